@@ -0,0 +1,160 @@
+"""
+Analysis statistics for dashboards
+Counts of analyses and abnormal results per user, test type and day are
+kept in summary tables (models.AnalysisSummary, models.AnalysisDailySummary)
+that are updated in the same transaction as each Analysis insert, so /stats
+never scans analyses or decodes raw_data.
+
+Usage:
+    python analysis_stats.py rebuild   # recompute the summary tables from analyses
+"""
+import json
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional
+from sqlalchemy.exc import IntegrityError
+from models import db, Analysis, AnalysisSummary, AnalysisDailySummary, GLOBAL_SUMMARY_USER
+from utils import AnalysisValidator
+
+logger = logging.getLogger(__name__)
+
+# Healthy vaginal pH range; anything outside it is reported as abnormal
+PH_NORMAL_RANGE = (3.8, 4.5)
+
+
+def is_abnormal(test_type: str, response: Dict[str, Any]) -> bool:
+    """Whether an analysis response (as stored in raw_data) is an abnormal result"""
+    if test_type == "fob":
+        return response.get("result") == "positive"
+    if test_type == "ph":
+        value = response.get("estimated_ph", response.get("pH"))
+        return value is not None and not PH_NORMAL_RANGE[0] <= value <= PH_NORMAL_RANGE[1]
+    if test_type == "urinalysis":
+        # Image analyses store per-pad dicts, video analyses store the bare result
+        results = {code: data if isinstance(data, dict) else {"result": data}
+                   for code, data in (response.get("results") or {}).items()}
+        findings = AnalysisValidator.assess_abnormality(results)
+        return bool(findings["critical"] or findings["warning"])
+    return False
+
+
+def _increment(model, keys: Dict[str, Any], abnormal: bool):
+    values = {model.total: model.total + 1, model.abnormal: model.abnormal + int(abnormal)}
+    if model.query.filter_by(**keys).update(values, synchronize_session=False):
+        return
+    try:
+        with db.session.begin_nested():
+            db.session.add(model(total=1, abnormal=int(abnormal), **keys))
+    except IntegrityError:
+        # A concurrent transaction created the row first
+        model.query.filter_by(**keys).update(values, synchronize_session=False)
+
+
+def record_analysis(analysis: Analysis, response: Dict[str, Any]):
+    """
+    Add one analysis to the summary tables.
+
+    Call after db.session.add(analysis) and before the commit, so the
+    counters and the analysis row are committed (or rolled back) together.
+    """
+    abnormal = is_abnormal(analysis.test_type, response)
+    day = (analysis.created_at or datetime.utcnow()).date()
+    for user_id in (analysis.user_id, GLOBAL_SUMMARY_USER):
+        _increment(AnalysisSummary, {"user_id": user_id, "test_type": analysis.test_type}, abnormal)
+        _increment(AnalysisDailySummary,
+                   {"user_id": user_id, "day": day, "test_type": analysis.test_type}, abnormal)
+
+
+def forget_user(user_id: int):
+    """
+    Drop a user's summary rows (on account deletion). The all-users rows
+    keep counting their analyses; they describe analyses performed.
+    """
+    AnalysisSummary.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    AnalysisDailySummary.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+
+
+def rebuild_summaries(batch_size: int = 1000) -> Dict[str, int]:
+    """
+    Recompute both summary tables from the analyses table in one transaction.
+
+    Returns:
+        Number of analyses read and summary rows written
+    """
+    totals = defaultdict(lambda: [0, 0])
+    daily = defaultdict(lambda: [0, 0])
+    count = 0
+
+    query = (Analysis.query
+             .options(db.load_only(Analysis.user_id, Analysis.test_type, Analysis.created_at,
+                                   Analysis.result, Analysis.raw_data))
+             .order_by(Analysis.id)
+             .yield_per(batch_size))
+    for analysis in query:
+        try:
+            response = json.loads(analysis.raw_data) if analysis.raw_data else {}
+        except ValueError:
+            response = {}
+        response.setdefault("result", analysis.result)
+        abnormal = int(is_abnormal(analysis.test_type, response))
+        day = (analysis.created_at or datetime.utcnow()).date()
+        for user_id in (analysis.user_id, GLOBAL_SUMMARY_USER):
+            for counts in (totals[(user_id, analysis.test_type)], daily[(user_id, day, analysis.test_type)]):
+                counts[0] += 1
+                counts[1] += abnormal
+        count += 1
+
+    try:
+        AnalysisSummary.query.delete()
+        AnalysisDailySummary.query.delete()
+        db.session.bulk_insert_mappings(AnalysisSummary, [
+            {"user_id": user_id, "test_type": test_type, "total": total, "abnormal": abnormal}
+            for (user_id, test_type), (total, abnormal) in totals.items()])
+        db.session.bulk_insert_mappings(AnalysisDailySummary, [
+            {"user_id": user_id, "day": day, "test_type": test_type, "total": total, "abnormal": abnormal}
+            for (user_id, day, test_type), (total, abnormal) in daily.items()])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    logger.info(f"Rebuilt analysis summaries from {count} analyses")
+    return {"analyses": count, "summary_rows": len(totals), "daily_rows": len(daily)}
+
+
+def get_stats(user_id: int, days: int = 30, today: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Rollup for one user (or GLOBAL_SUMMARY_USER) from the summary tables.
+
+    Reads at most one row per test type plus one per test type and day in
+    the window, however many analyses exist.
+    """
+    today = today or datetime.utcnow().date()
+    since = today - timedelta(days=days - 1)
+
+    by_test_type = {row.test_type: row.to_dict()
+                    for row in AnalysisSummary.query.filter_by(user_id=user_id)}
+    daily = (AnalysisDailySummary.query
+             .filter(AnalysisDailySummary.user_id == user_id, AnalysisDailySummary.day >= since)
+             .order_by(AnalysisDailySummary.day, AnalysisDailySummary.test_type))
+
+    return {
+        "total": sum(t["total"] for t in by_test_type.values()),
+        "abnormal": sum(t["abnormal"] for t in by_test_type.values()),
+        "by_test_type": by_test_type,
+        "daily": [row.to_dict() for row in daily],
+        "since": since.isoformat()
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    from app import app
+
+    parser = argparse.ArgumentParser(description="Maintain the analysis summary tables")
+    parser.add_argument("command", choices=["rebuild"], help="rebuild: recompute summaries from analyses")
+    args = parser.parse_args()
+
+    with app.app_context():
+        print(json.dumps(rebuild_summaries()))
@@ -0,0 +1,191 @@
+"""
+Write-behind persistence for analyses
+/analyze hands finished analyses to an in-process queue instead of
+committing on the request thread. A background writer group-commits them
+in small batches (with their summary-table updates) and drains the queue
+before the process exits.
+
+The provisional id each analysis was queued under is stored on its row
+(Analysis.request_id). Until then ``status`` reports it as pending, and a
+row that could not be written as failed.
+
+Rows still queued when the process is killed without a clean shutdown
+are lost; keep ANALYSIS_WRITE_BEHIND off where that is unacceptable.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from models import db, Analysis
+from analysis_stats import record_analysis
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 32
+FLUSH_INTERVAL = 0.05  # seconds the writer waits to fill a batch
+MAX_QUEUE = 1000
+FAILED_HISTORY = 1000  # failed provisional ids remembered for status()
+
+_STOP = object()
+
+# (provisional id, Analysis column values, analysis response)
+PendingAnalysis = Tuple[str, Dict[str, Any], Dict[str, Any]]
+
+
+class AnalysisWriter:
+    """Background group-committer of Analysis rows"""
+
+    def __init__(self, app, batch_size: int = BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL,
+                 max_queue: int = MAX_QUEUE):
+        self.app = app
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.stats = {"queued": 0, "rejected": 0, "written": 0, "batches": 0, "failed": 0}
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        # provisional id -> user id, until written or failed
+        self._pending: Dict[str, Any] = {}
+        self._failed: "OrderedDict[str, Any]" = OrderedDict()
+        self._closed = False
+        self._lock = threading.Lock()
+        self._worker = threading.Thread(target=self._run, name="analysis-writer", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def submit(self, provisional_id: str, fields: Dict[str, Any], response: Dict[str, Any]) -> bool:
+        """
+        Queue an analysis for writing.
+
+        Returns:
+            False if the writer is closed or the queue is full; the caller
+            should then write the row itself
+        """
+        with self._lock:
+            if self._closed:
+                return False
+            try:
+                self._queue.put_nowait((provisional_id, fields, response))
+            except queue.Full:
+                self.stats["rejected"] += 1
+                return False
+            self.stats["queued"] += 1
+            self._pending[provisional_id] = fields.get("user_id")
+            return True
+
+    def status(self, provisional_id: str, user_id: Any = None) -> Optional[str]:
+        """
+        "pending" while ``user_id``'s analysis is queued, "failed" if it could
+        not be written, otherwise None (written, or never queued here)
+        """
+        with self._lock:
+            if provisional_id in self._pending:
+                return "pending" if self._pending[provisional_id] == user_id else None
+            if provisional_id in self._failed:
+                return "failed" if self._failed[provisional_id] == user_id else None
+        return None
+
+    def flush(self):
+        """Block until every analysis queued so far has been written (or has failed)"""
+        self._queue.join()
+
+    def close(self, timeout: float = 30.0):
+        """Stop accepting analyses and write everything still queued"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        # Blocking put: a full queue still gets the stop marker once the writer catches up
+        self._queue.put(_STOP)
+        self._worker.join(timeout)
+        if self._worker.is_alive():
+            logger.error(f"Analysis writer did not drain within {timeout}s; "
+                         f"{self._queue.qsize()} queued analyses may be lost")
+
+    # ---------------------- Worker ----------------------
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            batch: List[PendingAnalysis] = [item]
+
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    # Once stopping, take whatever is left without waiting
+                    if stopping or remaining <= 0:
+                        item = self._queue.get_nowait()
+                    else:
+                        item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    continue
+                batch.append(item)
+
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, batch: List[PendingAnalysis]):
+        with self.app.app_context():
+            try:
+                self._add(batch)
+                db.session.commit()
+                self.stats["written"] += len(batch)
+                self.stats["batches"] += 1
+                self._settle(batch)
+                return
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Batch of {len(batch)} analyses failed ({str(e)}); retrying one by one")
+
+            # One bad row must not lose the rest of the batch
+            for item in batch:
+                try:
+                    self._add([item])
+                    db.session.commit()
+                    self.stats["written"] += 1
+                    self._settle([item])
+                except Exception as e:
+                    db.session.rollback()
+                    self.stats["failed"] += 1
+                    self._settle([item], failed=True)
+                    logger.error(f"Failed to save analysis {item[0]}: {str(e)}")
+
+    def _settle(self, batch: List[PendingAnalysis], failed: bool = False):
+        with self._lock:
+            for provisional_id, _, _ in batch:
+                user_id = self._pending.pop(provisional_id, None)
+                if failed:
+                    self._failed[provisional_id] = user_id
+                    if len(self._failed) > FAILED_HISTORY:
+                        self._failed.popitem(last=False)
+
+    @staticmethod
+    def _add(batch: List[PendingAnalysis]):
+        for _, fields, response in batch:
+            analysis = Analysis(**fields)
+            db.session.add(analysis)
+            record_analysis(analysis, response)
+
+
+def create_writer(app) -> Optional[AnalysisWriter]:
+    """AnalysisWriter configured from app.config, or None when write-behind is off"""
+    if not app.config.get("ANALYSIS_WRITE_BEHIND", False):
+        return None
+    return AnalysisWriter(
+        app,
+        batch_size=app.config.get("ANALYSIS_WRITE_BEHIND_BATCH_SIZE", BATCH_SIZE),
+        flush_interval=app.config.get("ANALYSIS_WRITE_BEHIND_INTERVAL", FLUSH_INTERVAL),
+        max_queue=app.config.get("ANALYSIS_WRITE_BEHIND_MAX_QUEUE", MAX_QUEUE)
+    )
@@ -1,14 +1,32 @@
-from flask import Flask, request, render_template, jsonify, send_from_directory
+from flask import Flask, request, render_template, jsonify, send_from_directory, send_file, Response
 from werkzeug.utils import secure_filename
 import os
 import uuid
 import logging
 import json
+import base64
+import binascii
+import hashlib
+import math
 from datetime import datetime
+from functools import wraps
 from config import get_config
 from utils import validate_image_quality, validate_file_extension, safe_file_cleanup, AnalysisValidator, validate_email
-from models import db, User, Analysis
-from auth import generate_token, token_required, optional_token
+from models import db, User, Analysis, GLOBAL_SUMMARY_USER
+from database import engine_options, configure_engine
+from migrations import upgrade as upgrade_schema
+from analysis_stats import record_analysis, forget_user, get_stats
+from analysis_writer import create_writer
+from auth import generate_token, token_required, optional_token, user_cache, PasswordHasher, PasswordHasherBusy
+from video_analysis import analyze_video
+from live_stream import StreamRegistry, TooManyStreams, decode_frame
+from static_assets import load_assets, DEFAULT_BUILD_DIR, IMMUTABLE_MAX_AGE
+from json_responses import NumpyJSONProvider, compress_response, dumps as dumps_json
+from result_encoder import create_encoder
+from response_fields import requested_fields, select_fields, wants
+from log_events import configure_logging, log_event
+from rate_limit import create_rate_limiter
+from imaging import DEFAULT_RENDITIONS, FULL_RENDITION, RENDITION_FORMATS, rendition_filename, renditions_from_config
 
 # Wrap imports in try-catch for better error handling
 try:
@@ -17,7 +35,8 @@ try:
 except ImportError as e:
     print(f"❌ FOB analyzer import failed: {e}")
     # Create dummy function for FOB
-    def analyze_fob(image_path, templates_dir="templates", debug=False, result_folder="result_images", analysis_id=None):
+    def analyze_fob(image_path, templates_dir="templates", debug=False, result_folder="result_images", analysis_id=None,
+                    renditions=None, encoder=None):
         return {
             "status": "success",
             "result": "Demo result - FOB analyzer not available",
@@ -26,18 +45,20 @@ except ImportError as e:
         }
 
 try:
-    from ph_strip_analyzer import PHStripAnalyzer
+    from ph_strip_analyzer import PHStripAnalyzer, CalibrationSessions
     print("✅ pH Strip analyzer imported successfully")
     REAL_PH_ANALYZER = True
 except ImportError as e:
     print(f"❌ pH Strip analyzer import failed: {e}")
     REAL_PH_ANALYZER = False
+    CalibrationSessions = None
     # Create dummy class for pH
     class PHStripAnalyzer:
         def __init__(self, debug=False):
             self.debug = debug
             
-        def analyze_ph_strip(self, image_path, debug=False, result_folder="result_images", analysis_id=None):
+        def analyze_ph_strip(self, image_path, debug=False, result_folder="result_images", analysis_id=None,
+                             renditions=None, encoder=None):
             print("⚠️ Using dummy pH analyzer - real analyzer not available")
             # Return a pH value in the normal range for demo purposes
             return {
@@ -58,7 +79,8 @@ except ImportError as e:
     print(f"❌ Urinalysis analyzer import failed: {e}")
     REAL_URINALYSIS_ANALYZER = False
     # Create dummy function for urinalysis
-    def analyze_urinalysis(image_path, debug=False, result_folder="result_images", analysis_id=None, k=3):
+    def analyze_urinalysis(image_path, debug=False, result_folder="result_images", analysis_id=None, k=3,
+                           renditions=None, encoder=None, explain=True):
         print("⚠️ Using dummy urinalysis analyzer - real analyzer not available")
         return {
             "success": True,
@@ -71,6 +93,8 @@ except ImportError as e:
         }
 
 app = Flask(__name__, template_folder='templates', static_folder='static')
+# jsonify accepts NumPy scalars and arrays from the analyzers
+app.json = NumpyJSONProvider(app)
 
 # Load configuration based on environment
 env = os.environ.get("FLASK_ENV", "production")
@@ -88,47 +112,209 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///rapidtest.db'
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'], app.config)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
 
 # Initialize database
 db.init_app(app)
 
-# Create database tables
+# Create database tables and apply schema migrations to existing databases
 with app.app_context():
+    configure_engine(db.engine)
     db.create_all()
+    upgrade_schema(db.engine)
     print("✅ Database initialized")
 
 # Configure Flask for memory optimization
 UPLOAD_FOLDER = app.config['UPLOAD_FOLDER']
 RESULT_IMAGES_FOLDER = app.config['RESULT_IMAGES_FOLDER']
 ALLOWED_EXTENSIONS = app.config['ALLOWED_EXTENSIONS']
+ALLOWED_VIDEO_EXTENSIONS = app.config['ALLOWED_VIDEO_EXTENSIONS']
+
+# pH colour-card calibrations reused across strips
+ph_calibrations = CalibrationSessions(
+    ttl=app.config.get('PH_CALIBRATION_TTL', 1800)
+) if CalibrationSessions else None
+
+# Open live camera streams (kiosk mode)
+live_streams = StreamRegistry(
+    max_streams=app.config.get('LIVE_STREAM_MAX_STREAMS', 32),
+    idle_timeout=app.config.get('LIVE_STREAM_IDLE_TIMEOUT', 120),
+    analysis_slots=app.config.get('LIVE_STREAM_ANALYSIS_SLOTS', 2),
+    max_per_client=app.config.get('LIVE_STREAM_MAX_PER_CLIENT', 2)
+)
+
+# Users looked up by the auth decorators
+user_cache.max_size = app.config.get('USER_CACHE_SIZE', 1024)
+user_cache.ttl = app.config.get('USER_CACHE_TTL', 30)
+
+# Password KDF calls are bounded, with a fast 503 once the queue is full
+password_hasher = PasswordHasher(
+    workers=app.config.get('PASSWORD_HASH_WORKERS', 1),
+    max_queue=app.config.get('PASSWORD_HASH_MAX_QUEUE', 1),
+    timeout=app.config.get('PASSWORD_HASH_TIMEOUT', 5.0)
+)
+
+# Sizes and encoders of saved result images (thumbnail + full by default)
+RESULT_RENDITIONS = renditions_from_config(
+    app.config.get('RESULT_IMAGE_RENDITIONS', [r._asdict() for r in DEFAULT_RENDITIONS])
+)
+RESULT_RENDITION_NAMES = {r.name: r for r in RESULT_RENDITIONS}
+
+# Background queue that encodes result images after /analyze responds (None: encode inline)
+result_encoder = create_encoder(app)
+
+# Optional write-behind queue for Analysis rows (None: commit on the request thread)
+analysis_writer = create_writer(app)
+
+# Precompressed, fingerprinted copies of static/ and frontend/ (rebuilt when sources change)
+static_assets = load_assets(
+    app.config.get('STATIC_ASSET_BUILD_DIR', DEFAULT_BUILD_DIR)
+) if app.config.get('STATIC_ASSETS_PRECOMPRESSED', True) else None
 
 # Create folders
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULT_IMAGES_FOLDER, exist_ok=True)
 
 logging.basicConfig(level=logging.INFO)
+configure_logging(app.config)
 logger = logging.getLogger(__name__)
 
-# Initialize rate limiter if enabled
-if app.config.get('RATE_LIMIT_ENABLED', False):
+# Token buckets for the analysis endpoints, per user and per anonymous IP
+# (checked only while RATE_LIMIT_ENABLED is set)
+rate_limiter = create_rate_limiter(app.config)
+
+def client_ip():
+    """Client address, taken from X-Forwarded-For behind RATE_LIMIT_TRUSTED_PROXIES proxies"""
+    trusted = app.config.get('RATE_LIMIT_TRUSTED_PROXIES', 0)
+    forwarded = request.headers.getlist('X-Forwarded-For')
+    if trusted and forwarded:
+        route = [addr.strip() for value in forwarded for addr in value.split(',')]
+        return route[max(0, len(route) - trusted)]
+    return request.remote_addr
+
+def rate_limited(f):
+    """
+    Charge the request's cost (RATE_LIMIT_COSTS by endpoint and test type)
+    to the user's bucket, or the client IP's when anonymous; 429 with
+    Retry-After once it is empty. Goes below @optional_token.
+    """
+    @wraps(f)
+    def decorated(current_user, *args, **kwargs):
+        if app.config.get('RATE_LIMIT_ENABLED', False):
+            retry_after = rate_limiter.check(current_user.id if current_user else None, client_ip(),
+                                             request.endpoint, request.form.get('test_type'))
+            if retry_after:
+                response = jsonify({'error': 'Too many requests, please slow down'})
+                response.status_code = 429
+                response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+                return response
+        return f(current_user, *args, **kwargs)
+    
+    return decorated
+
+def password_hasher_busy():
+    """Fast 503 for auth requests when the password hashing queue is full"""
+    response = jsonify({'error': 'Server busy, please try again shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
+def save_analysis(current_user, response, **fields):
+    """
+    Persist an analysis for current_user and mark ``response`` accordingly.
+    
+    ``request_id`` is the provisional id the analysis ran under; it is
+    stored on the row. With write-behind enabled the row is only queued:
+    ``saved`` is "pending", ``analysis_id`` is None and the client resolves
+    the row later with /history/pending/<request_id>. Otherwise, or when the
+    queue is full, the row and its summary counters are committed here and
+    ``analysis_id`` is the row id.
+    """
+    request_id = response['analysis_id']
+    fields.update(user_id=current_user.id, raw_data=dumps_json(response), created_at=datetime.utcnow(),
+                  request_id=request_id)
+    response['request_id'] = request_id
+    if analysis_writer and analysis_writer.submit(request_id, fields, response):
+        response['saved'] = 'pending'
+        response['pending'] = True
+        response['analysis_id'] = None
+        return
+    
     try:
-        from flask_limiter import Limiter
-        from flask_limiter.util import get_remote_address
-        
-        limiter = Limiter(
-            app=app,
-            key_func=get_remote_address,
-            default_limits=[f"{app.config.get('RATE_LIMIT_PER_MINUTE', 10)} per minute"],
-            storage_uri="memory://"
-        )
-        logger.info("Rate limiting enabled")
-    except ImportError:
-        logger.warning("flask-limiter not installed. Rate limiting disabled.")
-        limiter = None
-else:
-    limiter = None
-    logger.info("Rate limiting disabled (development mode)")
+        analysis = Analysis(**fields)
+        db.session.add(analysis)
+        record_analysis(analysis, response)
+        db.session.commit()
+        response['saved'] = True
+        response['analysis_id'] = analysis.id
+        logger.info(f"Analysis saved to database for user {current_user.username}")
+    except Exception as e:
+        logger.error(f"Failed to save analysis to database: {str(e)}")
+        db.session.rollback()
+        # Don't fail the request if save fails
+        response['saved'] = False
+
+def attach_renditions(response, result):
+    """Copy the analyzer's result image renditions (name -> path) into ``response``"""
+    paths = result.get("result_renditions")
+    if paths:
+        response["result_renditions"] = paths
+
+def inline_thumbnail(response):
+    """
+    Embed the smallest rendition in ``response`` as a data URI
+    (``result_thumbnail``) if it fits RESULT_INLINE_MAX_BYTES, saving the
+    client a round trip for the preview. Called after the analysis is
+    saved so the encoded image does not bloat raw_data.
+    """
+    paths = response.get("result_renditions") or {}
+    sized = [r for r in RESULT_RENDITIONS if r.name in paths and r.name != FULL_RENDITION and r.max_dim]
+    if not sized:
+        return
+    thumb = min(sized, key=lambda r: r.max_dim)
+    if result_encoder:
+        result_encoder.wait(paths[thumb.name], app.config.get('RESULT_ENCODE_WAIT', 2.0))
+    try:
+        if os.path.getsize(paths[thumb.name]) > app.config.get('RESULT_INLINE_MAX_BYTES', 16 * 1024):
+            return
+        with open(paths[thumb.name], 'rb') as f:
+            data = base64.b64encode(f.read()).decode('ascii')
+    except OSError as e:
+        logger.warning(f"Could not inline thumbnail: {str(e)}")
+        return
+    response["result_thumbnail"] = f"data:{RENDITION_FORMATS[thumb.format][2]};base64,{data}"
+
+def wants_inline_thumbnail():
+    """inline_thumbnail form/query flag, defaulting to RESULT_INLINE_THUMBNAIL"""
+    flag = request.values.get('inline_thumbnail')
+    if flag is None:
+        return app.config.get('RESULT_INLINE_THUMBNAIL', False)
+    return flag.lower() in ('1', 'true', 'yes')
+
+def send_asset(prefix, folder, filename):
+    """
+    Serve a static or frontend file from the asset build: the brotli or
+    gzip variant the client accepts, cached for a year when the name is
+    fingerprinted and revalidated otherwise. Falls back to the source
+    folder for files the build does not know.
+    """
+    entry = static_assets.lookup(prefix, filename) if static_assets else None
+    if entry is None:
+        return send_from_directory(folder, filename)
+    
+    path, encoding = static_assets.choose(entry, request.accept_encodings)
+    response = send_file(path, mimetype=entry['mimetype'], conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if entry['encodings']:
+        response.vary.add('Accept-Encoding')
+    if entry['immutable']:
+        response.cache_control.public = True
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
 
 def allowed_file(filename):
     """Check if file extension is allowed"""
@@ -142,7 +328,7 @@ def home():
 # Custom loading/splash screen
 @app.route("/loading")
 def loading():
-    return send_from_directory('static', 'loading.html')
+    return send_asset('static', 'static', 'loading.html')
 
 # Health check endpoint for deployment platforms
 @app.route("/health")
@@ -151,25 +337,49 @@ def health():
         "status": "healthy",
         "service": "rapid-test-analyzer",
         "version": "1.0.0",
-        "timestamp": datetime.utcnow().isoformat()
+        "timestamp": datetime.utcnow().isoformat(),
+        "user_cache": user_cache.snapshot(),
+        "password_hasher": dict(password_hasher.stats),
+        "analysis_writer": dict(analysis_writer.stats) if analysis_writer else None,
+        "result_encoder": result_encoder.metrics() if result_encoder else None,
+        "rate_limiter": rate_limiter.snapshot() if app.config.get('RATE_LIMIT_ENABLED', False) else None
     }), 200
 
 # Serve static files (CSS, JS, images)
 @app.route('/static/<path:filename>')
 def serve_sample_images(filename):
-    return send_from_directory('static', filename)
+    return send_asset('static', 'static', filename)
 
 # Serve result images
 @app.route('/result_images/<path:filename>')
 def serve_result_images(filename):
-    return send_from_directory('result_images', filename)
+    # ?size=thumb (or any configured rendition) serves that rendition of the image
+    size = request.args.get('size')
+    if size:
+        rendition = RESULT_RENDITION_NAMES.get(size)
+        if rendition is None:
+            return jsonify({"error": f"Unknown size. Available: {', '.join(RESULT_RENDITION_NAMES)}"}), 400
+        filename = rendition_filename(filename, rendition)
+    if result_encoder:
+        # The image may still be encoding in the background; wait briefly instead of a 404
+        result_encoder.wait(os.path.join(RESULT_IMAGES_FOLDER, filename),
+                            app.config.get('RESULT_ENCODE_WAIT', 2.0))
+    # Names contain the unique analysis id and files are never rewritten,
+    # so browsers may keep them for a year without revalidating. Private:
+    # these are medical images, not for shared caches.
+    response = send_from_directory(RESULT_IMAGES_FOLDER, filename,
+                                   max_age=app.config.get('RESULT_IMAGE_MAX_AGE', 31536000))
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
 
 # Serve frontend files (JS, CSS, HTML from frontend folder)
 @app.route('/<path:filename>')
 def serve_frontend_files(filename):
     # Serve JS, CSS, and HTML files from frontend
     if filename.endswith(('.js', '.css', '.html')):
-        return send_from_directory('frontend', filename)
+        return send_asset('frontend', 'frontend', filename)
     return "File not found", 404
 
 # Add CORS headers for local development
@@ -178,7 +388,8 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', '*')
     response.headers.add('Access-Control-Allow-Headers', 'Content-Type,Authorization')
     response.headers.add('Access-Control-Allow-Methods', 'GET,PUT,POST,DELETE,OPTIONS')
-    return response
+    return compress_response(response, request.accept_encodings,
+                             min_size=app.config.get('JSON_COMPRESS_MIN_SIZE', 1024))
 
 # ============================================
 # AUTHENTICATION ROUTES
@@ -228,7 +439,7 @@ def register():
         
         # Create new user
         user = User(username=username, email=email)
-        user.set_password(password)
+        user.password_hash = password_hasher.hash_password(password)
         
         # Auto-verify users since email sending is not implemented yet
         user.email_verified = True
@@ -248,6 +459,10 @@ def register():
             'user': user.to_dict()
         }), 201
         
+    except PasswordHasherBusy as e:
+        db.session.rollback()
+        logger.warning(f"Registration rejected: {str(e)}")
+        return password_hasher_busy()
     except Exception as e:
         db.session.rollback()
         logger.error(f"Registration error: {str(e)}")
@@ -276,7 +491,7 @@ def login():
         # Find user
         user = User.query.filter_by(email=email).first()
         
-        if not user or not user.check_password(password):
+        if not user or not password_hasher.verify_password(user.password_hash, password):
             return jsonify({'error': 'Invalid email or password'}), 401
         
         # Email verification check disabled for now (email sending not implemented)
@@ -290,6 +505,7 @@ def login():
         # Update last login
         user.last_login = datetime.utcnow()
         db.session.commit()
+        user_cache.invalidate(user.id)
         
         # Generate JWT token
         token = generate_token(user.id, user.username, user.email)
@@ -302,6 +518,10 @@ def login():
             'user': user.to_dict()
         }), 200
         
+    except PasswordHasherBusy as e:
+        db.session.rollback()
+        logger.warning(f"Login rejected: {str(e)}")
+        return password_hasher_busy()
     except Exception as e:
         logger.error(f"Login error: {str(e)}")
         return jsonify({'error': 'Login failed'}), 500
@@ -336,6 +556,7 @@ def verify_email(token):
         user.email_verified = True
         user.verification_token = None  # Clear the token after use
         db.session.commit()
+        user_cache.invalidate(user.id)
         
         logger.info(f"Email verified for user: {user.username}")
         
@@ -407,41 +628,195 @@ def resend_verification():
 @app.route("/profile", methods=["GET"])
 @token_required
 def get_profile(current_user):
-    """Get current user's profile (protected route)"""
-    return jsonify({
+    """Get current user's profile (protected route); supports conditional GET"""
+    response = jsonify({
         'success': True,
         'user': current_user.to_dict()
-    }), 200
+    })
+    response.add_etag(weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def encode_history_cursor(analysis):
+    """Opaque keyset cursor pointing just past ``analysis`` in newest-first order"""
+    payload = json.dumps({'c': analysis.created_at.isoformat(), 'i': analysis.id}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def history_etag(user_id, *params):
+    """
+    Weak ETag for a history page: the user's analysis count and newest
+    created_at plus the page parameters. Rows are never edited, so any
+    insert or delete changes it. Costs one aggregate over the user's index.
+    """
+    count, latest = db.session.query(
+        db.func.count(Analysis.id), db.func.max(Analysis.created_at)
+    ).filter(Analysis.user_id == user_id).one()
+    key = json.dumps([user_id, count, latest.isoformat() if latest else None, *params])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def not_modified(etag):
+    """304 response carrying the weak ETag"""
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+def decode_history_cursor(cursor):
+    """Return (created_at, id) from a cursor; raises ValueError if malformed"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        return datetime.fromisoformat(data['c']), int(data['i'])
+    except (TypeError, KeyError, binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
 
 @app.route("/history", methods=["GET"])
 @token_required
 def get_history(current_user):
     """
-    Get user's analysis history
+    Get user's analysis history, newest first, one page at a time
     Query params:
-        - limit: Number of results (default 50)
+        - limit: Page size (default 50, capped at HISTORY_MAX_PAGE_SIZE)
         - test_type: Filter by test type (optional)
+        - cursor: next_cursor from the previous page (optional)
+    
+    Pages are keyset-paginated on (created_at, id), so each page is a
+    bounded range scan of the (user_id, test_type, created_at) index no
+    matter how deep into the history it is.
     """
     try:
-        limit = request.args.get('limit', 50, type=int)
+        max_page_size = app.config.get('HISTORY_MAX_PAGE_SIZE', 100)
+        limit = request.args.get('limit', app.config.get('HISTORY_PAGE_SIZE', 50), type=int)
+        limit = max(1, min(limit, max_page_size))
         test_type = request.args.get('test_type')
+        cursor = request.args.get('cursor')
+        
+        # Conditional GET: answer 304 before loading or serializing any row
+        etag = history_etag(current_user.id, limit, test_type, cursor)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
         
         query = Analysis.query.filter_by(user_id=current_user.id)
         
         if test_type:
             query = query.filter_by(test_type=test_type)
+
+        if cursor:
+            try:
+                cursor_created_at, cursor_id = decode_history_cursor(cursor)
+            except ValueError:
+                return jsonify({'error': 'Invalid cursor'}), 400
+            query = query.filter(db.or_(
+                Analysis.created_at < cursor_created_at,
+                db.and_(Analysis.created_at == cursor_created_at, Analysis.id < cursor_id)
+            ))
+        
+        # One extra row tells us whether another page exists
+        analyses = query.order_by(Analysis.created_at.desc(), Analysis.id.desc()).limit(limit + 1).all()
+        has_more = len(analyses) > limit
+        analyses = analyses[:limit]
+        
+        response = jsonify({
+            'success': True,
+            'count': len(analyses),
+            'analyses': [a.to_dict() for a in analyses],
+            'limit': limit,
+            'next_cursor': encode_history_cursor(analyses[-1]) if has_more else None
+        })
+        response.set_etag(etag, weak=True)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response, 200
         
-        analyses = query.order_by(Analysis.created_at.desc()).limit(limit).all()
+    except Exception as e:
+        logger.error(f"History fetch error: {str(e)}")
+        return jsonify({'error': 'Failed to fetch history'}), 500
+
+@app.route("/history/<int:analysis_id>", methods=["GET"])
+@token_required
+def get_history_detail(current_user, analysis_id):
+    """
+    Get one analysis with its full stored response (raw_data)
+    
+    raw_data is deferred on list queries; only this endpoint loads and
+    parses it.
+    """
+    try:
+        analysis = Analysis.query.options(db.undefer(Analysis.raw_data)).filter_by(
+            id=analysis_id, user_id=current_user.id
+        ).first()
+        if analysis is None:
+            return jsonify({'error': 'Analysis not found'}), 404
         
         return jsonify({
             'success': True,
-            'count': len(analyses),
-            'analyses': [a.to_dict() for a in analyses]
+            'analysis': analysis.to_dict(include_details=True)
         }), 200
         
     except Exception as e:
-        logger.error(f"History fetch error: {str(e)}")
-        return jsonify({'error': 'Failed to fetch history'}), 500
+        logger.error(f"History detail fetch error: {str(e)}")
+        return jsonify({'error': 'Failed to fetch analysis'}), 500
+
+@app.route("/history/pending/<request_id>", methods=["GET"])
+@token_required
+def get_pending_analysis(current_user, request_id):
+    """
+    Resolve the ``request_id`` of a saved analysis to its row.
+    
+    Returns:
+        200 with the analysis once it is written, 202 while write-behind
+        still has it queued, 500 if it could not be saved, 404 otherwise
+    """
+    try:
+        analysis = Analysis.query.options(db.undefer(Analysis.raw_data)).filter_by(
+            request_id=request_id, user_id=current_user.id
+        ).first()
+        if analysis is not None:
+            return jsonify({
+                'success': True,
+                'saved': True,
+                'analysis': analysis.to_dict(include_details=True)
+            }), 200
+        
+        status = analysis_writer.status(request_id, current_user.id) if analysis_writer else None
+        if status == 'pending':
+            return jsonify({'success': True, 'saved': 'pending'}), 202
+        if status == 'failed':
+            return jsonify({'success': False, 'saved': False, 'error': 'Analysis could not be saved'}), 500
+        return jsonify({'error': 'Analysis not found'}), 404
+        
+    except Exception as e:
+        logger.error(f"Pending analysis lookup error: {str(e)}")
+        return jsonify({'error': 'Failed to fetch analysis'}), 500
+
+@app.route("/stats", methods=["GET"])
+@token_required
+def get_analysis_stats(current_user):
+    """
+    Analysis counts for the current user and across all users
+    
+    Served from the summary tables maintained on each analysis insert.
+    
+    Query parameters:
+        - days: Length of the daily series ending today (default 30)
+    """
+    try:
+        max_days = app.config.get('STATS_MAX_DAYS', 366)
+        days = request.args.get('days', app.config.get('STATS_DEFAULT_DAYS', 30), type=int)
+        days = max(1, min(days, max_days))
+        
+        return jsonify({
+            'success': True,
+            'days': days,
+            'user': get_stats(current_user.id, days),
+            'global': get_stats(GLOBAL_SUMMARY_USER, days)
+        }), 200
+        
+    except Exception as e:
+        logger.error(f"Stats fetch error: {str(e)}")
+        return jsonify({'error': 'Failed to fetch stats'}), 500
 
 @app.route("/update-profile", methods=["POST"])
 @token_required
@@ -488,6 +863,7 @@ def update_profile(current_user):
             current_user.email = email
         
         db.session.commit()
+        user_cache.invalidate(current_user.id)
         logger.info(f"Profile updated for user: {current_user.username}")
         
         return jsonify({
@@ -523,7 +899,7 @@ def change_password(current_user):
         new_password = data['new_password']
         
         # Verify current password
-        if not current_user.check_password(current_password):
+        if not password_hasher.verify_password(current_user.password_hash, current_password):
             return jsonify({'error': 'Current password is incorrect'}), 401
         
         # Validate new password
@@ -531,8 +907,9 @@ def change_password(current_user):
             return jsonify({'error': 'New password must be at least 6 characters'}), 400
         
         # Update password
-        current_user.set_password(new_password)
+        current_user.password_hash = password_hasher.hash_password(new_password)
         db.session.commit()
+        user_cache.invalidate(current_user.id)
         
         logger.info(f"Password changed for user: {current_user.username}")
         
@@ -541,6 +918,10 @@ def change_password(current_user):
             'message': 'Password changed successfully'
         }), 200
         
+    except PasswordHasherBusy as e:
+        db.session.rollback()
+        logger.warning(f"Password change rejected: {str(e)}")
+        return password_hasher_busy()
     except Exception as e:
         db.session.rollback()
         logger.error(f"Password change error: {str(e)}")
@@ -554,10 +935,13 @@ def delete_account(current_user):
     """
     try:
         username = current_user.username
+        user_id = current_user.id
         
-        # Delete user (cascade will delete all analyses)
+        # Delete user (cascade will delete all analyses) and their summary rows
+        forget_user(user_id)
         db.session.delete(current_user)
         db.session.commit()
+        user_cache.invalidate(user_id)
         
         logger.info(f"Account deleted: {username}")
         
@@ -578,6 +962,7 @@ def delete_account(current_user):
 # API endpoint for analysis - now with optional authentication
 @app.route("/analyze", methods=["POST"])
 @optional_token
+@rate_limited
 def analyze(current_user):
     """
     Analyze uploaded medical test image.
@@ -585,6 +970,8 @@ def analyze(current_user):
     Accepts POST request with:
     - image: File upload (PNG, JPG, JPEG, GIF, BMP)
     - test_type: String ('ph', 'fob', 'urinalysis')
+    - fields: Optional comma-separated keys to return, e.g. "result,results.confidence"
+    - profile: Optional "compact" for a predefined minimal fieldset per test type
     
     Returns:
         JSON response with analysis results or error message
@@ -604,6 +991,12 @@ def analyze(current_user):
     if not test_type or test_type not in ["ph", "fob", "urinalysis"]:
         return jsonify({"error": "Invalid test type. Must be 'ph', 'fob', or 'urinalysis'"}), 400
 
+    # Sparse response: fields=a,b.c or profile=compact (default: everything)
+    try:
+        fields = requested_fields(test_type, request.values.get("fields"), request.values.get("profile"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     if not allowed_file(image_file.filename):
         return jsonify({"error": f"Invalid file type. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
 
@@ -633,10 +1026,14 @@ def analyze(current_user):
                 image_path=image_path,
                 debug=False,  # Don't show debug windows in web app
                 result_folder=RESULT_IMAGES_FOLDER,
-                analysis_id=analysis_id
+                analysis_id=analysis_id,
+                renditions=RESULT_RENDITIONS,
+                encoder=result_encoder
             )
             
-            logger.info(f"FOB analysis result: {result}")
+            log_event(logger, "analysis.result", test_type="fob", analysis_id=analysis_id,
+                      status=result.get("status"), result=result.get("result"), method=result.get("method"),
+                      score=result.get("template_best_score"))
             
             if result["status"] == "error":
                 logger.error(f"FOB analysis failed: {result['message']}")
@@ -653,25 +1050,53 @@ def analyze(current_user):
             }
             
         elif test_type == "ph":
-            logger.info(f"pH analysis starting. Real analyzer available: {REAL_PH_ANALYZER}")
             analyzer = PHStripAnalyzer(debug=False)
-            logger.info(f"PHStripAnalyzer created successfully")
-            
+
+            # Optional calibration session: reuse the colour card fitted on an earlier image
+            calibration_id = request.form.get("calibration_id")
+            owner = current_user.id if current_user else None
+            calibration = None
+            if calibration_id:
+                calibration = ph_calibrations.get(calibration_id, owner) if ph_calibrations else None
+                if calibration is None:
+                    return jsonify({"error": "Calibration session not found or expired"}), 404
+
+            ph_kwargs = {"calibration": calibration} if calibration is not None else {}
             result = analyzer.analyze_ph_strip(
                 image_path,
                 debug=False,
                 result_folder=RESULT_IMAGES_FOLDER,
-                analysis_id=analysis_id
+                analysis_id=analysis_id,
+                renditions=RESULT_RENDITIONS,
+                encoder=result_encoder,
+                **ph_kwargs
             )
             
-            logger.info(f"pH analysis result: {result}")
+            log_event(logger, "analysis.result", test_type="ph", analysis_id=analysis_id,
+                      real_analyzer=REAL_PH_ANALYZER, success=result.get("success"),
+                      ph=result.get("estimated_ph"), distance=result.get("min_distance_to_reference"),
+                      references=result.get("detected_reference_patches_count"), calibrated=result.get("calibrated"))
             
             if not result["success"]:
                 logger.error(f"pH analysis failed: {result.get('error', 'Unknown error')}")
                 return jsonify({"error": result.get("error", "pH analysis failed")}), 500
 
+            calibration_info = None
+            if calibration_id:
+                calibration_info = {"session_id": calibration_id, "status": "used"}
+                if result.get("calibration_drift"):
+                    # Lighting changed: the cached card no longer applies
+                    ph_calibrations.invalidate(calibration_id)
+                    calibration_info = {"session_id": calibration_id, "status": "invalidated",
+                                        "drift": result.get("drift")}
+            if request.form.get("calibrate") in ("1", "true", "yes") and ph_calibrations:
+                new_calibration = getattr(analyzer, "calibration", None)
+                if new_calibration is not None and (calibration_info is None
+                                                    or calibration_info["status"] == "invalidated"):
+                    calibration_info = {"session_id": ph_calibrations.create(new_calibration, owner),
+                                        "status": "created"}
+
             ph_value = result["estimated_ph"]
-            logger.info(f"Estimated pH value: {ph_value}")
             
             # Vaginal pH Test Medical Interpretation
             # Normal vaginal pH: 3.8-4.5 (healthy acidic environment)
@@ -711,20 +1136,25 @@ def analyze(current_user):
                 "result_images": result.get("result_images", []),
                 "analysis_id": analysis_id
             }
+            if calibration_info:
+                response["calibration"] = calibration_info
 
         elif test_type == "urinalysis":
-            logger.info(f"Urinalysis analysis starting. Real analyzer available: {REAL_URINALYSIS_ANALYZER}")
-            
             result = analyze_urinalysis(
                 image_path=image_path,
-                debug=True,  # Enable debug to see what's happening
+                debug=False,
                 result_folder=RESULT_IMAGES_FOLDER,
                 analysis_id=analysis_id,
-                k=3  # KNN parameter
+                k=3,  # KNN parameter
+                renditions=RESULT_RENDITIONS,
+                encoder=result_encoder,
+                explain=wants(fields, "results", "explanation")
             )
             
-            logger.info(f"Urinalysis analysis result: {result}")
-            logger.info(f"Results dict: {result.get('results', {})}")
+            log_event(logger, "analysis.result", test_type="urinalysis", analysis_id=analysis_id,
+                      real_analyzer=REAL_URINALYSIS_ANALYZER, success=result.get("success"),
+                      pads=result.get("pads_detected"),
+                      results={code: pad.get("result") for code, pad in result.get("results", {}).items()})
             
             if not result.get("success", False):
                 logger.error(f"Urinalysis analysis failed: {result.get('error', 'Unknown error')}")
@@ -765,30 +1195,22 @@ def analyze(current_user):
                 "analysis_id": analysis_id
             }
 
+        attach_renditions(response, result)
+
         # Save analysis to database if user is authenticated
         if current_user:
-            try:
-                analysis = Analysis(
-                    user_id=current_user.id,
-                    test_type=test_type,
-                    result=response.get('result') or response.get('diagnosis', ''),
-                    diagnosis=response.get('diagnosis', ''),
-                    image_path=image_path,
-                    confidence=response.get('confidence'),
-                    raw_data=json.dumps(response)
-                )
-                db.session.add(analysis)
-                db.session.commit()
-                response['saved'] = True
-                response['analysis_id'] = analysis.id
-                logger.info(f"Analysis saved to database for user {current_user.username}")
-            except Exception as e:
-                logger.error(f"Failed to save analysis to database: {str(e)}")
-                db.session.rollback()
-                # Don't fail the request if save fails
-                response['saved'] = False
+            save_analysis(
+                current_user, response,
+                test_type=test_type,
+                result=response.get('result') or response.get('diagnosis', ''),
+                diagnosis=response.get('diagnosis', ''),
+                image_path=image_path,
+                confidence=response.get('confidence')
+            )
+        if wants_inline_thumbnail():
+            inline_thumbnail(response)
 
-        return jsonify(response)
+        return jsonify(select_fields(response, fields))
 
     except Exception as e:
         logger.error(f"Error analyzing {test_type} image: {str(e)}")
@@ -803,6 +1225,278 @@ def analyze(current_user):
         gc.collect()
 
 
+@app.route("/analyze-video", methods=["POST"])
+@optional_token
+@rate_limited
+def analyze_video_upload(current_user):
+    """
+    Analyze a short video of a test strip.
+    
+    Accepts POST request with:
+    - video: File upload (MP4, MOV, AVI, WEBM, MKV)
+    - test_type: String ('ph', 'fob', 'urinalysis')
+    
+    Only stable, sharp frames that differ from the last analyzed frame are
+    run through the analyzer; their results are combined by majority vote.
+    "stable" is false until enough frames were read to trust the score.
+    
+    Returns:
+        JSON response with the aggregated result, stability score and frame
+        counts; 422 when no frame was readable or the video is longer than
+        VIDEO_MAX_SECONDS / VIDEO_MAX_FRAMES
+    """
+    if "video" not in request.files:
+        return jsonify({"error": "No video provided"}), 400
+
+    video_file = request.files["video"]
+    test_type = request.form.get("test_type")
+
+    if not test_type or test_type not in ["ph", "fob", "urinalysis"]:
+        return jsonify({"error": "Invalid test type. Must be 'ph', 'fob', or 'urinalysis'"}), 400
+
+    if not validate_file_extension(video_file.filename, ALLOWED_VIDEO_EXTENSIONS):
+        return jsonify({"error": f"Invalid file type. Allowed types: {', '.join(ALLOWED_VIDEO_EXTENSIONS)}"}), 400
+
+    analysis_id = uuid.uuid4().hex
+    filename = secure_filename(f"{analysis_id}_{video_file.filename}")
+    video_path = os.path.join(UPLOAD_FOLDER, filename)
+    video_file.save(video_path)
+
+    try:
+        result = analyze_video(video_path, test_type,
+                               sample_fps=app.config.get('VIDEO_SAMPLE_FPS', 5.0),
+                               max_seconds=app.config.get('VIDEO_MAX_SECONDS', 60.0),
+                               max_frames=app.config.get('VIDEO_MAX_FRAMES', 3600))
+        logger.info(f"Video analysis frame counts: {result.get('frames')}")
+
+        if not result["success"]:
+            return jsonify({"error": result["error"], "frames": result.get("frames", {})}), 422
+
+        response = {
+            "success": True,
+            "test_type": test_type,
+            "source": "video",
+            "stability_score": result["stability_score"],
+            "stable": result["stable"],
+            "frames": result["frames"],
+            "analysis_id": analysis_id
+        }
+        if test_type == "urinalysis":
+            response["results"] = result["result"]
+            response["message"] = "Urinalysis strip analyzed from video"
+        elif test_type == "ph":
+            response["pH"] = response["estimated_ph"] = result["result"]
+            response["result"] = f"pH {result['result']:.1f}"
+            response["message"] = f"pH: {result['result']:.1f}"
+        else:
+            response["result"] = result["result"]
+            response["message"] = f"FOB Test Result: {result['result']}"
+
+        if current_user:
+            save_analysis(
+                current_user, response,
+                test_type=test_type,
+                result=response.get('result') or response.get('message', ''),
+                diagnosis=response.get('message', ''),
+                image_path=video_path,
+                confidence=result["stability_score"]
+            )
+
+        return jsonify(response)
+
+    except Exception as e:
+        logger.error(f"Error analyzing {test_type} video: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        safe_file_cleanup(video_path)
+
+
+# ============================================
+# pH CALIBRATION ROUTES
+# ============================================
+
+@app.route("/ph/calibrations", methods=["POST"])
+@optional_token
+@rate_limited
+def create_ph_calibration(current_user):
+    """
+    Calibrate against a pH colour card once and reuse it for later strips.
+    
+    Accepts POST request with:
+    - image: Photo of a strip on the colour card
+    
+    The reference patches are detected and the colour model fitted once;
+    pass the returned calibration_id with later /analyze requests (test_type
+    'ph') to skip reference detection. The session is invalidated
+    automatically when the lighting changes.
+    """
+    if ph_calibrations is None:
+        return jsonify({"error": "pH analyzer not available"}), 503
+    if "image" not in request.files:
+        return jsonify({"error": "No image provided"}), 400
+
+    image_file = request.files["image"]
+    if not allowed_file(image_file.filename):
+        return jsonify({"error": f"Invalid file type. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"}), 400
+
+    filename = secure_filename(f"{uuid.uuid4().hex}_{image_file.filename}")
+    image_path = os.path.join(UPLOAD_FOLDER, filename)
+    image_file.save(image_path)
+
+    try:
+        is_valid, error_message = validate_image_quality(image_path)
+        if not is_valid:
+            return jsonify({"error": error_message}), 400
+
+        analyzer = PHStripAnalyzer(debug=False)
+        result = analyzer.analyze_ph_strip(image_path)
+        if not result["success"] or analyzer.calibration is None:
+            return jsonify({"error": result.get("error", "Calibration failed")}), 422
+
+        owner = current_user.id if current_user else None
+        calibration_id = ph_calibrations.create(analyzer.calibration, owner)
+        return jsonify({
+            "success": True,
+            "calibration_id": calibration_id,
+            "expires_in": ph_calibrations.ttl,
+            **analyzer.calibration.to_dict()
+        }), 201
+    except Exception as e:
+        logger.error(f"pH calibration failed: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+    finally:
+        safe_file_cleanup(image_path)
+
+
+@app.route("/ph/calibrations/<calibration_id>", methods=["GET"])
+@optional_token
+def get_ph_calibration(current_user, calibration_id):
+    """Reference colours of a live calibration session"""
+    owner = current_user.id if current_user else None
+    calibration = ph_calibrations.get(calibration_id, owner) if ph_calibrations else None
+    if calibration is None:
+        return jsonify({"error": "Calibration session not found or expired"}), 404
+    return jsonify({"calibration_id": calibration_id, **calibration.to_dict()})
+
+
+@app.route("/ph/calibrations/<calibration_id>", methods=["DELETE"])
+@optional_token
+def delete_ph_calibration(current_user, calibration_id):
+    """End a calibration session"""
+    owner = current_user.id if current_user else None
+    if ph_calibrations is None or ph_calibrations.get(calibration_id, owner) is None:
+        return jsonify({"error": "Calibration session not found or expired"}), 404
+    ph_calibrations.invalidate(calibration_id)
+    return jsonify({"success": True})
+
+# ============================================
+# LIVE STREAM ROUTES
+# ============================================
+
+@app.route("/stream", methods=["POST"])
+@optional_token
+@rate_limited
+def open_stream(current_user):
+    """
+    Open a live frame stream for a test type.
+    
+    Request body: {"test_type": "fob" | "ph" | "urinalysis"}
+    
+    Returns:
+        JSON with the stream_id used by the frame and poll routes
+    """
+    data = request.get_json(silent=True) or {}
+    test_type = data.get("test_type") or request.form.get("test_type")
+
+    if not test_type or test_type not in ["ph", "fob", "urinalysis"]:
+        return jsonify({"error": "Invalid test type. Must be 'ph', 'fob', or 'urinalysis'"}), 400
+
+    owner = current_user.id if current_user else None
+    try:
+        stream = live_streams.open(test_type, owner=owner, client=owner if current_user else client_ip())
+    except TooManyStreams as e:
+        return jsonify({"error": str(e)}), 429
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 503
+
+    return jsonify({"success": True, "stream_id": stream.stream_id, "test_type": test_type}), 201
+
+
+@app.route("/stream/<stream_id>/frame", methods=["POST"])
+@optional_token
+@rate_limited
+def submit_stream_frame(current_user, stream_id):
+    """
+    Submit the newest camera frame.
+    
+    Accepts an encoded image either as the raw request body or as a
+    multipart "frame" file. Any frame still waiting for analysis is dropped
+    in favour of this one. The response carries the most recent completed
+    result, so the frame POST itself is the client's result channel.
+    
+    Query parameters:
+    - wait: Seconds (capped at LIVE_STREAM_MAX_WAIT) to wait for this
+      frame's result; 200 once "latest" covers this frame, 202 otherwise
+    """
+    owner = current_user.id if current_user else None
+    stream = live_streams.get(stream_id, owner)
+    if stream is None:
+        return jsonify({"error": "Stream not found"}), 404
+
+    if "frame" in request.files:
+        data = request.files["frame"].read()
+    else:
+        data = request.get_data()
+
+    frame = decode_frame(data)
+    if frame is None:
+        return jsonify({"error": "Could not decode frame"}), 400
+
+    try:
+        seq = stream.submit(frame)
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 410
+
+    wait = min(request.args.get("wait", 0.0, type=float), app.config.get('LIVE_STREAM_MAX_WAIT', 5.0))
+    results = stream.results_after(seq - 1, timeout=wait) if wait > 0 else []
+    latest = results[-1] if results else stream.latest_result()
+    done = latest is not None and latest["seq"] >= seq
+    return jsonify({"accepted": True, "seq": seq, "latest": latest}), 200 if done else 202
+
+
+@app.route("/stream/<stream_id>", methods=["GET"])
+@optional_token
+def get_stream(current_user, stream_id):
+    """
+    Latest result and counters for a stream.
+    
+    Query parameters:
+    - after: Return the results for frames after this sequence number
+    - wait: Seconds (capped at LIVE_STREAM_MAX_WAIT) to long-poll for them
+    """
+    stream = live_streams.get(stream_id, current_user.id if current_user else None)
+    if stream is None:
+        return jsonify({"error": "Stream not found"}), 404
+
+    after = request.args.get("after", type=int)
+    wait = min(request.args.get("wait", 0.0, type=float), app.config.get('LIVE_STREAM_MAX_WAIT', 5.0))
+    response = {"stream_id": stream_id, "test_type": stream.test_type, "stats": dict(stream.stats)}
+    if after is None:
+        response["latest"] = stream.latest_result()
+    else:
+        response["results"] = stream.results_after(after, timeout=wait)
+    return jsonify(response)
+
+
+@app.route("/stream/<stream_id>", methods=["DELETE"])
+@optional_token
+def close_stream(current_user, stream_id):
+    """Close a stream and stop its worker"""
+    if not live_streams.close(stream_id, current_user.id if current_user else None):
+        return jsonify({"error": "Stream not found"}), 404
+    return jsonify({"success": True})
+
+
 if __name__ == "__main__":
     # Use environment variables for production deployment
     port = int(os.environ.get("PORT", 5000))
@@ -5,8 +5,135 @@ from functools import wraps
 from flask import request, jsonify
 import jwt
 import os
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from models import User
+from sqlalchemy.orm import make_transient_to_detached
+from werkzeug.security import generate_password_hash, check_password_hash
+from models import db, User
+
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 30  # seconds
+
+class UserCache:
+    """
+    In-process LRU + TTL cache of User rows keyed by id, so protected
+    requests skip the user lookup.
+    
+    Entries hold column values, not ORM instances; a hit rebuilds the User
+    and merges it into the current session without a query. Routes that
+    change a user call invalidate(); changes made by other processes are
+    picked up when the entry expires.
+    """
+    
+    def __init__(self, max_size=USER_CACHE_SIZE, ttl=USER_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, user_id):
+        """Cached column values for user_id, or None"""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.stats['hits'] += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[user_id]
+            self.stats['misses'] += 1
+            return None
+    
+    def put(self, user):
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        values = {column.key: getattr(user, column.key) for column in User.__table__.columns}
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, values)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+    
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def snapshot(self):
+        """Counters plus current size, for monitoring"""
+        with self._lock:
+            return dict(self.stats, size=len(self._entries))
+
+user_cache = UserCache()
+
+def load_user(user_id):
+    """Get the user for a token, from user_cache when possible"""
+    values = user_cache.get(user_id)
+    if values is not None:
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+    
+    user = db.session.get(User, user_id)
+    if user is not None:
+        user_cache.put(user)
+    return user
+
+class PasswordHasherBusy(Exception):
+    """The password hashing queue is full or a job did not finish in time"""
+    pass
+
+class PasswordHasher:
+    """
+    Bounds how many password KDF calls run at once.
+    
+    The KDF runs on the calling request thread. At most ``workers`` calls
+    run at the same time and up to ``max_queue`` more wait, each for at
+    most ``timeout`` seconds, for a turn. Further calls raise
+    PasswordHasherBusy immediately, so a login burst occupies at most
+    ``workers + max_queue`` request threads. The KDF releases the GIL, so
+    analysis requests on the other threads keep running meanwhile; run
+    more request threads than ``workers + max_queue``.
+    """
+    
+    def __init__(self, workers=1, max_queue=1, timeout=5.0):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.stats = {'completed': 0, 'rejected': 0, 'timeouts': 0}
+        self._admitted = threading.BoundedSemaphore(workers + max_queue)
+        self._running = threading.BoundedSemaphore(workers)
+    
+    def run(self, fn, *args):
+        """Run fn(*args) once a slot is free and return its result"""
+        if not self._admitted.acquire(blocking=False):
+            self.stats['rejected'] += 1
+            raise PasswordHasherBusy('Password hashing queue is full')
+        try:
+            if not self._running.acquire(timeout=self.timeout):
+                self.stats['timeouts'] += 1
+                raise PasswordHasherBusy('Password hashing timed out')
+            try:
+                result = fn(*args)
+            finally:
+                self._running.release()
+        finally:
+            self._admitted.release()
+        self.stats['completed'] += 1
+        return result
+    
+    def hash_password(self, password):
+        return self.run(generate_password_hash, password)
+    
+    def verify_password(self, password_hash, password):
+        return self.run(check_password_hash, password_hash, password)
 
 def get_secret_key():
     """Get JWT secret key from environment or use default"""
@@ -47,7 +174,7 @@ def token_required(f):
         try:
             # Decode and verify token
             data = jwt.decode(token, get_secret_key(), algorithms=['HS256'])
-            current_user = User.query.get(data['user_id'])
+            current_user = load_user(data['user_id'])
             
             if not current_user:
                 return jsonify({'error': 'User not found'}), 401
@@ -75,7 +202,7 @@ def optional_token(f):
             try:
                 token = auth_header.split(' ')[1] if ' ' in auth_header else auth_header
                 data = jwt.decode(token, get_secret_key(), algorithms=['HS256'])
-                current_user = User.query.get(data['user_id'])
+                current_user = load_user(data['user_id'])
             except:
                 pass  # Invalid token, proceed as anonymous
         
@@ -0,0 +1,288 @@
+"""
+Offline batch analysis of strip photo archives
+Walks a directory or manifest, runs each image through the matching
+analyzer across worker processes and streams results to a JSONL file.
+Re-running with the same output file resumes where the last run stopped.
+
+Usage:
+    python batch_analyze.py archive/ -o results.jsonl --workers 8
+    python batch_analyze.py manifest.csv -o results.jsonl --test-type ph
+
+This module deliberately imports neither Flask nor the database layer.
+"""
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+import numpy as np
+
+TEST_TYPES = ("fob", "ph", "urinalysis")
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.webp', '.tif', '.tiff')
+DEFAULT_TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+PROGRESS_INTERVAL = 2.0  # seconds between progress lines
+
+logger = logging.getLogger(__name__)
+
+
+# ---------------------- Input discovery ----------------------
+def infer_test_type(path: str) -> Optional[str]:
+    """Test type from the nearest directory named fob, ph or urinalysis"""
+    parts = os.path.normpath(path).split(os.sep)[:-1]
+    for part in reversed(parts):
+        if part.lower() in TEST_TYPES:
+            return part.lower()
+    return None
+
+
+def discover_images(root: str) -> Iterator[Dict[str, Any]]:
+    """Yield {"path", "test_type"} items for every image under ``root`` in a stable order"""
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for fname in sorted(filenames):
+            if fname.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(dirpath, fname)
+                yield {"path": path, "test_type": infer_test_type(os.path.relpath(path, root))}
+
+
+def read_manifest(manifest_path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield items from a manifest file.
+
+    Supported formats (paths are relative to the manifest's directory):
+    - .jsonl: one {"path": ..., "test_type": ...} object per line
+    - .csv: header with a "path" column and optional "test_type" column
+    - anything else: one path per line
+    """
+    base = os.path.dirname(os.path.abspath(manifest_path))
+
+    def item(path, test_type=None):
+        path = path.strip()
+        if not os.path.isabs(path):
+            path = os.path.join(base, path)
+        return {"path": path, "test_type": (test_type or "").strip().lower() or infer_test_type(path)}
+
+    with open(manifest_path, newline='', encoding='utf-8') as f:
+        if manifest_path.lower().endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield item(record["path"], record.get("test_type"))
+        elif manifest_path.lower().endswith('.csv'):
+            for row in csv.DictReader(f):
+                if row.get("path"):
+                    yield item(row["path"], row.get("test_type"))
+        else:
+            for line in f:
+                if line.strip() and not line.startswith('#'):
+                    yield item(line)
+
+
+def item_key(item: Dict[str, Any]) -> str:
+    """Stable identifier of an item in the output file"""
+    return f"{item['test_type']}:{os.path.normpath(item['path'])}"
+
+
+# ---------------------- Resumable output ----------------------
+def load_completed_keys(output_path: str) -> Set[str]:
+    """
+    Keys already written to ``output_path``.
+
+    A line cut short by a crash is ignored (that image is re-analyzed), and
+    the file is terminated with a newline so appended records stay valid.
+    """
+    keys = set()
+    if not os.path.exists(output_path):
+        return keys
+
+    with open(output_path, 'rb') as f:
+        data = f.read()
+    for line in data.splitlines():
+        try:
+            keys.add(json.loads(line)["key"])
+        except (ValueError, KeyError, TypeError):
+            continue
+
+    if data and not data.endswith(b'\n'):
+        with open(output_path, 'ab') as f:
+            f.write(b'\n')
+    return keys
+
+
+def _json_safe(value: Any) -> Any:
+    """Convert analyzer output to JSON types; images and other arrays are dropped"""
+    if isinstance(value, dict):
+        return {k: _json_safe(v) for k, v in value.items() if not isinstance(v, np.ndarray)}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+# ---------------------- Worker ----------------------
+_worker_options: Dict[str, Any] = {}
+
+
+def _set_options(options: Dict[str, Any]):
+    _worker_options.clear()
+    _worker_options.update(options)
+
+
+def _init_worker(options: Dict[str, Any]):
+    """
+    Worker process setup: one OpenCV thread per process (the pool provides
+    the parallelism), analyzers imported up front so the first image's
+    timing does not include scikit-learn's import, then quiet logging.
+    """
+    import cv2
+    cv2.setNumThreads(1)
+    import fob_analyzer, ph_strip_analyzer, urinalysis_strip_analyzer  # noqa: F401
+    logging.getLogger().setLevel(options.get("log_level", logging.WARNING))
+    _set_options(options)
+
+
+def analyze_item(item: Dict[str, Any]) -> Dict[str, Any]:
+    """Analyze one image and return its JSONL record (never raises)"""
+    test_type = item.get("test_type")
+    record = {"key": item_key(item), "path": item["path"], "test_type": test_type}
+    start = time.perf_counter()
+    result_folder = _worker_options.get("result_folder")
+
+    try:
+        if test_type == "fob":
+            from fob_analyzer import analyze_fob
+            result = analyze_fob(item["path"], templates_dir=_worker_options.get("templates_dir", DEFAULT_TEMPLATES_DIR),
+                                 result_folder=result_folder)
+            ok = result.get("status") == "ok"
+        elif test_type == "ph":
+            from ph_strip_analyzer import PHStripAnalyzer
+            result = PHStripAnalyzer().analyze_ph_strip(item["path"], result_folder=result_folder,
+                                                        analysis_id=os.path.splitext(os.path.basename(item["path"]))[0])
+            ok = bool(result.get("success"))
+        elif test_type == "urinalysis":
+            from urinalysis_strip_analyzer import analyze_urinalysis
+            result = analyze_urinalysis(item["path"], result_folder=result_folder)
+            ok = bool(result.get("success"))
+        else:
+            result = {"error": f"Unknown test type for {item['path']}"}
+            ok = False
+    except Exception as e:
+        result = {"error": str(e)}
+        ok = False
+
+    record["ok"] = ok
+    record["result"] = _json_safe(result)
+    record["elapsed_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    return record
+
+
+# ---------------------- Runner ----------------------
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    hours, rem = divmod(seconds, 3600)
+    minutes, secs = divmod(rem, 60)
+    return f"{hours}:{minutes:02d}:{secs:02d}" if hours else f"{minutes:02d}:{secs:02d}"
+
+
+def run_batch(items: Iterable[Dict[str, Any]], output_path: str, workers: int = 1,
+              templates_dir: str = DEFAULT_TEMPLATES_DIR, result_folder: Optional[str] = None,
+              log_level: int = logging.WARNING, progress_stream=sys.stderr) -> Dict[str, Any]:
+    """
+    Analyze ``items`` and append one JSON record per image to ``output_path``.
+
+    Items whose key is already in the output are skipped, so an interrupted
+    run can simply be started again.
+
+    Returns:
+        Summary with counts, elapsed seconds and throughput (images/second)
+    """
+    completed = load_completed_keys(output_path)
+    pending: List[Dict[str, Any]] = [item for item in items if item_key(item) not in completed]
+    total = len(pending)
+    summary = {"total": total, "skipped": len(completed), "done": 0, "ok": 0, "failed": 0}
+
+    options = {"templates_dir": templates_dir, "result_folder": result_folder, "log_level": log_level}
+    start = last_report = time.monotonic()
+
+    def report(final=False):
+        elapsed = time.monotonic() - start
+        rate = summary["done"] / elapsed if elapsed > 0 else 0.0
+        eta = (total - summary["done"]) / rate if rate > 0 else 0.0
+        if progress_stream:
+            progress_stream.write(
+                f"{summary['done']}/{total} images ({summary['failed']} failed), "
+                f"{rate:.2f} img/s, " + (f"elapsed {_format_duration(elapsed)}" if final
+                                         else f"ETA {_format_duration(eta)}") + "\n")
+            progress_stream.flush()
+        summary["elapsed_seconds"] = round(elapsed, 2)
+        summary["images_per_second"] = round(rate, 3)
+
+    if workers > 1 and total > 1:
+        pool = multiprocessing.Pool(workers, initializer=_init_worker, initargs=(options,))
+        records = pool.imap_unordered(analyze_item, pending, chunksize=max(1, min(8, total // (workers * 4))))
+    else:
+        pool = None
+        _set_options(options)
+        records = (analyze_item(item) for item in pending)
+
+    try:
+        with open(output_path, 'a', encoding='utf-8') as out:
+            for record in records:
+                # One complete line per record, flushed so a crash loses at most the current line
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+                summary["done"] += 1
+                summary["ok" if record["ok"] else "failed"] += 1
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    report()
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    report(final=True)
+    return summary
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Batch-analyze strip photos into a resumable JSONL file")
+    parser.add_argument("input", help="Directory to scan, or a manifest (.txt, .csv or .jsonl)")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file to append results to")
+    parser.add_argument("-t", "--test-type", choices=TEST_TYPES,
+                        help="Test type for every image (default: from the manifest or a fob/ph/urinalysis directory name)")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1, help="Worker processes")
+    parser.add_argument("--templates-dir", default=DEFAULT_TEMPLATES_DIR, help="FOB template directory")
+    parser.add_argument("--result-folder", help="Also save annotated result images here")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show analyzer log output")
+    args = parser.parse_args(argv)
+
+    log_level = logging.INFO if args.verbose else logging.WARNING
+    logging.basicConfig(level=log_level, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    if os.path.isdir(args.input):
+        items = list(discover_images(args.input))
+    elif os.path.isfile(args.input):
+        items = list(read_manifest(args.input))
+    else:
+        parser.error(f"Input not found: {args.input}")
+
+    if args.test_type:
+        for item in items:
+            item["test_type"] = args.test_type
+
+    summary = run_batch(items, args.output, workers=max(1, args.workers),
+                        templates_dir=args.templates_dir, result_folder=args.result_folder,
+                        log_level=log_level)
+    print(json.dumps(summary))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
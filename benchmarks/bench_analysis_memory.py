@@ -0,0 +1,83 @@
+"""
+Peak and retained memory per analysis request
+
+Runs each analyzer on the sample images under tracemalloc (NumPy and
+OpenCV's Python outputs allocate through it) and reports, per analysis:
+- peak: highest traced memory while the analysis runs
+- retained: memory still referenced by the returned result dict, which
+  the Flask layer keeps alive until the request ends
+
+Two modes are measured: "request" saves the annotated result image like
+/analyze, "frames" skips it like video and live-stream frame analysis.
+
+Usage:
+    python benchmarks/bench_analysis_memory.py
+    python benchmarks/bench_analysis_memory.py --repeat 5
+"""
+import argparse
+import gc
+import glob
+import logging
+import os
+import sys
+import tempfile
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fob_analyzer import analyze_fob  # noqa: E402
+from ph_strip_analyzer import PHStripAnalyzer  # noqa: E402
+from urinalysis_strip_analyzer import analyze_urinalysis  # noqa: E402
+
+SAMPLE_DIR = os.path.join(ROOT, "static", "sample-images")
+TEMPLATES_DIR = os.path.join(ROOT, "templates")
+
+ANALYZERS = {
+    "fob": lambda path, folder: analyze_fob(path, templates_dir=TEMPLATES_DIR, result_folder=folder,
+                                            analysis_id="bench"),
+    "ph": lambda path, folder: PHStripAnalyzer().analyze_ph_strip(path, result_folder=folder,
+                                                                  analysis_id="bench"),
+    "urinalysis": lambda path, folder: analyze_urinalysis(path, result_folder=folder, analysis_id="bench"),
+}
+
+
+def measure(analyze, path, folder):
+    """(peak bytes, retained bytes) of one analysis"""
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = analyze(path, folder)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return peak - baseline, current - baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per image (the minimum is reported)")
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for test_type, analyze in ANALYZERS.items():
+            images = sorted(glob.glob(os.path.join(SAMPLE_DIR, test_type, "*")))
+            if not images:
+                print(f"{test_type:>11}: no sample images")
+                continue
+            # Warm-up: imports, template loading, lazily built tables
+            analyze(images[0], tmp)
+            for mode, folder in (("request", tmp), ("frames", None)):
+                peaks, retained = [], []
+                for path in images:
+                    runs = [measure(analyze, path, folder) for _ in range(args.repeat)]
+                    peaks.append(min(peak for peak, _ in runs))
+                    retained.append(min(kept for _, kept in runs))
+                print(f"{test_type:>11} {mode:>8}: peak {sum(peaks) / len(peaks) / 2**20:7.2f} MiB "
+                      f"(max {max(peaks) / 2**20:7.2f}) | retained {sum(retained) / len(retained) / 2**20:7.2f} MiB "
+                      f"| {len(images)} images")
+
+
+if __name__ == "__main__":
+    main()
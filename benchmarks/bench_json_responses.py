@@ -0,0 +1,124 @@
+"""
+Serialization time and size of typical API payloads
+
+Payloads: a pH result with NumPy values, a urinalysis result with ten
+explained pads, and a /history page of 100 rows. Each is encoded with:
+- "tolist": recursive conversion to Python types, then json.dumps (the
+  workaround the provider replaces)
+- "provider": json_responses.dumps (orjson when installed, otherwise
+  json.dumps with a NumPy default hook)
+and then gzipped as compress_response would.
+
+Usage:
+    python benchmarks/bench_json_responses.py
+    python benchmarks/bench_json_responses.py --repeat 2000
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from json_responses import dumps, orjson, COMPRESS_LEVEL  # noqa: E402
+
+PAD_CODES = ["LEU", "NIT", "URO", "PRO", "PH", "BLO", "SG", "KET", "BIL", "GLU"]
+
+
+def ph_payload():
+    return {
+        "success": True,
+        "estimated_ph": np.float64(4.37),
+        "test_patch_color_hsv": (np.int64(23), np.int64(181), np.int64(204)),
+        "min_distance_to_reference": np.float32(3.21),
+        "reference_colors_hsv": np.random.default_rng(0).integers(0, 255, (7, 3)).astype(np.uint8),
+        "detected_reference_patches_count": np.int64(7),
+        "result_images": ["result_images/ph_abc123.png"],
+    }
+
+
+def urinalysis_payload():
+    rng = np.random.default_rng(1)
+    return {
+        "success": True,
+        "test_type": "urinalysis",
+        "results": {
+            code: {
+                "result": "NEG",
+                "confidence": np.float64(rng.uniform(60, 100)),
+                "hsv": tuple(np.int64(v) for v in rng.integers(0, 255, 3)),
+                "explanation": (f"Classified by hue (Hue={rng.uniform(0, 180):.1f}) | K=3 nearest: "
+                                f"NEG(4.1), NEG(5.3), TRACE(9.8) | Won by 2/3 votes. " * 3),
+            }
+            for code in PAD_CODES
+        },
+        "pads_detected": np.int64(10),
+    }
+
+
+def history_payload(rows=100):
+    base = datetime(2024, 1, 1)
+    return {
+        "success": True,
+        "count": rows,
+        "analyses": [{
+            "id": i,
+            "user_id": 1,
+            "test_type": "fob" if i % 2 else "ph",
+            "result": "negative" if i % 2 else "pH 4.2 - Normal",
+            "diagnosis": "FOB Test shows: negative. No blood detected in sample.",
+            "image_path": f"uploads/{i:032x}.jpg",
+            "result_image_path": None,
+            "confidence": 0.93,
+            "created_at": (base + timedelta(minutes=i)).isoformat(),
+        } for i in range(rows)],
+        "limit": rows,
+        "next_cursor": "eyJjIjoiMjAyNC0wMS0wMVQwMDowMDowMCIsImkiOjF9",
+    }
+
+
+def to_python(value):
+    """The manual conversion callers needed before the provider existed"""
+    if isinstance(value, dict):
+        return {k: to_python(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_python(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def timed(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    return (time.perf_counter() - start) / repeat * 1e6, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"encoder: {'orjson' if orjson else 'stdlib json'}; gzip level {COMPRESS_LEVEL}")
+    for name, payload in (("ph", ph_payload()), ("urinalysis", urinalysis_payload()),
+                          ("history-100", history_payload())):
+        tolist_us, _ = timed(lambda: json.dumps(to_python(payload)), args.repeat)
+        provider_us, encoded = timed(lambda: dumps(payload), args.repeat)
+        raw = encoded.encode()
+        gzip_us, compressed = timed(lambda: gzip.compress(raw, compresslevel=COMPRESS_LEVEL), args.repeat)
+        print(f"{name:>12}: tolist {tolist_us:8.1f} us | provider {provider_us:8.1f} us | "
+              f"gzip {gzip_us:8.1f} us | {len(raw):6d} B -> {len(compressed):6d} B "
+              f"({len(compressed) / len(raw):.0%})")
+
+
+if __name__ == "__main__":
+    main()
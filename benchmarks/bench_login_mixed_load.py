@@ -0,0 +1,101 @@
+"""
+Login throughput vs. analysis latency under mixed load
+
+Simulates one gunicorn worker with a fixed number of request threads. A
+steady stream of pH analyses arrives while bursts of logins hit the same
+threads. Runs twice: with the password KDF inline on the request thread
+(no admission limit), and through auth.PasswordHasher (bounded, fast 503).
+
+Usage:
+    python benchmarks/bench_login_mixed_load.py
+    python benchmarks/bench_login_mixed_load.py --threads 2 --logins 40 --analyses 20
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from werkzeug.security import generate_password_hash, check_password_hash  # noqa: E402
+from auth import PasswordHasher, PasswordHasherBusy  # noqa: E402
+from imaging import load_image  # noqa: E402
+from ph_strip_analyzer import PHStripAnalyzer  # noqa: E402
+
+SAMPLE_IMAGE = os.path.join(ROOT, "sample images", "ph", "test3.jpeg")
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else float('nan')
+
+
+def run(mode, threads, logins, analyses, analysis_interval, workers, max_queue):
+    password_hash = generate_password_hash("password123")
+    image, _ = load_image(SAMPLE_IMAGE)
+    hasher = PasswordHasher(workers=workers, max_queue=max_queue) if mode == "bounded" else None
+
+    login_ok = login_busy = 0
+    analysis_latencies = []
+    lock = threading.Lock()
+
+    def login():
+        nonlocal login_ok, login_busy
+        try:
+            if hasher:
+                hasher.verify_password(password_hash, "password123")
+            else:
+                check_password_hash(password_hash, "password123")
+            with lock:
+                login_ok += 1
+        except PasswordHasherBusy:
+            with lock:
+                login_busy += 1
+
+    def analyze(submitted):
+        assert PHStripAnalyzer().analyze_ph_strip(image)["success"]
+        # Latency includes time spent waiting for a free request thread
+        with lock:
+            analysis_latencies.append(time.perf_counter() - submitted)
+
+    pool = ThreadPoolExecutor(max_workers=threads)
+    start = time.perf_counter()
+    futures = []
+    for i in range(analyses):
+        # A burst of logins lands just ahead of every analysis request
+        for _ in range(logins // analyses):
+            futures.append(pool.submit(login))
+        futures.append(pool.submit(analyze, time.perf_counter()))
+        time.sleep(analysis_interval)
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+    pool.shutdown()
+
+    print(f"{mode:>8}: logins ok={login_ok:3d} 503={login_busy:3d} "
+          f"({login_ok / elapsed:5.1f}/s) | analysis p50={_percentile(analysis_latencies, 50):7.1f} ms "
+          f"p95={_percentile(analysis_latencies, 95):7.1f} ms | wall {elapsed:5.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--threads", type=int, default=2, help="Request threads (gunicorn --threads)")
+    parser.add_argument("--logins", type=int, default=60, help="Total login requests")
+    parser.add_argument("--analyses", type=int, default=20, help="Total analysis requests")
+    parser.add_argument("--interval", type=float, default=0.1, help="Seconds between analysis requests")
+    parser.add_argument("--workers", type=int, default=1, help="Concurrent PasswordHasher KDF calls")
+    parser.add_argument("--max-queue", type=int, default=1, help="PasswordHasher callers allowed to wait")
+    args = parser.parse_args()
+
+    # Warm up imports and scikit-learn before timing
+    PHStripAnalyzer().analyze_ph_strip(load_image(SAMPLE_IMAGE)[0])
+    for mode in ("inline", "bounded"):
+        run(mode, args.threads, args.logins, args.analyses, args.interval, args.workers, args.max_queue)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+SQLite write throughput under concurrent inserts and history reads
+
+Writer threads insert analyses (one commit each, like /analyze) while
+reader threads page through /history-style queries. Runs once with
+SQLAlchemy's defaults (rollback journal) and once with the WAL pragmas
+from database.py, each on a fresh temporary database file.
+
+Usage:
+    python benchmarks/bench_sqlite_concurrency.py
+    python benchmarks/bench_sqlite_concurrency.py --writers 8 --readers 8 --seconds 5
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import create_engine, insert, select  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from database import configure_engine  # noqa: E402
+from models import db, Analysis, User  # noqa: E402
+
+RAW_DATA = '{"result": "negative", "confidence": 0.93}' * 20
+
+
+def run(mode, writers, readers, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}", pool_size=writers + readers)
+        if mode == "wal":
+            configure_engine(engine)
+        db.metadata.create_all(engine)
+        with engine.begin() as conn:
+            conn.execute(insert(User.__table__).values(id=1, username="bench", email="bench@example.com",
+                                                       password_hash="x", email_verified=True))
+
+        counts = {"inserts": 0, "reads": 0, "locked": 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + seconds
+        analyses = Analysis.__table__
+
+        def count(key):
+            with lock:
+                counts[key] += 1
+
+        def writer():
+            while time.monotonic() < deadline:
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(insert(analyses).values(
+                            user_id=1, test_type="fob", result="negative", raw_data=RAW_DATA,
+                            created_at=datetime.utcnow()))
+                    count("inserts")
+                except OperationalError:
+                    count("locked")
+
+        def reader():
+            query = (select(analyses.c.id, analyses.c.test_type, analyses.c.result, analyses.c.created_at)
+                     .where(analyses.c.user_id == 1)
+                     .order_by(analyses.c.created_at.desc(), analyses.c.id.desc())
+                     .limit(50))
+            while time.monotonic() < deadline:
+                try:
+                    with engine.connect() as conn:
+                        conn.execute(query).fetchall()
+                    count("reads")
+                except OperationalError:
+                    count("locked")
+
+        threads = ([threading.Thread(target=writer) for _ in range(writers)]
+                   + [threading.Thread(target=reader) for _ in range(readers)])
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+
+    print(f"{mode:>8}: {counts['inserts'] / seconds:8.1f} inserts/s  {counts['reads'] / seconds:8.1f} reads/s  "
+          f"{counts['locked']:6d} 'database is locked' errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=3.0)
+    args = parser.parse_args()
+
+    for mode in ("default", "wal"):
+        run(mode, args.writers, args.readers, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
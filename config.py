@@ -19,27 +19,122 @@ class Config:
     UPLOAD_FOLDER = "uploads"
     RESULT_IMAGES_FOLDER = "result_images"
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp'}
+    ALLOWED_VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'webm', 'mkv'}
+    VIDEO_SAMPLE_FPS = 5.0
+    VIDEO_MAX_SECONDS = 60.0
+    VIDEO_MAX_FRAMES = 3600
+    
+    # Live camera streams
+    LIVE_STREAM_MAX_STREAMS = 32
+    LIVE_STREAM_IDLE_TIMEOUT = 120  # seconds without a frame before a stream is closed
+    LIVE_STREAM_ANALYSIS_SLOTS = 2  # full analyses running at once across all streams
+    LIVE_STREAM_MAX_PER_CLIENT = 2  # open streams per user, or per IP when anonymous
+    LIVE_STREAM_MAX_WAIT = 5.0  # longest a frame POST or poll may wait for a result (seconds)
     
     # Analysis settings
     KNN_NEIGHBORS = 3
+    PH_CALIBRATION_TTL = 30 * 60  # seconds a pH colour-card calibration stays valid
+    
+    # JSON responses at least this large (bytes) are gzipped for clients that accept it
+    JSON_COMPRESS_MIN_SIZE = 1024
+    
+    # Serve static/ and frontend/ from the precompressed, fingerprinted asset build
+    STATIC_ASSETS_PRECOMPRESSED = True
+    
+    # Cache lifetime of result images (seconds); their names are unique per analysis
+    RESULT_IMAGE_MAX_AGE = 365 * 24 * 3600
+    
+    # Sizes each result image is saved in, served via /result_images/<name>?size=<name>.
+    # "full" keeps the original name; max_dim None keeps the full resolution
+    RESULT_IMAGE_RENDITIONS = [
+        {"name": "thumb", "max_dim": 320, "format": "webp", "quality": 70},
+        {"name": "full", "max_dim": None, "format": "jpeg", "quality": 90},
+    ]
+    # Embed the thumbnail in /analyze responses as a data URI (also per request: inline_thumbnail=1)
+    RESULT_INLINE_THUMBNAIL = False
+    RESULT_INLINE_MAX_BYTES = 16 * 1024  # larger thumbnails are linked, not embedded
+    
+    # Encode result images on a background queue; /analyze returns their URLs immediately
+    RESULT_ENCODE_BACKGROUND = True
+    RESULT_ENCODE_WORKERS = 1
+    RESULT_ENCODE_MAX_QUEUE = 32  # beyond this, images are encoded on the request thread
+    RESULT_ENCODE_WAIT = 2.0  # seconds /result_images waits for an image still encoding
+    
+    # History pagination
+    HISTORY_PAGE_SIZE = 50
+    HISTORY_MAX_PAGE_SIZE = 100
+    
+    # Password hashing: WORKERS KDF calls run at once and MAX_QUEUE more may
+    # wait; together they are how many request threads auth traffic may
+    # hold, so keep them below the gunicorn thread count
+    PASSWORD_HASH_WORKERS = 1
+    PASSWORD_HASH_MAX_QUEUE = 1
+    PASSWORD_HASH_TIMEOUT = 5.0  # seconds
+    
+    # Connection pool for server databases (DATABASE_URL); SQLite uses WAL pragmas instead
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    DB_POOL_TIMEOUT = 30  # seconds to wait for a free connection
+    DB_POOL_RECYCLE = 1800  # seconds before a connection is replaced
+    DB_POOL_PRE_PING = True
+    
+    # Write-behind analysis persistence: /analyze returns before the row is
+    # committed; a background writer group-commits queued rows
+    ANALYSIS_WRITE_BEHIND = os.getenv('ANALYSIS_WRITE_BEHIND', '').lower() in ('1', 'true', 'yes')
+    ANALYSIS_WRITE_BEHIND_BATCH_SIZE = 32
+    ANALYSIS_WRITE_BEHIND_INTERVAL = 0.05  # seconds to wait for a batch to fill
+    ANALYSIS_WRITE_BEHIND_MAX_QUEUE = 1000  # beyond this, requests write inline
+    
+    # Auth decorator user cache (LRU entries, seconds before a cached user is re-read)
+    USER_CACHE_SIZE = 1024
+    USER_CACHE_TTL = 30
+    
+    # /stats daily window (days)
+    STATS_DEFAULT_DAYS = 30
+    STATS_MAX_DAYS = 366
     MIN_IMAGE_BRIGHTNESS = 20
     MAX_IMAGE_BRIGHTNESS = 235
     
-    # Rate limiting (disabled by default - flask-limiter not in requirements)
-    RATE_LIMIT_ENABLED = False
-    RATE_LIMIT_PER_MINUTE = 50  # Increased from 10 to 50
+    # Logging: LOG_FORMAT=json writes one JSON object per line; events listed
+    # here are sampled (fraction emitted), the rest are always logged
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    LOG_SAMPLE_RATES = {"analysis.result": 0.1}
+    
+    # Built-in token-bucket rate limiting of the analysis endpoints. Anonymous
+    # clients are limited per IP, signed-in users per account; a request
+    # takes its cost in tokens from a bucket of BURST that refills at PER_MINUTE
+    RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    RATE_LIMIT_PER_MINUTE = 50
+    RATE_LIMIT_BURST = 20
+    RATE_LIMIT_USER_PER_MINUTE = 120
+    RATE_LIMIT_USER_BURST = 40
+    # Tokens per request by endpoint; /analyze by test type (FOB template matching is the dearest)
+    RATE_LIMIT_COSTS = {
+        "analyze": {"fob": 5, "urinalysis": 3, "ph": 1, "default": 1},
+        "analyze_video_upload": 15,
+        "create_ph_calibration": 1,
+        "open_stream": 2,
+        # Per live-stream frame: a few frames a second fit the sustained rate
+        "submit_stream_frame": 0.25,
+    }
+    RATE_LIMIT_MAX_BUCKETS = 10000
+    # Proxies in front of the app that append to X-Forwarded-For
+    RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', 0))
     
 class DevelopmentConfig(Config):
     """Development environment configuration"""
     DEBUG = True
     TESTING = False
     RATE_LIMIT_ENABLED = False  # Disable rate limiting in dev
+    LOG_SAMPLE_RATES = {}  # Log every event while developing
     
 class ProductionConfig(Config):
     """Production environment configuration"""
     DEBUG = False
     TESTING = False
-    RATE_LIMIT_ENABLED = False  # Disabled - flask-limiter not installed on Render
+    # Render and Heroku put one load balancer in front of the app; without
+    # this every client shares the balancer's address and one rate-limit bucket
+    RATE_LIMIT_TRUSTED_PROXIES = int(os.getenv('RATE_LIMIT_TRUSTED_PROXIES', 1))
     
 class TestingConfig(Config):
     """Testing environment configuration"""
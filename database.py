@@ -0,0 +1,66 @@
+"""
+Database engine configuration per backend
+SQLite files run in WAL mode with tuned pragmas so analysis inserts and
+history reads do not serialize on the rollback journal; server databases
+(Postgres via DATABASE_URL) get explicit pool sizing and pre-ping.
+"""
+import logging
+from typing import Any, Dict, Mapping
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+
+logger = logging.getLogger(__name__)
+
+# Applied to every new SQLite connection. journal_mode is persistent in the
+# file, the rest are per connection.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",      # readers no longer block the writer (and vice versa)
+    "synchronous": "NORMAL",    # fsync at checkpoints only; safe with WAL
+    "busy_timeout": 5000,       # ms to wait for the write lock instead of "database is locked"
+    "mmap_size": 268435456,     # 256 MB of the file read through the page cache
+}
+
+
+def _is_file_sqlite(uri: str) -> bool:
+    url = make_url(uri)
+    return url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:")
+
+
+def engine_options(uri: str, config: Mapping[str, Any]) -> Dict[str, Any]:
+    """
+    SQLALCHEMY_ENGINE_OPTIONS for ``uri``.
+
+    Server databases get a sized connection pool with pre-ping and recycle
+    (so connections dropped by the server or a proxy are replaced instead of
+    failing a request); SQLite keeps SQLAlchemy's default pool.
+    """
+    if make_url(uri).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": config.get("DB_POOL_SIZE", 5),
+        "max_overflow": config.get("DB_MAX_OVERFLOW", 10),
+        "pool_timeout": config.get("DB_POOL_TIMEOUT", 30),
+        "pool_recycle": config.get("DB_POOL_RECYCLE", 1800),
+        "pool_pre_ping": config.get("DB_POOL_PRE_PING", True),
+    }
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas: Mapping[str, Any] = SQLITE_PRAGMAS):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def configure_engine(engine: Engine, pragmas: Mapping[str, Any] = SQLITE_PRAGMAS):
+    """Install per-connection setup on ``engine``; call before its first connection"""
+    if not _is_file_sqlite(str(engine.url)):
+        return
+
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection, pragmas)
+
+    logger.info(f"SQLite pragmas enabled: {dict(pragmas)}")
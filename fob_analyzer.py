@@ -2,7 +2,17 @@ import cv2
 import numpy as np
 import os
 import logging
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Dict, List, Tuple, Optional, Any, Sequence, Union
+from imaging import (FrameContext, ImageSource, Rendition, RoiTracker, WorkingImage, as_frame_context,
+                     box_kernel, describe_source, load_image, primary_rendition, save_renditions, source_basename)
+
+# Long-side size (px) of the frame used to locate the strip in sobel_crop.
+# The strip itself is cropped from the full-resolution image.
+WORKING_MAX_DIM = 800
+
+# Morphology kernels shared by every call
+KERNEL_3X3 = box_kernel(3)
+LINE_KERNEL = box_kernel(3, 20)  # joins the horizontal segments of a test line
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 
@@ -36,20 +46,30 @@ def load_templates(template_dir: str = "templates") -> Dict[str, np.ndarray]:
     
     return templates
 
-def sobel_crop(image: np.ndarray, debug: bool = False) -> Tuple[Optional[np.ndarray], Optional[Tuple[int,int,int,int]]]:
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (21, 21), 0)
-    grad_x = cv2.Sobel(blurred, cv2.CV_64F, 1, 0, ksize=3)
-    grad_y = cv2.Sobel(blurred, cv2.CV_64F, 0, 1, ksize=3)
+def sobel_crop(image: Union[np.ndarray, WorkingImage], debug: bool = False, max_dim: int = WORKING_MAX_DIM,
+               source_scale: float = 1.0) -> Tuple[Optional[np.ndarray], Optional[Tuple[int,int,int,int]]]:
+    """Locate the strip on a downsampled frame and crop it from the full-resolution image."""
+    if isinstance(image, WorkingImage):
+        work = image
+    else:
+        work = WorkingImage(image, max_dim, source_scale=source_scale)
+    image = work.full
+    blurred = work.context.gaussian_blur(work.kernel(21, odd=True))
+    # 16-bit gradients are exact for 8-bit input with ksize=3
+    grad_x = cv2.Sobel(blurred, cv2.CV_16S, 1, 0, ksize=3)
+    grad_y = cv2.Sobel(blurred, cv2.CV_16S, 0, 1, ksize=3)
     sobel_edges = cv2.addWeighted(cv2.convertScaleAbs(grad_x), 0.5,
                                   cv2.convertScaleAbs(grad_y), 0.5, 0)
     _show("Sobel Edges", sobel_edges, debug=debug)
-    _, edges = cv2.threshold(sobel_edges, 18, 255, cv2.THRESH_BINARY)
-    edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8), iterations=6)
+    # Gradients steepen as the frame shrinks, so the edge threshold rises with it.
+    # The closing pass stays at 6 working-pixel iterations, which bridges
+    # proportionally wider gaps at lower resolution.
+    _, edges = cv2.threshold(sobel_edges, 18 / work.constant_scale, 255, cv2.THRESH_BINARY)
+    edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, KERNEL_3X3, iterations=6)
     _show("Binary Edges", edges, debug=debug)
     contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     best_bbox, max_area = None, 0
-    img_area = image.shape[0] * image.shape[1]
+    img_area = edges.shape[0] * edges.shape[1]
     for c in contours:
         area = cv2.contourArea(c)
         if not (img_area * 0.05 < area < img_area * 0.9):
@@ -65,33 +85,39 @@ def sobel_crop(image: np.ndarray, debug: bool = False) -> Tuple[Optional[np.ndar
                 max_area = w * h
                 best_bbox = (x, y, w, h)
     if best_bbox:
-        x, y, w, h = best_bbox
+        x, y, w, h = work.to_full_bbox(best_bbox)
+        best_bbox = (x, y, w, h)
         cropped = image[y:y + h, x:x + w]
         _show("Cropped Strip", cropped, debug=debug)
         return cropped, best_bbox
     return None, None
 
-def edge_preprocess(image: np.ndarray) -> np.ndarray:
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
-    gray = clahe.apply(gray)
-    edges = cv2.adaptiveThreshold(
-        gray, 255,
-        cv2.ADAPTIVE_THRESH_MEAN_C,
-        cv2.THRESH_BINARY_INV, 15, 5
-    )
-    edges = cv2.GaussianBlur(edges, (3, 3), 0)
-    kernel = np.ones((3, 3), np.uint8)
-    edges = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
-    return edges
+def edge_preprocess(image: Union[np.ndarray, FrameContext]) -> np.ndarray:
+    """Edge map used for template matching, memoized on the frame context."""
+    ctx = as_frame_context(image)
+
+    def compute():
+        clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
+        gray = clahe.apply(ctx.gray)
+        edges = cv2.adaptiveThreshold(
+            gray, 255,
+            cv2.ADAPTIVE_THRESH_MEAN_C,
+            cv2.THRESH_BINARY_INV, 15, 5
+        )
+        edges = cv2.GaussianBlur(edges, (3, 3), 0)
+        return cv2.morphologyEx(edges, cv2.MORPH_CLOSE, KERNEL_3X3)
+
+    return ctx.cached('fob_edges', compute)
 
 def multi_scale_match(
-    image: np.ndarray,
+    image: Union[np.ndarray, FrameContext],
     template_edges: np.ndarray,
     scales: np.ndarray = np.linspace(0.5, 1.5, 15),
     method: int = cv2.TM_CCORR_NORMED
 ) -> Tuple[float, Optional[np.ndarray], Optional[Tuple[int,int,int,int]], Optional[Tuple[int,int]]]:
-    img_edges = edge_preprocess(image)
+    ctx = as_frame_context(image)
+    image = ctx.image
+    img_edges = edge_preprocess(ctx)
     best_score = -1.0
     best_loc = None
     best_size = None
@@ -101,8 +127,7 @@ def multi_scale_match(
         if new_w < 10 or new_h < 10:
             continue
         resized_template = cv2.resize(template_edges, (new_w, new_h))
-        kernel = np.ones((3, 3), np.uint8)
-        resized_template = cv2.morphologyEx(resized_template, cv2.MORPH_CLOSE, kernel)
+        resized_template = cv2.morphologyEx(resized_template, cv2.MORPH_CLOSE, KERNEL_3X3)
         if img_edges.shape[0] < new_h or img_edges.shape[1] < new_w:
             continue
         result = cv2.matchTemplate(img_edges, resized_template, method)
@@ -119,10 +144,12 @@ def multi_scale_match(
     return best_score, roi, roi_box, best_loc
 
 def match_with_templates_dict(
-    image: np.ndarray,
+    image: Union[np.ndarray, FrameContext],
     templates: Dict[str, np.ndarray],
     threshold: float = 0.6
 ) -> Tuple[Optional[np.ndarray], Optional[Tuple[int,int,int,int]], float, Optional[str], Optional[Tuple[int,int,int,int]]]:
+    # Shared context so the strip's edge map is computed once for all templates
+    image = as_frame_context(image)
     best_score = -1.0
     best_roi, best_box = None, None
     best_name = None
@@ -135,9 +162,11 @@ def match_with_templates_dict(
         return best_roi, best_box, best_score, best_name, best_box
     return None, None, best_score, None, None
 
-def circle_based_roi(cropped_strip: np.ndarray, debug: bool = False) -> Tuple[Optional[np.ndarray], Optional[Tuple[int,int,int,int]]]:
-    gray = cv2.cvtColor(cropped_strip, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.medianBlur(gray, 5)
+def circle_based_roi(cropped_strip: Union[np.ndarray, FrameContext], debug: bool = False) -> Tuple[Optional[np.ndarray], Optional[Tuple[int,int,int,int]]]:
+    ctx = as_frame_context(cropped_strip)
+    cropped_strip = ctx.image
+    gray = ctx.gray
+    blurred = ctx.median_blur(5)
     gray_eq = cv2.equalizeHist(blurred)
     h, w = gray.shape
     expected_r = int(0.10 * h)
@@ -146,44 +175,48 @@ def circle_based_roi(cropped_strip: np.ndarray, debug: bool = False) -> Tuple[Op
                                param1=80, param2=50,
                                minRadius=int(expected_r * 0.8),
                                maxRadius=int(expected_r * 1.2))
-    debug_img = cropped_strip.copy()
     if circles is None:
         return None, None
     circles = np.round(circles[0, :]).astype("int")
     cx, cy, r = sorted(circles, key=lambda c: c[1], reverse=True)[0]
-    cv2.circle(debug_img, (cx, cy), r, (0, 255, 0), 2)
     y_start = max(0, cy - int(r * 4.5))
     y_end = min(h, y_start + int(r * 2.7))
     x_start = max(0, cx - int(r * 0.65))
     x_end = min(w, cx + int(r * 0.65))
     roi = cropped_strip[y_start:y_end, x_start:x_end]
-    cv2.rectangle(debug_img, (x_start, y_start), (x_end, y_end), (0, 0, 255), 2)
-    _show("Circle ROI Debug", debug_img, debug=debug)
+    if debug:
+        debug_img = cropped_strip.copy()
+        cv2.circle(debug_img, (cx, cy), r, (0, 255, 0), 2)
+        cv2.rectangle(debug_img, (x_start, y_start), (x_end, y_end), (0, 0, 255), 2)
+        _show("Circle ROI Debug", debug_img, debug=debug)
     return roi, (x_start, y_start, x_end - x_start, y_end - y_start)
 
-def detect_lines(roi: np.ndarray, min_vertical_gap: int = 20, debug: bool = False) -> List[Tuple[int,int,int,int]]:
-    hsv = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
+def detect_lines(roi: Union[np.ndarray, FrameContext], min_vertical_gap: int = 20, debug: bool = False) -> List[Tuple[int,int,int,int]]:
+    ctx = as_frame_context(roi)
+    roi = ctx.image
+    hsv = ctx.hsv
     mask1 = cv2.inRange(hsv, np.array([0, 15, 80]), np.array([15, 255, 255]))
     mask2 = cv2.inRange(hsv, np.array([165, 15, 80]), np.array([179, 255, 255]))
     color_mask = cv2.bitwise_or(mask1, mask2)
-    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
-    adapt = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+    adapt = cv2.adaptiveThreshold(ctx.gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
                                   cv2.THRESH_BINARY_INV, 51, 21)
     combined = cv2.bitwise_and(color_mask, adapt)
     _show("Combined Mask", combined, debug=debug)
-    dilated = cv2.dilate(combined, np.ones((3, 20), np.uint8), iterations=2)
+    dilated = cv2.dilate(combined, LINE_KERNEL, iterations=2)
     _show("Dilated Mask", dilated, debug=debug)
     contours, _ = cv2.findContours(dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     lines, roi_h = [], roi.shape[0]
-    debug_img = roi.copy()
     for c in contours:
         x, y, w, h = cv2.boundingRect(c)
         if cv2.contourArea(c) > 100 and w > 20 and 5 <= h < 35 and w / h > 1:
             cy = y + h / 2
             if roi_h * 0.15 < cy < roi_h * 0.95:
                 lines.append((x, y, w, h))
-                cv2.rectangle(debug_img, (x, y), (x + w, y + h), (0, 0, 255), 2)
-    _show("Detected Lines", debug_img, debug=debug)
+    if debug:
+        debug_img = roi.copy()
+        for x, y, w, h in lines:
+            cv2.rectangle(debug_img, (x, y), (x + w, y + h), (0, 0, 255), 2)
+        _show("Detected Lines", debug_img, debug=debug)
     lines.sort(key=lambda b: b[1])
     filtered = []
     for l in lines:
@@ -215,81 +248,136 @@ def draw_roi_bbox_on_strip(strip: np.ndarray, roi_box: Tuple[int,int,int,int], t
     cv2.putText(vis, label, (x, max(0, y - 8)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
     return vis
 
-def analyze_fob(image_path: str, templates_dir: str = "templates", debug: bool = False, result_folder: str = "result_images", analysis_id: str = None) -> Dict[str, Any]:
-    image = cv2.imread(image_path)
-    if image is None:
-        return {"status": "error", "message": f"Failed to load image: {image_path}"}
-    
-    # Try to load templates, but don't fail if they're missing
-    templates = load_templates(templates_dir)
-    
-    cropped_strip, strip_box = sobel_crop(image, debug=debug)
+def _detect_strip_and_roi(work: WorkingImage, templates_dir: str, debug: bool) -> Dict[str, Any]:
+    """Full detection: strip box in full-resolution pixels, ROI box relative to the strip."""
+    cropped_strip, strip_box = sobel_crop(work, debug=debug)
     if cropped_strip is None:
         return {"status": "error", "message": "Could not crop strip"}
-    
+    strip_ctx = work.full_context.roi(strip_box)
+
+    # Try to load templates, but don't fail if they're missing
+    templates = load_templates(templates_dir)
+
     roi, roi_box, score, best_template_name = None, None, 0.0, None
     method_used = "circle"  # Default to circle method
     
     # Try template matching if templates are available
     if templates:
         roi, roi_box, score, best_template_name, _ = match_with_templates_dict(
-            cropped_strip, templates, threshold=0.6
+            strip_ctx, templates, threshold=0.6
         )
         if roi is not None:
             method_used = "template"
     
     # Fallback to circle detection if template matching failed or no templates
     if roi is None:
-        roi_cd, roi_cd_box = circle_based_roi(cropped_strip, debug=debug)
+        roi_cd, roi_cd_box = circle_based_roi(strip_ctx, debug=debug)
         if roi_cd is None:
             return {
                 "status": "error",
                 "message": "Both template matching and circle detection failed",
                 "template_best_score": float(score)
             }
-        roi, roi_box = roi_cd, roi_cd_box
+        roi_box = roi_cd_box
         method_used = "circle"
-    # Draw and show/save the ROI bounding box on the cropped strip
-    vis_strip = cropped_strip.copy()
-    roi_box_img = draw_roi_bbox_on_strip(
-        vis_strip,
-        roi_box if roi_box is not None else (0, 0, vis_strip.shape[1], vis_strip.shape[0]),
-        best_template_name if method_used=="template" else None
-    )
-    _show("ROI Bounding Box (before cropping)", roi_box_img, debug=debug)
+
+    return {
+        "status": "ok",
+        "strip_box": strip_box,
+        "roi_box": roi_box,
+        "method": method_used,
+        "template_best_score": float(score),
+        "best_template": best_template_name
+    }
+
+def analyze_fob(image_path: ImageSource, templates_dir: str = "templates", debug: bool = False, result_folder: Optional[str] = "result_images", analysis_id: str = None,
+                tracker: Optional[RoiTracker] = None, renditions: Optional[Sequence[Rendition]] = None,
+                encoder=None) -> Dict[str, Any]:
+    """
+    Analyze an FOB cassette image.
+
+    Pass the same ``tracker`` for consecutive frames of one strip (burst or
+    video) to reuse the strip and ROI boxes while the strip stays in view.
+    ``renditions`` selects the sizes/encoders the result image is saved in
+    (imaging.DEFAULT_RENDITIONS if None); with an ``encoder``
+    (result_encoder.ResultEncoder) they are written in the background.
+    """
+    # Always a full decode: template sizes and the line-detection thresholds
+    # on the cropped strip are in original-upload pixels, so a reduced decode
+    # would change which lines pass them
+    image, _ = load_image(image_path)
+    if image is None:
+        return {"status": "error", "message": f"Failed to load image: {describe_source(image_path)}"}
+    
+    work = WorkingImage(image, WORKING_MAX_DIM)
+    tracked = tracker.lookup(image) if tracker else None
+    if tracked:
+        geometry, (dx, dy) = tracked
+        x, y, w, h = geometry["strip_box"]
+        geometry = dict(geometry, strip_box=(x + dx, y + dy, w, h))
+    else:
+        geometry = _detect_strip_and_roi(work, templates_dir, debug)
+        if geometry["status"] != "ok":
+            return geometry
+        if tracker:
+            tracker.store(image, geometry["strip_box"], geometry)
+
+    strip_box, roi_box = geometry["strip_box"], geometry["roi_box"]
+    method_used, score = geometry["method"], geometry["template_best_score"]
+    best_template_name = geometry["best_template"]
+    # Every later stage reads gray/HSV/edge views of the strip from one context
+    strip_ctx = work.full_context.roi(strip_box)
+    cropped_strip = strip_ctx.image
+    x_roi, y_roi, w_roi, h_roi = roi_box
+    roi = cropped_strip[y_roi:y_roi + h_roi, x_roi:x_roi + w_roi]
+    if debug:
+        # Show the ROI bounding box on the cropped strip (draw_roi_bbox_on_strip copies)
+        roi_box_img = draw_roi_bbox_on_strip(
+            cropped_strip,
+            roi_box if roi_box is not None else (0, 0, cropped_strip.shape[1], cropped_strip.shape[0]),
+            best_template_name if method_used=="template" else None
+        )
+        _show("ROI Bounding Box (before cropping)", roi_box_img, debug=debug)
 
     # --- Add missing ROI crop, line detection, and result classification ---
     h_roi = roi.shape[0]
     y1 = int(h_roi * 0.20)
     y2 = int(h_roi * 0.85)
-    roi_cropped = roi[y1:y2, :]
+    x_roi, y_roi = roi_box[:2]
+    roi_cropped = strip_ctx.roi((x_roi, y_roi + y1, roi.shape[1], y2 - y1))
     lines = detect_lines(roi_cropped, debug=debug)
-    result_text = classify_result(lines, roi_cropped.shape[0])
+    result_text = classify_result(lines, roi_cropped.image.shape[0])
+    if tracked and result_text == "invalid":
+        # The reused geometry may no longer fit; detect afresh on the next frame
+        tracker.reset()
 
-    # Draw bounding box around detected ROI and detected lines on cropped strip
-    final_img = cropped_strip.copy()
-    if roi_box is not None:
-        x_roi, y_roi, w_roi, h_roi = roi_box
-        # Draw actual ROI bounding box on cropped strip
-        cv2.rectangle(final_img, (x_roi, y_roi), (x_roi + w_roi, y_roi + h_roi), (255, 0, 0), 2)
-        cv2.putText(final_img, "ROI", (x_roi, max(0, y_roi - 8)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
-        # Overlay detected lines at correct position inside ROI
-        for line in lines:
-            x, y, w, h = line
-            # Lines are relative to cropped ROI, so offset by ROI position and y1 crop
-            cv2.rectangle(final_img, (x_roi + x, y_roi + y + y1), (x_roi + x + w, y_roi + y + h + y1), (0, 255, 0), 2)
+    # Annotated copy of the strip, made only when it is saved or shown
+    result_images = []
+    result_renditions = {}
+    if result_folder or debug:
+        # Draw bounding box around detected ROI and detected lines on cropped strip
+        final_img = cropped_strip.copy()
+        if roi_box is not None:
+            x_roi, y_roi, w_roi, h_roi = roi_box
+            # Draw actual ROI bounding box on cropped strip
+            cv2.rectangle(final_img, (x_roi, y_roi), (x_roi + w_roi, y_roi + h_roi), (255, 0, 0), 2)
+            cv2.putText(final_img, "ROI", (x_roi, max(0, y_roi - 8)), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 0, 0), 2)
+            # Overlay detected lines at correct position inside ROI
+            for line in lines:
+                x, y, w, h = line
+                # Lines are relative to cropped ROI, so offset by ROI position and y1 crop
+                cv2.rectangle(final_img, (x_roi + x, y_roi + y + y1), (x_roi + x + w, y_roi + y + h + y1), (0, 255, 0), 2)
 
-    _show("Cropped Strip with ROI and Detected Lines", final_img, debug=debug)
+        _show("Cropped Strip with ROI and Detected Lines", final_img, debug=debug)
 
-    # Save the final annotated image
-    os.makedirs(result_folder, exist_ok=True)
-    base_name = os.path.splitext(os.path.basename(image_path))[0]
-    if analysis_id:
-        filename = f"{analysis_id}_fob_result.jpg"
-    else:
-        filename = f"{base_name}_fob_result.jpg"
-    output_path = os.path.join(result_folder, filename)
-    cv2.imwrite(output_path, final_img)
+        # Save the final annotated image
+        if result_folder:
+            if analysis_id:
+                filename = f"{analysis_id}_fob_result.jpg"
+            else:
+                filename = f"{source_basename(image_path)}_fob_result.jpg"
+            result_renditions = save_renditions(final_img, result_folder, filename, renditions, encoder)
+            result_images.append(primary_rendition(result_renditions))
 
     # Now return the result dictionary
     return {
@@ -299,7 +387,9 @@ def analyze_fob(image_path: str, templates_dir: str = "templates", debug: bool =
         "method": method_used,
         "template_best_score": float(score),
         "best_template": best_template_name,
-        "result_images": [output_path]
+        "tracked": bool(tracked),
+        "result_images": result_images,
+        "result_renditions": result_renditions
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,536 @@
+"""
+Shared image preprocessing for the test strip analyzers
+Header-aware decoding, per-frame caching of derived views,
+working-resolution normalization and coordinate back-mapping
+"""
+import functools
+import os
+import threading
+import cv2
+import numpy as np
+from typing import Any, Callable, Dict, Hashable, Iterable, Mapping, NamedTuple, Optional, Sequence, Tuple, Union
+
+# Optional: Pillow reads image headers without decoding pixels
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+Number = Union[int, float]
+
+EXIF_ORIENTATION_TAG = 0x0112
+# EXIF orientations that swap width and height when applied
+_TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+# Formats libjpeg can decode at 1/2, 1/4 and 1/8 scale in the DCT domain
+_REDUCED_DECODE_FORMATS = {'JPEG', 'MPO'}
+_REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+class ImageHeader(NamedTuple):
+    """Image metadata read without decoding pixels (dimensions are after EXIF orientation)"""
+    width: int
+    height: int
+    format: str
+    orientation: int
+
+
+def read_image_header(image_path: str) -> Optional[ImageHeader]:
+    """
+    Read dimensions, format and EXIF orientation from the file header.
+
+    Returns None if Pillow is unavailable or the header cannot be parsed.
+    """
+    if not PIL_AVAILABLE:
+        return None
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+            image_format = img.format or ''
+            orientation = img.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    except Exception:
+        return None
+
+    # cv2.imread applies the EXIF orientation, so report the displayed size
+    if orientation in _TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    return ImageHeader(width, height, image_format, orientation)
+
+
+def reduced_decode_factor(header: ImageHeader, min_dim: Optional[int] = None,
+                          min_width: Optional[int] = None) -> int:
+    """
+    Pick the largest JPEG reduction (1, 2, 4 or 8) that keeps the decoded
+    image at or above the requested long side and/or width.
+    """
+    headroom = []
+    if min_dim:
+        headroom.append(max(header.width, header.height) / float(min_dim))
+    if min_width:
+        headroom.append(header.width / float(min_width))
+    if not headroom:
+        return 1
+
+    for factor in (8, 4, 2):
+        if min(headroom) >= factor:
+            return factor
+    return 1
+
+
+ImageSource = Union[str, np.ndarray]
+
+
+def describe_source(image_path: ImageSource) -> str:
+    """Short label for an image path or in-memory frame, safe for log messages"""
+    if isinstance(image_path, np.ndarray):
+        return f"<frame {image_path.shape[1]}x{image_path.shape[0]}>"
+    return str(image_path)
+
+
+def source_basename(image_path: ImageSource, default: str = "frame") -> str:
+    """File name without extension, or a default for in-memory frames"""
+    if isinstance(image_path, np.ndarray):
+        return default
+    return os.path.splitext(os.path.basename(image_path))[0]
+
+
+def load_image(image_path: ImageSource, min_dim: Optional[int] = None,
+               min_width: Optional[int] = None) -> Tuple[Optional[np.ndarray], float]:
+    """
+    Decode an image no larger than the analyzer needs.
+
+    Large JPEGs are decoded at 1/2, 1/4 or 1/8 scale directly in the DCT
+    domain, which cuts both decode time and peak memory. Other formats (or
+    images already near the target) are decoded normally. Already-decoded
+    frames (e.g. from video) are passed through unchanged.
+
+    Args:
+        image_path: Path to the image file, or a decoded BGR frame
+        min_dim: Smallest acceptable long side of the decoded image
+        min_width: Smallest acceptable width of the decoded image
+
+    Returns:
+        Tuple of (image, decode_scale)
+        - image: BGR image, or None if it could not be decoded
+        - decode_scale: decoded width / original width (1.0 for a full decode)
+    """
+    if isinstance(image_path, np.ndarray):
+        return image_path, 1.0
+
+    header = read_image_header(image_path)
+    if header and header.format in _REDUCED_DECODE_FORMATS:
+        factor = reduced_decode_factor(header, min_dim=min_dim, min_width=min_width)
+        if factor > 1:
+            image = cv2.imread(image_path, _REDUCED_DECODE_FLAGS[factor])
+            if image is not None:
+                return image, image.shape[1] / float(header.width)
+
+    return cv2.imread(image_path), 1.0
+
+
+class FrameContext:
+    """
+    Per-image cache of derived representations.
+
+    Gray, HSV, blurred and edge views are computed on first use and reused by
+    every later stage, so no colour conversion runs twice for the same frame.
+    ``roi`` returns a child context for a sub-region; a child slices the
+    parent's gray/HSV views when the parent already has them instead of
+    converting its pixels again.
+    """
+
+    def __init__(self, image: np.ndarray, parent: Optional["FrameContext"] = None,
+                 bbox: Optional[Tuple[int, int, int, int]] = None):
+        self.image = image
+        self._parent = parent
+        self._bbox = bbox
+        self._cache: Dict[Hashable, Any] = {}
+
+    def cached(self, key: Hashable, compute: Callable[[], Any]) -> Any:
+        """Return the memoized value for key, computing it on first use"""
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def _from_parent(self, key: str) -> Optional[np.ndarray]:
+        if self._parent is None or key not in self._parent._cache:
+            return None
+        x, y, w, h = self._bbox
+        return self._parent._cache[key][y:y + h, x:x + w]
+
+    def _converted(self, key: str, code: int) -> np.ndarray:
+        def compute():
+            view = self._from_parent(key)
+            return view if view is not None else cv2.cvtColor(self.image, code)
+        return self.cached(key, compute)
+
+    @property
+    def gray(self) -> np.ndarray:
+        return self._converted('gray', cv2.COLOR_BGR2GRAY)
+
+    @property
+    def hsv(self) -> np.ndarray:
+        return self._converted('hsv', cv2.COLOR_BGR2HSV)
+
+    def median_blur(self, ksize: int) -> np.ndarray:
+        """Median-blurred gray view"""
+        return self.cached(('median', ksize), lambda: cv2.medianBlur(self.gray, ksize))
+
+    def gaussian_blur(self, ksize: int) -> np.ndarray:
+        """Gaussian-blurred gray view"""
+        return self.cached(('gaussian', ksize), lambda: cv2.GaussianBlur(self.gray, (ksize, ksize), 0))
+
+    def canny(self, low: int, high: int, blur_ksize: int = 5) -> np.ndarray:
+        """Canny edges of the Gaussian-blurred gray view"""
+        return self.cached(('canny', low, high, blur_ksize),
+                           lambda: cv2.Canny(self.gaussian_blur(blur_ksize), low, high))
+
+    def roi(self, bbox: Tuple[int, int, int, int]) -> "FrameContext":
+        """Child context for an (x, y, w, h) region, sliced like image[y:y+h, x:x+w]"""
+        x, y, w, h = bbox
+        return FrameContext(self.image[y:y + h, x:x + w], parent=self, bbox=(x, y, w, h))
+
+
+def as_frame_context(image) -> FrameContext:
+    """Wrap a plain frame in a FrameContext; existing contexts pass through"""
+    if isinstance(image, FrameContext):
+        return image
+    return FrameContext(image)
+
+
+class WorkingImage:
+    """
+    Downsampled view of a full-resolution frame used for detection.
+
+    Detection (Hough transforms, thresholding, morphology, contour search)
+    runs on ``image``, which is at most ``max_dim`` pixels on its long side.
+    Detected geometry is mapped back to ``full`` for colour sampling, so the
+    colour measurements keep their full-resolution precision.
+
+    Pixel-size constants that were tuned against the original upload (radii,
+    areas, kernel sizes) should go through ``length``, ``area`` and ``kernel``
+    so they keep their meaning at the working scale. When ``full`` came from a
+    reduced decode, pass its ``source_scale`` so the constants account for it.
+    """
+
+    def __init__(self, full: np.ndarray, max_dim: int, upscale: bool = False,
+                 source_scale: float = 1.0):
+        self.full = full
+        # Scale of ``full`` relative to the original upload (see load_image)
+        self.source_scale = source_scale
+        self._context = None
+        self._full_context = None
+        h, w = full.shape[:2]
+        scale = float(max_dim) / max(h, w, 1)
+        if not upscale:
+            scale = min(1.0, scale)
+
+        if scale != 1.0:
+            size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+            interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+            self.image = cv2.resize(full, size, interpolation=interpolation)
+            # Use the realised ratio so back-mapping lands on the right pixel
+            self.scale = size[0] / float(w)
+        else:
+            self.image = full
+            self.scale = 1.0
+
+    @classmethod
+    def fit_width(cls, full: np.ndarray, width: int, source_scale: float = 1.0) -> "WorkingImage":
+        """Normalize to an exact width (up or down) for analyzers tuned to a fixed frame width"""
+        h, w = full.shape[:2]
+        return cls(full, int(round(width * max(h, w) / float(max(w, 1)))), upscale=True,
+                   source_scale=source_scale)
+
+    @property
+    def is_downscaled(self) -> bool:
+        return self.scale < 1.0
+
+    @property
+    def is_rescaled(self) -> bool:
+        return self.scale != 1.0
+
+    @property
+    def context(self) -> FrameContext:
+        """Cached derived views of the working-resolution frame"""
+        if self._context is None:
+            self._context = FrameContext(self.image)
+        return self._context
+
+    @property
+    def full_context(self) -> FrameContext:
+        """Cached derived views of the full-resolution frame (shared when not rescaled)"""
+        if not self.is_rescaled:
+            return self.context
+        if self._full_context is None:
+            self._full_context = FrameContext(self.full)
+        return self._full_context
+
+    @property
+    def constant_scale(self) -> float:
+        """Working pixels per original-upload pixel, used to scale tuned constants"""
+        return self.scale * self.source_scale
+
+    # ---------------------- Constant scaling ----------------------
+    def length(self, value: Number, minimum: int = 1) -> int:
+        """Scale a full-resolution length (radius, distance) to working pixels"""
+        return max(minimum, int(round(value * self.constant_scale)))
+
+    def area(self, value: Number) -> float:
+        """Scale a full-resolution area to working pixels"""
+        return value * self.constant_scale * self.constant_scale
+
+    def kernel(self, size: int, odd: bool = False) -> int:
+        """Scale a kernel size, optionally forcing an odd value for blurs"""
+        k = self.length(size)
+        if odd and k % 2 == 0:
+            k += 1
+        return k
+
+    # ---------------------- Back-mapping ----------------------
+    def to_full_length(self, value: Number) -> int:
+        return int(round(value / self.scale))
+
+    def to_full_point(self, point: Tuple[Number, Number]) -> Tuple[int, int]:
+        x, y = point
+        return self.to_full_length(x), self.to_full_length(y)
+
+    def to_full_bbox(self, bbox: Tuple[Number, Number, Number, Number]) -> Tuple[int, int, int, int]:
+        """Map an (x, y, w, h) box to full resolution"""
+        x, y, w, h = bbox
+        x0, y0 = self.to_full_length(x), self.to_full_length(y)
+        return x0, y0, self.to_full_length(x + w) - x0, self.to_full_length(y + h) - y0
+
+    def to_full_area(self, value: Number) -> float:
+        return value / (self.scale * self.scale)
+
+
+def as_working_image(image, max_dim: Optional[int] = None) -> WorkingImage:
+    """Wrap a plain frame in a WorkingImage; existing WorkingImages pass through"""
+    if isinstance(image, WorkingImage):
+        return image
+    return WorkingImage(image, max_dim or max(image.shape[:2]))
+
+
+@functools.lru_cache(maxsize=64)
+def box_kernel(height: int, width: Optional[int] = None) -> np.ndarray:
+    """Shared all-ones morphology kernel; read-only, allocated once per size"""
+    kernel = np.ones((height, width or height), np.uint8)
+    kernel.setflags(write=False)
+    return kernel
+
+
+class Rendition(NamedTuple):
+    """One encoded size of a result image"""
+    name: str
+    max_dim: Optional[int] = None  # long side in pixels; None keeps the full size
+    format: str = "jpeg"           # "jpeg" or "webp"
+    quality: int = 90
+
+
+# format -> (file extension, cv2 quality flag, MIME type)
+RENDITION_FORMATS = {
+    "jpeg": (".jpg", cv2.IMWRITE_JPEG_QUALITY, "image/jpeg"),
+    "webp": (".webp", cv2.IMWRITE_WEBP_QUALITY, "image/webp"),
+}
+FULL_RENDITION = "full"
+DEFAULT_RENDITIONS: Tuple[Rendition, ...] = (
+    Rendition("thumb", max_dim=320, format="webp", quality=70),
+    Rendition(FULL_RENDITION, max_dim=None, format="jpeg", quality=90),
+)
+
+
+def renditions_from_config(specs: Iterable[Mapping[str, Any]]) -> Tuple[Rendition, ...]:
+    """Renditions from config dicts ({"name", "max_dim", "format", "quality"})"""
+    renditions = tuple(Rendition(**spec) for spec in specs)
+    for rendition in renditions:
+        if rendition.format not in RENDITION_FORMATS:
+            raise ValueError(f"Unsupported rendition format: {rendition.format}")
+    return renditions
+
+
+def rendition_filename(filename: str, rendition: Rendition) -> str:
+    """
+    File name of ``rendition`` of a result image. The full rendition keeps
+    the image's own stem (abc_fob_result.jpg); others add their name
+    (abc_fob_result.thumb.webp).
+    """
+    stem = os.path.splitext(filename)[0]
+    ext = RENDITION_FORMATS[rendition.format][0]
+    return stem + ext if rendition.name == FULL_RENDITION else f"{stem}.{rendition.name}{ext}"
+
+
+def encode_rendition(image: np.ndarray, rendition: Rendition) -> bytes:
+    """Downscale (never upscale) and encode a BGR image"""
+    h, w = image.shape[:2]
+    if rendition.max_dim and max(h, w) > rendition.max_dim:
+        scale = rendition.max_dim / float(max(h, w))
+        image = cv2.resize(image, (max(1, int(round(w * scale))), max(1, int(round(h * scale)))),
+                           interpolation=cv2.INTER_AREA)
+    ext, quality_flag, _ = RENDITION_FORMATS[rendition.format]
+    ok, buffer = cv2.imencode(ext, image, [quality_flag, int(rendition.quality)])
+    if not ok:
+        raise ValueError(f"Could not encode {rendition.name} rendition as {rendition.format}")
+    return buffer.tobytes()
+
+
+def write_rendition(image: np.ndarray, rendition: Rendition, path: str):
+    """Encode one rendition to ``path`` via a temporary file, so readers never see a partial image"""
+    data = encode_rendition(image, rendition)
+    tmp_path = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def save_renditions(image: np.ndarray, result_folder: str, filename: str,
+                    renditions: Optional[Sequence[Rendition]] = None, encoder=None) -> Dict[str, str]:
+    """
+    Write every rendition of a result image into ``result_folder``.
+
+    With an ``encoder`` (result_encoder.ResultEncoder) the renditions are
+    encoded in the background and the returned paths may not exist yet.
+
+    Returns:
+        Rendition name -> path
+    """
+    if encoder is not None:
+        return encoder.submit(image, result_folder, filename, renditions)
+    os.makedirs(result_folder, exist_ok=True)
+    paths = {}
+    for rendition in renditions or DEFAULT_RENDITIONS:
+        path = os.path.join(result_folder, rendition_filename(filename, rendition))
+        write_rendition(image, rendition, path)
+        paths[rendition.name] = path
+    return paths
+
+
+def primary_rendition(paths: Mapping[str, str]) -> Optional[str]:
+    """Path listed in an analyzer's ``result_images``: the full rendition, else the last one written"""
+    if not paths:
+        return None
+    return paths.get(FULL_RENDITION) or list(paths.values())[-1]
+
+
+def _subpixel_peak(values: np.ndarray, index: int) -> float:
+    """Refine a peak position by fitting a parabola through it and its neighbours"""
+    if index <= 0 or index >= len(values) - 1:
+        return float(index)
+    left, centre, right = float(values[index - 1]), float(values[index]), float(values[index + 1])
+    denom = left - 2 * centre + right
+    if denom >= 0:
+        return float(index)
+    return index + 0.5 * (left - right) / denom
+
+
+class RoiTracker:
+    """
+    Reuses detected geometry across consecutive frames of the same strip.
+
+    After a full detection, ``store`` keeps a small grayscale signature of an
+    anchor region (e.g. the strip box) alongside the analyzer's geometry. On
+    the next frame ``lookup`` searches for the signature in a slightly
+    enlarged window around the anchor; if it matches well, the stored
+    geometry is returned together with the offset the anchor moved by, and
+    the analyzer can skip detection. Any failure returns None so the caller
+    falls back to full detection.
+    """
+
+    def __init__(self, min_score: float = 0.85, search_margin: float = 0.15,
+                 signature_dim: int = 128):
+        self.min_score = min_score
+        self.search_margin = search_margin
+        self.signature_dim = signature_dim
+        self.hits = 0
+        self.misses = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the tracked geometry; the next lookup misses"""
+        self._geometry = None
+        self._origin = None
+        self._anchor = None
+        self._signature = None
+        self._factor = 1
+        self._frame_shape = None
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
+
+    def _downsample(self, image: np.ndarray, x: int, y: int, w: int, h: int) -> np.ndarray:
+        """Block-average a region by the integer signature factor (keeps pixel grids aligned)"""
+        f = self._factor
+        w, h = (w // f) * f, (h // f) * f
+        region = image[y:y + h, x:x + w]
+        if f > 1:
+            region = cv2.resize(region, (w // f, h // f), interpolation=cv2.INTER_AREA)
+        # Shrink before the gray conversion so only the small image is converted
+        return cv2.cvtColor(region, cv2.COLOR_BGR2GRAY) if region.ndim == 3 else region
+
+    def store(self, image: np.ndarray, anchor_bbox: Tuple[int, int, int, int], geometry: Any):
+        """Remember geometry detected on ``image``, verified later through ``anchor_bbox``"""
+        x, y, w, h = (int(v) for v in anchor_bbox)
+        self._factor = max(1, max(w, h) // self.signature_dim)
+        if w < self._factor or h < self._factor:
+            self.reset()
+            return
+        self._origin = self._anchor = (x, y, w, h)
+        self._signature = self._downsample(image, x, y, w, h)
+        self._geometry = geometry
+        self._frame_shape = image.shape[:2]
+
+    def lookup(self, image: np.ndarray) -> Optional[Tuple[Any, Tuple[int, int]]]:
+        """
+        Verify the stored geometry against a new frame.
+
+        Returns:
+            Tuple of (geometry, (dx, dy)) where (dx, dy) is the anchor's offset
+            from where the geometry was detected, or None if nothing is
+            tracked or the anchor was not found nearby
+        """
+        if self._geometry is None or image.shape[:2] != self._frame_shape:
+            self.misses += 1
+            return None
+
+        f = self._factor
+        x, y, w, h = self._anchor
+        frame_h, frame_w = image.shape[:2]
+        # Search window: the anchor plus a margin, in whole signature pixels
+        mx = max(1, int(np.ceil(w * self.search_margin / f))) * f
+        my = max(1, int(np.ceil(h * self.search_margin / f))) * f
+        x0, y0 = x - min(mx, (x // f) * f), y - min(my, (y // f) * f)
+        x1, y1 = min(frame_w, x + w + mx), min(frame_h, y + h + my)
+        window = self._downsample(image, x0, y0, x1 - x0, y1 - y0)
+
+        sig_h, sig_w = self._signature.shape[:2]
+        if window.shape[0] < sig_h or window.shape[1] < sig_w:
+            self.misses += 1
+            return None
+
+        scores = cv2.matchTemplate(window, self._signature, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (loc_x, loc_y) = cv2.minMaxLoc(scores)
+        if not score >= self.min_score:
+            self.misses += 1
+            return None
+
+        # A peak on the edge of the search range (other than the frame border)
+        # means the anchor probably moved further than the window covers
+        last_y, last_x = scores.shape[0] - 1, scores.shape[1] - 1
+        if ((loc_x == 0 and x0 > 0) or (loc_x == last_x and x1 + f <= frame_w)
+                or (loc_y == 0 and y0 > 0) or (loc_y == last_y and y1 + f <= frame_h)):
+            self.misses += 1
+            return None
+
+        new_x = int(round(x0 + _subpixel_peak(scores[loc_y], loc_x) * f))
+        new_y = int(round(y0 + _subpixel_peak(scores[:, loc_x], loc_y) * f))
+        # Keep the anchor inside the frame
+        new_x = min(max(new_x, 0), frame_w - w)
+        new_y = min(max(new_y, 0), frame_h - h)
+        self._anchor = (new_x, new_y, w, h)
+        self.hits += 1
+        return self._geometry, (new_x - self._origin[0], new_y - self._origin[1])
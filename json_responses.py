@@ -0,0 +1,113 @@
+"""
+JSON encoding and compression for API responses
+Analyzer results carry NumPy scalars and small arrays; with orjson (in
+requirements.txt) the provider serializes them natively, without
+intermediate ``tolist()`` copies. Without it, the stdlib fallback converts
+them through Python lists. Both write NaN and infinities as null, so the
+output does not depend on which encoder is installed. Large JSON bodies
+are gzip-compressed when the client accepts it.
+"""
+import gzip
+import json
+import math
+from typing import Any
+
+import numpy as np
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    # orjson not installed: stdlib json with a NumPy-aware default (slower, copies arrays)
+    orjson = None
+
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS if orjson else 0
+
+# Responses smaller than this are not worth compressing (bytes)
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+COMPRESSIBLE_MIMETYPES = ("application/json",)
+
+
+def numpy_default(o: Any) -> Any:
+    """json ``default`` hook for NumPy (and what Flask's default provider handles)"""
+    if isinstance(o, np.generic):
+        return o.item()
+    if isinstance(o, np.ndarray):
+        return o.tolist()
+    return DefaultJSONProvider.default(o)
+
+
+def _finite(obj: Any) -> Any:
+    """``obj`` with NaN and infinite floats replaced by None, as orjson writes them"""
+    if isinstance(obj, (float, np.floating)):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, np.ndarray):
+        return _finite(obj.tolist())
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(v) for v in obj]
+    return obj
+
+
+def _stdlib_dumps(obj: Any, **kwargs: Any) -> str:
+    kwargs.setdefault("default", numpy_default)
+    try:
+        return json.dumps(obj, allow_nan=False, **kwargs)
+    except ValueError:
+        # Rare: only results with NaN/Inf pay for the second pass
+        return json.dumps(_finite(obj), allow_nan=False, **kwargs)
+
+
+class NumpyJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that accepts NumPy scalars and arrays anywhere in a response"""
+
+    default = staticmethod(numpy_default)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        # orjson only for the compact form Flask uses outside debug mode
+        if orjson is not None and not kwargs.get("indent"):
+            option = ORJSON_OPTIONS
+            if kwargs.get("sort_keys", self.sort_keys):
+                option |= orjson.OPT_SORT_KEYS
+            return orjson.dumps(obj, default=numpy_default, option=option).decode()
+        kwargs.setdefault("ensure_ascii", self.ensure_ascii)
+        kwargs.setdefault("sort_keys", self.sort_keys)
+        return _stdlib_dumps(obj, **kwargs)
+
+
+def dumps(obj: Any) -> str:
+    """Compact NumPy-aware JSON (e.g. for Analysis.raw_data)"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=numpy_default, option=ORJSON_OPTIONS).decode()
+    return _stdlib_dumps(obj)
+
+
+def compress_response(response, accept_encodings, min_size: int = COMPRESS_MIN_SIZE,
+                      level: int = COMPRESS_LEVEL):
+    """
+    Gzip a buffered JSON response in place if the client accepts gzip and
+    the body is at least ``min_size`` bytes. Streams, already-encoded and
+    partial responses are left alone.
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or response.status_code < 200 or response.status_code >= 300
+            or "Content-Encoding" in response.headers):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    if not accept_encodings["gzip"]:
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=level))
+    response.headers["Content-Encoding"] = "gzip"
+    # A strong validator must differ per encoding; weak ones (ours) stay valid
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag + "-gzip")
+    return response
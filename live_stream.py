@@ -0,0 +1,289 @@
+"""
+Live camera frame streaming for the kiosk
+Each stream keeps a single pending-frame slot: a new frame replaces any
+frame still waiting, so the worker always analyzes the most recent frame
+and the backlog never grows. Cheap pre-checks answer "no strip" or
+"hold still" without running the full analyzer.
+
+Results go back on the frame POST itself (optionally waiting a few
+seconds for that frame) or by short long-polling; no request is held for
+the life of a stream, so a sync gunicorn worker is never tied up. Full
+analyses across all streams share a small number of slots, so open
+streams cannot take every CPU from /analyze.
+"""
+import cv2
+import numpy as np
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional
+from utils import compute_quality_metrics, MIN_SHARPNESS, MIN_BRIGHTNESS, MAX_BRIGHTNESS
+from video_analysis import (FRAME_ANALYZERS, FrameAnalyzer, make_frame_analyzer, frame_thumbnails,
+                            frame_difference, STABILITY_THRESHOLD, CHANGE_THRESHOLD)
+
+logger = logging.getLogger(__name__)
+
+# Fraction of thumbnail pixels on a Canny edge below which no strip is in view
+MIN_EDGE_DENSITY = 0.005
+# Completed results kept per stream for clients that poll
+RESULT_HISTORY = 16
+MAX_STREAMS = 32
+MAX_STREAMS_PER_CLIENT = 2
+STREAM_IDLE_TIMEOUT = 120  # seconds
+# Full analyses running at once across every stream
+ANALYSIS_SLOTS = 2
+# Longest a request may wait for a result (well inside gunicorn's --timeout)
+MAX_WAIT = 5.0  # seconds
+
+PRECHECK_MESSAGES = {
+    "no_strip": "No test strip detected. Place the strip in front of the camera.",
+    "hold_still": "Hold the strip still.",
+    "too_dark": "Image too dark. Improve the lighting.",
+    "too_bright": "Image too bright. Avoid glare and direct light.",
+    "blurry": "Image blurry. Hold the strip still and in focus.",
+}
+
+
+class TooManyStreams(RuntimeError):
+    """The client already has its maximum number of streams open"""
+    pass
+
+
+def decode_frame(data: bytes) -> Optional[np.ndarray]:
+    """Decode an encoded image (JPEG, PNG, ...) received over the wire"""
+    if not data:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def precheck_frame(gray_thumb: np.ndarray, motion: float) -> Optional[str]:
+    """
+    Cheap checks run on the thumbnail before the full analyzer.
+
+    Args:
+        gray_thumb: Grayscale thumbnail of the frame
+        motion: Mean absolute difference from the previously processed frame
+
+    Returns:
+        A PRECHECK_MESSAGES key if the frame should not be analyzed, otherwise None
+    """
+    metrics = compute_quality_metrics(gray_thumb)
+    if metrics["brightness"] < MIN_BRIGHTNESS:
+        return "too_dark"
+    if metrics["brightness"] > MAX_BRIGHTNESS:
+        return "too_bright"
+
+    edges = cv2.Canny(gray_thumb, 50, 150)
+    if np.count_nonzero(edges) < MIN_EDGE_DENSITY * edges.size:
+        return "no_strip"
+
+    if motion > STABILITY_THRESHOLD:
+        return "hold_still"
+    if metrics["sharpness"] < MIN_SHARPNESS:
+        return "blurry"
+    return None
+
+
+class LiveStream:
+    """
+    One client's frame stream.
+
+    ``submit`` never blocks on analysis: it drops whatever frame is still
+    waiting and stores the new one. A worker thread processes the pending
+    frame and publishes a result tagged with the frame's sequence number.
+    The full analyzer runs only while holding one of the shared ``slots``.
+    """
+
+    def __init__(self, test_type: str, analyze_frame: Optional[FrameAnalyzer] = None,
+                 owner: Any = None, slots: Optional[threading.Semaphore] = None, client: Any = None):
+        if analyze_frame is None:
+            if test_type not in FRAME_ANALYZERS:
+                raise ValueError(f"Unsupported test type: {test_type}")
+            analyze_frame = make_frame_analyzer(test_type)
+
+        self.stream_id = uuid.uuid4().hex
+        self.test_type = test_type
+        self.owner = owner
+        self.client = client
+        self.last_active = time.monotonic()
+        self.stats = {"received": 0, "dropped": 0, "prechecked": 0, "reused": 0, "analyzed": 0}
+
+        self._analyze_frame = analyze_frame
+        self._slots = slots if slots is not None else nullcontext()
+        self._cond = threading.Condition()
+        self._pending = None
+        self._seq = 0
+        self._results = deque(maxlen=RESULT_HISTORY)
+        self._closed = False
+        self._previous_thumb = None
+        self._analyzed_thumb = None
+        self._analyzed_value = None
+
+        self._worker = threading.Thread(target=self._run, name=f"live-stream-{self.stream_id[:8]}",
+                                        daemon=True)
+        self._worker.start()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def submit(self, frame: np.ndarray) -> int:
+        """Queue a frame for analysis, replacing any frame not yet started. Returns its sequence number"""
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Stream is closed")
+            self._seq += 1
+            self.stats["received"] += 1
+            if self._pending is not None:
+                self.stats["dropped"] += 1
+            self._pending = (self._seq, frame)
+            self.last_active = time.monotonic()
+            self._cond.notify_all()
+            return self._seq
+
+    def latest_result(self) -> Optional[Dict[str, Any]]:
+        with self._cond:
+            return self._results[-1] if self._results else None
+
+    def results_after(self, seq: int, timeout: float = 0.0) -> List[Dict[str, Any]]:
+        """Results for frames after ``seq``, waiting up to ``timeout`` seconds for the first one"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                results = [r for r in self._results if r["seq"] > seq]
+                remaining = deadline - time.monotonic()
+                if results or self._closed or remaining <= 0:
+                    return results
+                self._cond.wait(remaining)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending = None
+            self._cond.notify_all()
+
+    # ---------------------- Worker ----------------------
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                seq, frame = self._pending
+                self._pending = None
+
+            try:
+                result = self._process(frame)
+            except Exception as e:
+                logger.error(f"Live frame {seq} failed: {str(e)}")
+                result = {"status": "error", "message": "Analysis failed"}
+            result["seq"] = seq
+
+            with self._cond:
+                self._results.append(result)
+                self._cond.notify_all()
+
+    def _process(self, frame: np.ndarray) -> Dict[str, Any]:
+        start = time.perf_counter()
+        gray, diff_thumb = frame_thumbnails(frame)
+        motion = frame_difference(self._previous_thumb, diff_thumb)
+        self._previous_thumb = diff_thumb
+
+        # The first frame has nothing to compare with, so it counts as moving
+        check = precheck_frame(gray, motion)
+        if check:
+            self.stats["prechecked"] += 1
+            return {"status": check, "message": PRECHECK_MESSAGES[check]}
+
+        # Same scene as the last full analysis: its answer still holds
+        if (self._analyzed_value is not None
+                and frame_difference(self._analyzed_thumb, diff_thumb) < CHANGE_THRESHOLD):
+            self.stats["reused"] += 1
+            return {"status": "ok", "result": self._analyzed_value, "reused": True}
+
+        with self._slots:
+            value = self._analyze_frame(frame)
+        self._analyzed_thumb = diff_thumb
+        self._analyzed_value = value
+        self.stats["analyzed"] += 1
+        if value is None:
+            return {"status": "unreadable", "message": "Strip found but could not be read. Adjust the framing."}
+        return {
+            "status": "ok",
+            "result": value,
+            "processing_ms": round((time.perf_counter() - start) * 1000, 1)
+        }
+
+
+class StreamRegistry:
+    """
+    Thread-safe registry of open streams with idle expiry.
+
+    Streams are bound to the user who opened them (None for anonymous
+    streams), like pH calibration sessions. Each client (user, or IP when
+    anonymous) may hold at most ``max_per_client`` open streams.
+    """
+
+    def __init__(self, max_streams: int = MAX_STREAMS, idle_timeout: float = STREAM_IDLE_TIMEOUT,
+                 analysis_slots: int = ANALYSIS_SLOTS, max_per_client: int = MAX_STREAMS_PER_CLIENT):
+        self.max_streams = max_streams
+        self.max_per_client = max_per_client
+        self.idle_timeout = idle_timeout
+        self.analysis_slots = threading.BoundedSemaphore(analysis_slots)
+        self._streams: Dict[str, LiveStream] = {}
+        self._lock = threading.Lock()
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_timeout
+        for stream_id, stream in list(self._streams.items()):
+            if stream.last_active < cutoff:
+                stream.close()
+                del self._streams[stream_id]
+
+    def open(self, test_type: str, analyze_frame: Optional[FrameAnalyzer] = None,
+             owner: Any = None, client: Any = None) -> LiveStream:
+        """
+        Start a new stream for ``client`` (defaults to ``owner``).
+
+        Raises:
+            TooManyStreams: the client already has max_per_client streams open
+            RuntimeError: the server is at capacity
+        """
+        if client is None:
+            client = owner
+        with self._lock:
+            self._evict_idle()
+            if sum(1 for s in self._streams.values() if s.client == client) >= self.max_per_client:
+                raise TooManyStreams("Too many open streams; close one first")
+            if len(self._streams) >= self.max_streams:
+                raise RuntimeError("Too many active streams")
+            stream = LiveStream(test_type, analyze_frame, owner=owner, slots=self.analysis_slots,
+                                client=client)
+            self._streams[stream.stream_id] = stream
+            return stream
+
+    def get(self, stream_id: str, owner: Any = None) -> Optional[LiveStream]:
+        """Open stream owned by ``owner``, or None"""
+        with self._lock:
+            self._evict_idle()
+            stream = self._streams.get(stream_id)
+            if stream is None or stream.owner != owner:
+                return None
+            return stream
+
+    def close(self, stream_id: str, owner: Any = None) -> bool:
+        with self._lock:
+            stream = self._streams.get(stream_id)
+            if stream is None or stream.owner != owner:
+                return False
+            del self._streams[stream_id]
+        stream.close()
+        return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._streams)
@@ -0,0 +1,121 @@
+"""
+Structured, lazy and sampled logging for the analysis hot path
+``log_event(logger, "analysis.result", test_type="ph", result=result)``
+emits one record per event instead of an f-string of the whole result:
+- nothing is built when the level is disabled or the event is sampled out
+- the message is only formatted if a handler actually writes the record
+- fields are summarized, never repr'd: arrays become their shape and
+  dtype, long strings, lists and dicts are truncated
+
+With LOG_FORMAT=json, StructuredFormatter writes one JSON object per line
+with the event name and its summarized fields.
+"""
+import json
+import logging
+import random
+from typing import Any, Dict, Mapping, Optional
+import numpy as np
+
+MAX_FIELD_CHARS = 200  # longer strings are cut and marked with the original length
+MAX_ITEMS = 20         # entries kept from a list or dict
+MAX_DEPTH = 3          # nesting levels kept before containers are summarized
+
+# event name -> fraction of events emitted (1.0 when not listed)
+_sample_rates: Dict[str, float] = {}
+_random = random.Random()
+
+
+def configure_sampling(rates: Optional[Mapping[str, float]]):
+    """Replace the per-event sample rates"""
+    _sample_rates.clear()
+    _sample_rates.update({event: max(0.0, min(1.0, float(rate))) for event, rate in (rates or {}).items()})
+
+
+def summarize(value: Any, depth: int = 0) -> Any:
+    """JSON-safe, size-capped stand-in for ``value``"""
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, np.ndarray):
+        return f"<ndarray shape={value.shape} dtype={value.dtype}>"
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f"<{type(value).__name__} len={len(value)}>"
+    if isinstance(value, str):
+        return value if len(value) <= MAX_FIELD_CHARS else f"{value[:MAX_FIELD_CHARS]}...<{len(value)} chars>"
+    if isinstance(value, Mapping):
+        if depth >= MAX_DEPTH:
+            return f"<{type(value).__name__} len={len(value)}>"
+        items = list(value.items())
+        summary = {str(k): summarize(v, depth + 1) for k, v in items[:MAX_ITEMS]}
+        if len(items) > MAX_ITEMS:
+            summary["..."] = f"{len(items) - MAX_ITEMS} more"
+        return summary
+    if isinstance(value, (list, tuple, set, frozenset)):
+        if depth >= MAX_DEPTH:
+            return f"<{type(value).__name__} len={len(value)}>"
+        items = list(value)
+        summary = [summarize(v, depth + 1) for v in items[:MAX_ITEMS]]
+        if len(items) > MAX_ITEMS:
+            summary.append(f"...{len(items) - MAX_ITEMS} more")
+        return summary
+    return summarize(str(value), depth)
+
+
+class EventMessage:
+    """Log message formatted on first use"""
+
+    __slots__ = ("event", "fields", "_text")
+
+    def __init__(self, event: str, fields: Dict[str, Any]):
+        self.event = event
+        self.fields = fields
+        self._text = None
+
+    def summary(self) -> Dict[str, Any]:
+        return {key: summarize(value) for key, value in self.fields.items()}
+
+    def __str__(self) -> str:
+        if self._text is None:
+            parts = [self.event]
+            for key, value in self.summary().items():
+                parts.append(f"{key}={value if isinstance(value, str) else json.dumps(value, default=str)}")
+            self._text = " ".join(parts)
+        return self._text
+
+
+def log_event(logger: logging.Logger, event: str, level: int = logging.INFO, **fields: Any):
+    """Log ``event`` with ``fields``, subject to the level and the event's sample rate"""
+    if not logger.isEnabledFor(level):
+        return
+    rate = _sample_rates.get(event, 1.0)
+    if rate < 1.0 and _random.random() >= rate:
+        return
+    logger.log(level, EventMessage(event, fields), stacklevel=2)
+
+
+class StructuredFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, event and summarized fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+        }
+        if isinstance(record.msg, EventMessage):
+            entry["event"] = record.msg.event
+            entry.update(record.msg.summary())
+        else:
+            entry["message"] = summarize(record.getMessage())
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(config: Mapping[str, Any]):
+    """Apply LOG_FORMAT and LOG_SAMPLE_RATES from an app config to the root logger"""
+    configure_sampling(config.get("LOG_SAMPLE_RATES"))
+    if config.get("LOG_FORMAT") == "json":
+        for handler in logging.getLogger().handlers:
+            handler.setFormatter(StructuredFormatter())
@@ -0,0 +1,103 @@
+"""
+Schema migrations for Rapid Test Analyzer
+db.create_all() creates missing tables but never changes existing ones, so
+indexes and tables added after a database was first created are applied
+here. Each migration runs once and is recorded in schema_migrations.
+
+Usage:
+    python migrations.py            # apply pending migrations
+    python migrations.py --status   # list applied and pending migrations
+"""
+import logging
+from datetime import datetime
+from typing import Callable, List, Tuple, Union
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+Statement = Union[str, Callable]
+
+
+def add_column(table: str, column: str, ddl: str) -> Callable:
+    """ALTER TABLE ... ADD COLUMN, skipped when the column already exists"""
+    def apply(conn):
+        if column not in {c["name"] for c in inspect(conn).get_columns(table)}:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+    return apply
+
+
+# (migration id, statements). Statements are SQL strings or callables taking
+# the connection, and must be idempotent so a database created by
+# db.create_all() with the current models can be marked up to date.
+MIGRATIONS: List[Tuple[str, List[Statement]]] = [
+    ("0001_analyses_history_indexes", [
+        # Keyset pagination of /history: equality on user_id (and test_type),
+        # range and order on (created_at, id)
+        "CREATE INDEX IF NOT EXISTS ix_analyses_user_type_created "
+        "ON analyses (user_id, test_type, created_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_analyses_user_created "
+        "ON analyses (user_id, created_at, id)",
+    ]),
+    ("0002_analyses_request_id", [
+        # Provisional ids of write-behind analyses
+        add_column("analyses", "request_id", "VARCHAR(32)"),
+        "CREATE UNIQUE INDEX IF NOT EXISTS ix_analyses_request_id ON analyses (request_id)",
+    ]),
+]
+
+
+def _ensure_migrations_table(conn):
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        "id VARCHAR(100) PRIMARY KEY, applied_at TIMESTAMP NOT NULL)"
+    ))
+
+
+def applied_migrations(engine) -> List[str]:
+    with engine.begin() as conn:
+        _ensure_migrations_table(conn)
+        return [row[0] for row in conn.execute(text("SELECT id FROM schema_migrations ORDER BY id"))]
+
+
+def upgrade(engine) -> List[str]:
+    """
+    Apply pending migrations in order, each in its own transaction.
+
+    Returns:
+        IDs of the migrations applied by this call
+    """
+    done = set(applied_migrations(engine))
+    applied = []
+    for migration_id, statements in MIGRATIONS:
+        if migration_id in done:
+            continue
+        with engine.begin() as conn:
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(text(statement))
+            conn.execute(text("INSERT INTO schema_migrations (id, applied_at) VALUES (:id, :at)"),
+                         {"id": migration_id, "at": datetime.utcnow()})
+        logger.info(f"Applied migration {migration_id}")
+        applied.append(migration_id)
+    return applied
+
+
+if __name__ == "__main__":
+    import argparse
+    from app import app
+    from models import db
+
+    parser = argparse.ArgumentParser(description="Apply database schema migrations")
+    parser.add_argument("--status", action="store_true", help="List migrations without applying them")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.status:
+            done = set(applied_migrations(db.engine))
+            for migration_id, _ in MIGRATIONS:
+                print(f"{'applied' if migration_id in done else 'pending'}  {migration_id}")
+        else:
+            applied = upgrade(db.engine)
+            print(f"Applied {len(applied)} migration(s): {', '.join(applied) or 'none'}")
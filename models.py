@@ -5,6 +5,7 @@ Handles User accounts and Analysis history
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+import json
 import secrets
 
 db = SQLAlchemy()
@@ -52,6 +53,13 @@ class User(db.Model):
 class Analysis(db.Model):
     """Analysis model for storing test results"""
     __tablename__ = 'analyses'
+    # History pages are read newest-first per user (optionally per test type);
+    # id breaks created_at ties so keyset cursors are stable. Existing
+    # databases get these from migrations.py.
+    __table_args__ = (
+        db.Index('ix_analyses_user_type_created', 'user_id', 'test_type', 'created_at', 'id'),
+        db.Index('ix_analyses_user_created', 'user_id', 'created_at', 'id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
@@ -61,12 +69,21 @@ class Analysis(db.Model):
     image_path = db.Column(db.String(255))
     result_image_path = db.Column(db.String(255))
     confidence = db.Column(db.Float)
-    raw_data = db.Column(db.Text)  # JSON string of detailed results
+    # JSON string of the full analysis response. Deferred: list queries never
+    # read it; load it with db.undefer(Analysis.raw_data) when details are needed.
+    raw_data = db.deferred(db.Column(db.Text))
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    # Id /analyze returned before the row existed (write-behind); resolved by /history/pending/<id>
+    request_id = db.Column(db.String(32), unique=True, index=True)
     
-    def to_dict(self):
-        """Convert analysis to dictionary"""
-        return {
+    def to_dict(self, include_details=False):
+        """
+        Convert analysis to dictionary
+        
+        Args:
+            include_details: Also parse and include raw_data (loads the deferred column)
+        """
+        data = {
             'id': self.id,
             'user_id': self.user_id,
             'test_type': self.test_type,
@@ -75,5 +92,49 @@ class Analysis(db.Model):
             'image_path': self.image_path,
             'result_image_path': self.result_image_path,
             'confidence': self.confidence,
-            'created_at': self.created_at.isoformat() if self.created_at else None
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'request_id': self.request_id
+        }
+        if include_details:
+            try:
+                data['details'] = json.loads(self.raw_data) if self.raw_data else None
+            except ValueError:
+                data['details'] = None
+        return data
+
+# User id of the all-users rows in the summary tables (no real user has id 0)
+GLOBAL_SUMMARY_USER = 0
+
+class AnalysisSummary(db.Model):
+    """
+    All-time analysis counts per user and test type, maintained by
+    analysis_stats.record_analysis in the same transaction as each insert.
+    Rows with user_id GLOBAL_SUMMARY_USER hold the totals over all users.
+    """
+    __tablename__ = 'analysis_summaries'
+    
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    test_type = db.Column(db.String(50), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    abnormal = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {'total': self.total, 'abnormal': self.abnormal}
+
+class AnalysisDailySummary(db.Model):
+    """Per-day analysis counts per user and test type (UTC days); see AnalysisSummary"""
+    __tablename__ = 'analysis_daily_summaries'
+    
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    day = db.Column(db.Date, primary_key=True)
+    test_type = db.Column(db.String(50), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    abnormal = db.Column(db.Integer, nullable=False, default=0)
+    
+    def to_dict(self):
+        return {
+            'day': self.day.isoformat(),
+            'test_type': self.test_type,
+            'total': self.total,
+            'abnormal': self.abnormal
         }
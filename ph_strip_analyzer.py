@@ -1,16 +1,162 @@
 import cv2
 import numpy as np
-from sklearn.neighbors import KNeighborsRegressor  # Changed from NearestNeighbors
-from typing import Optional, List, Dict, Any
+from sklearn.neighbors import KNeighborsRegressor, NearestNeighbors
+from typing import Optional, List, Dict, Any, Sequence, Tuple
 import os
+import threading
+import time
+import uuid
+from imaging import (FrameContext, Rendition, RoiTracker, WorkingImage, as_working_image, as_frame_context,
+                     box_kernel, describe_source, load_image, primary_rendition, save_renditions)
+
+# Long-side size (px) of the frame used for patch detection. Larger uploads are
+# downsampled before HoughCircles/thresholding; colours are still sampled at full resolution.
+WORKING_MAX_DIM = 1200
+
+# Mean HSV distance between a calibration's reference colours and the same
+# patches re-sampled on a new image above which lighting is considered changed
+CALIBRATION_DRIFT_THRESHOLD = 12.0
+CALIBRATION_TTL = 30 * 60  # seconds
+MAX_CALIBRATION_SESSIONS = 256
+
+# Morphology kernel shared by every call (size-dependent ones come from box_kernel's cache)
+KERNEL_3X3 = box_kernel(3)
+
+
+def _hsv_distance(a, b) -> np.ndarray:
+    """Euclidean HSV distance with hue treated as circular (OpenCV hue range 0-179)"""
+    a, b = np.asarray(a, dtype=np.float64), np.asarray(b, dtype=np.float64)
+    diff = np.abs(a - b)
+    diff[..., 0] = np.minimum(diff[..., 0], 180 - diff[..., 0])
+    return np.sqrt((diff ** 2).sum(axis=-1))
+
+
+class PHCalibration:
+    """
+    Reference colours and fitted models from one image of the colour card.
+
+    Reference patch positions are stored relative to the test patch centre
+    and in units of the test patch size, so later images of strips on the
+    same card only need the test patch located to know where to re-sample
+    the references for the drift check, whatever their resolution or decode
+    scale.
+    """
+
+    def __init__(self, reference_colors: List[Tuple[int, int, int]], labels: List[float],
+                 reference_bboxes: List[Tuple[int, int, int, int]], test_patch_center: Tuple[int, int],
+                 test_patch_size: float = 1.0):
+        self.reference_colors = [tuple(int(v) for v in c) for c in reference_colors]
+        self.labels = list(labels)
+        cx, cy = test_patch_center
+        s = float(test_patch_size)
+        self.reference_offsets = [((x - cx) / s, (y - cy) / s, w / s, h / s)
+                                  for x, y, w, h in reference_bboxes]
+        self.created_at = time.time()
+
+        X_train = np.array(self.reference_colors)
+        self.n_neighbors = min(3, len(X_train))  # Use 3 neighbors or less if we don't have enough data
+        self.knn_model = KNeighborsRegressor(n_neighbors=self.n_neighbors, weights='distance')
+        self.knn_model.fit(X_train, np.array(self.labels))
+        self.nn_model = NearestNeighbors(n_neighbors=1)
+        self.nn_model.fit(X_train)
+
+    def predict(self, test_hsv) -> Tuple[float, float]:
+        """Continuous pH prediction and distance to the nearest reference colour"""
+        sample = np.array(test_hsv).reshape(1, -1)
+        continuous_ph_value = self.knn_model.predict(sample)[0]
+        distances, _ = self.nn_model.kneighbors(sample)
+        return float(continuous_ph_value), float(distances[0][0])
+
+    def reference_bboxes(self, test_patch_center: Tuple[int, int],
+                         test_patch_size: float = 1.0) -> List[Tuple[int, int, int, int]]:
+        """Expected reference patch boxes for a test patch of ``test_patch_size`` at ``test_patch_center``"""
+        cx, cy = test_patch_center
+        s = float(test_patch_size)
+        return [(int(round(cx + dx * s)), int(round(cy + dy * s)), max(1, int(round(w * s))),
+                 max(1, int(round(h * s))))
+                for dx, dy, w, h in self.reference_offsets]
+
+    def drift(self, reference_colors: List[Tuple[int, int, int]]) -> float:
+        """Mean HSV distance between the calibrated and newly sampled reference colours"""
+        if len(reference_colors) != len(self.reference_colors):
+            return float('inf')
+        return float(np.mean(_hsv_distance(self.reference_colors, reference_colors)))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "reference_count": len(self.reference_colors),
+            "reference_colors": [list(c) for c in self.reference_colors],
+            "labels": self.labels,
+            "created_at": self.created_at
+        }
+
+
+class CalibrationSessions:
+    """
+    Thread-safe store of pH calibrations keyed by session ID.
+
+    Sessions expire after ``ttl`` seconds and are bound to the user who
+    created them (None for anonymous sessions).
+    """
+
+    def __init__(self, ttl: float = CALIBRATION_TTL, max_sessions: int = MAX_CALIBRATION_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: Dict[str, Tuple[PHCalibration, Any, float]] = {}
+        self._lock = threading.Lock()
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for session_id, (_, _, expires) in list(self._sessions.items()):
+            if expires <= now:
+                del self._sessions[session_id]
+
+    def create(self, calibration: PHCalibration, owner: Any = None) -> str:
+        with self._lock:
+            self._evict_expired()
+            if len(self._sessions) >= self.max_sessions:
+                # Drop the session closest to expiry
+                oldest = min(self._sessions, key=lambda k: self._sessions[k][2])
+                del self._sessions[oldest]
+            session_id = uuid.uuid4().hex
+            self._sessions[session_id] = (calibration, owner, time.monotonic() + self.ttl)
+            return session_id
+
+    def get(self, session_id: str, owner: Any = None) -> Optional[PHCalibration]:
+        """Calibration for a live session owned by ``owner``; use extends its lifetime"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            calibration, session_owner, expires = entry
+            if expires <= time.monotonic() or session_owner != owner:
+                if expires <= time.monotonic():
+                    del self._sessions[session_id]
+                return None
+            self._sessions[session_id] = (calibration, session_owner, time.monotonic() + self.ttl)
+            return calibration
+
+    def invalidate(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._evict_expired()
+            return len(self._sessions)
+
 
 class PHStripAnalyzer:
-    def __init__(self, fixed_ph_labels: Optional[List[float]] = None, debug: bool = False):
+    def __init__(self, fixed_ph_labels: Optional[List[float]] = None, debug: bool = False,
+                 working_max_dim: int = WORKING_MAX_DIM):
         self.knn_model = None
         self.knn_labels = []
         self.reference_segments_data = []
         self.debug_mode = debug
         self.fixed_ph_labels = fixed_ph_labels or [3.8, 4.5, 5.0, 5.5, 6.0, 7.0, 8.0]
+        self.working_max_dim = working_max_dim
+        # Calibration fitted (or reused) by the last successful analysis
+        self.calibration = None
 
     # ---------------------- Debug Utility ----------------------
     def _show_debug(self, title, img, wait_ms=None):
@@ -19,23 +165,35 @@ class PHStripAnalyzer:
 
     # ---------------------- Test Patch Detection ----------------------
     def detect_test_patch_contour(self, image):
-        debug_img = image.copy()
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.medianBlur(gray, 5)
+        """
+        Locate the circular test patch.
+
+        Detection runs on the working-resolution frame; the returned geometry
+        is in full-resolution coordinates.
+        """
+        work = as_working_image(image)
+        ctx = work.context
+        image = work.image
+        # Debug canvas only when debugging; otherwise nothing is drawn
+        debug_img = image.copy() if self.debug_mode else None
+        gray = ctx.gray
+        blurred = ctx.median_blur(5)
         # Removed debug display
         # self._show_debug("Blurred Gray Image", blurred, wait_ms=None)
 
         circles = cv2.HoughCircles(
-            blurred, cv2.HOUGH_GRADIENT, dp=1.2, minDist=50,
-            param1=50, param2=30, minRadius=15, maxRadius=80
+            blurred, cv2.HOUGH_GRADIENT, dp=1.2, minDist=work.length(50),
+            param1=50, param2=30, minRadius=work.length(15), maxRadius=work.length(80)
         )
 
         if circles is not None:
             circles = np.round(circles[0, :]).astype("int")
             x, y, r = circles[0]
-            cv2.circle(debug_img, (x, y), r, (0,255,0), 2)
-            # Removed debug display
-            # self._show_debug("Test Patch - HoughCircles", debug_img, wait_ms=None)
+            if debug_img is not None:
+                cv2.circle(debug_img, (x, y), r, (0,255,0), 2)
+                self._show_debug("Test Patch - HoughCircles", debug_img, wait_ms=None)
+            x, y = work.to_full_point((x, y))
+            r = work.to_full_length(r)
             return {
                 'contour': None,
                 'center': (x, y),
@@ -48,23 +206,22 @@ class PHStripAnalyzer:
         # Fallback contour method
         thresh_adaptive = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
                                                 cv2.THRESH_BINARY_INV, 11, 2)
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        hsv = ctx.hsv
         lower_color_bound = np.array([0, 25, 25])
         upper_color_bound = np.array([150, 255, 255])
         mask_hsv = cv2.inRange(hsv, lower_color_bound, upper_color_bound)
         combined_thresh = cv2.bitwise_and(thresh_adaptive, mask_hsv)
 
-        kernel_large = np.ones((10,10), np.uint8)
-        kernel_small = np.ones((3,3), np.uint8)
-        cleaned_thresh = cv2.morphologyEx(combined_thresh, cv2.MORPH_CLOSE, kernel_large)
-        cleaned_thresh = cv2.morphologyEx(cleaned_thresh, cv2.MORPH_OPEN, kernel_small)
-        cleaned_thresh = cv2.dilate(cleaned_thresh, kernel_small, iterations=1)
+        cleaned_thresh = cv2.morphologyEx(combined_thresh, cv2.MORPH_CLOSE, box_kernel(work.kernel(10)))
+        cleaned_thresh = cv2.morphologyEx(cleaned_thresh, cv2.MORPH_OPEN, KERNEL_3X3)
+        cleaned_thresh = cv2.dilate(cleaned_thresh, KERNEL_3X3, iterations=1)
         # Removed debug display
         # self._show_debug("Test Patch - Thresholded Mask", cleaned_thresh, wait_ms=None)
 
         contours, _ = cv2.findContours(cleaned_thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         test_patch_contour_info = None
         max_radius = 0
+        min_area, max_area = work.area(1500), work.area(50000)
 
         for contour in contours:
             area = cv2.contourArea(contour)
@@ -73,7 +230,7 @@ class PHStripAnalyzer:
                 continue
             circularity = 4 * np.pi * (area / (perimeter * perimeter))
             (x_center, y_center), radius = cv2.minEnclosingCircle(contour)
-            if 1500 < area < 50000 and circularity > 0.5:
+            if min_area < area < max_area and circularity > 0.5:
                 if radius > max_radius:
                     max_radius = radius
                     test_patch_contour_info = {
@@ -86,16 +243,30 @@ class PHStripAnalyzer:
                     }
 
         if test_patch_contour_info and test_patch_contour_info['contour'] is not None:
-            cv2.drawContours(debug_img, [test_patch_contour_info['contour']], -1, (0,255,0), 2)
-            # Removed debug display
-            # self._show_debug("Test Patch - Contour Fallback", debug_img, wait_ms=None)
+            if debug_img is not None:
+                cv2.drawContours(debug_img, [test_patch_contour_info['contour']], -1, (0,255,0), 2)
+                self._show_debug("Test Patch - Contour Fallback", debug_img, wait_ms=None)
+            if work.is_rescaled:
+                info = test_patch_contour_info
+                info['contour'] = np.round(info['contour'] / work.scale).astype(np.int32)
+                info['center'] = work.to_full_point(info['center'])
+                info['radius'] = work.to_full_length(info['radius'])
+                info['bbox'] = work.to_full_bbox(info['bbox'])
+                info['area'] = work.to_full_area(info['area'])
 
         return test_patch_contour_info
 
     # ---------------------- Reference Patch Detection (HSV only) ----------------------
     def detect_reference_patches(self, image, test_patch_bbox=None):
-        debug_img = image.copy()
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        """
+        Locate the reference colour patches.
+
+        ``test_patch_bbox`` and the returned patch geometry are in
+        full-resolution coordinates.
+        """
+        work = as_working_image(image)
+        image = work.image
+        hsv = work.context.hsv
 
         # Broad HSV range to capture patches
         lower_color_hsv = np.array([0, 40, 40])
@@ -103,26 +274,27 @@ class PHStripAnalyzer:
         mask_colors = cv2.inRange(hsv, lower_color_hsv, upper_color_hsv)
 
         # Morphological cleaning
-        kernel_open = np.ones((3,3), np.uint8)
-        mask_cleaned = cv2.morphologyEx(mask_colors, cv2.MORPH_OPEN, kernel_open, iterations=1)
-        kernel_close = np.ones((3,3), np.uint8)
-        mask_cleaned = cv2.morphologyEx(mask_cleaned, cv2.MORPH_CLOSE, kernel_close, iterations=1)
+        mask_cleaned = cv2.morphologyEx(mask_colors, cv2.MORPH_OPEN, KERNEL_3X3, iterations=1)
+        mask_cleaned = cv2.morphologyEx(mask_cleaned, cv2.MORPH_CLOSE, KERNEL_3X3, iterations=1)
         # Removed debug display
         # self._show_debug("Reference Patches - HSV Mask", mask_cleaned, wait_ms=None)
 
         contours, _ = cv2.findContours(mask_cleaned, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
         patches = []
         h_img = image.shape[0]
+        min_area, max_area = work.area(500), work.area(15000)
 
         for contour in contours:
             area = cv2.contourArea(contour)
             x, y, w, h = cv2.boundingRect(contour)
-            if 500 < area < 15000 and 0.5 < (w/h if h else 0) < 2.0 and h_img*0.20 < y < h_img*0.80:
+            if min_area < area < max_area and 0.5 < (w/h if h else 0) < 2.0 and h_img*0.20 < y < h_img*0.80:
+                aspect_ratio = w/h if h else 0
+                x, y, w, h = work.to_full_bbox((x, y, w, h))
                 if not test_patch_bbox or not self._bbox_overlap((x,y,w,h), test_patch_bbox):
                     patches.append({
                         'bbox': (x, y, w, h),
-                        'area': area,
-                        'aspect_ratio': w/h if h else 0,
+                        'area': work.to_full_area(area),
+                        'aspect_ratio': aspect_ratio,
                         'center_x': x + w // 2,
                         'center_y': y + h // 2
                     })
@@ -133,22 +305,22 @@ class PHStripAnalyzer:
         # ---- Cluster filtering ----
         ys = [p['center_y'] for p in patches]
         median_y = np.median(ys)
-        patches = [p for p in patches if abs(p['center_y'] - median_y) < 0.25 * image.shape[0]]
+        patches = [p for p in patches if abs(p['center_y'] - median_y) < 0.25 * work.full.shape[0]]
 
         # Sort and trim to label count
         patches = sorted(patches, key=lambda p: p['center_x'])
         patches = patches[:len(self.fixed_ph_labels)]
 
-        # Debug draw (but not displayed)
-        for i, patch in enumerate(patches):
-            x,y,w,h = patch['bbox']
-            cv2.rectangle(debug_img, (x,y), (x+w,y+h), (255,0,0), 2)
-            if i < len(self.fixed_ph_labels):
-                cv2.putText(debug_img, str(self.fixed_ph_labels[i]), (x, y-10),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255,0,0), 2)
-
-        # Removed debug display
-        # self._show_debug("Reference Patches - Filtered Cluster", debug_img, wait_ms=None)
+        # Debug canvas only when debugging
+        if self.debug_mode:
+            debug_img = image.copy()
+            for i, patch in enumerate(patches):
+                x,y,w,h = (int(round(v * work.scale)) for v in patch['bbox'])
+                cv2.rectangle(debug_img, (x,y), (x+w,y+h), (255,0,0), 2)
+                if i < len(self.fixed_ph_labels):
+                    cv2.putText(debug_img, str(self.fixed_ph_labels[i]), (x, y-10),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255,0,0), 2)
+            self._show_debug("Reference Patches - Filtered Cluster", debug_img, wait_ms=None)
         return patches
 
     # ---------------------- Utilities ----------------------
@@ -163,20 +335,85 @@ class PHStripAnalyzer:
         union_area = (w1*h1)+(w2*h2)-inter_area
         return (inter_area / union_area) > min_overlap_ratio
 
-    def _extract_average_color_circle(self, segment_image, center, radius_ratio=0.4):
-        if segment_image is None or segment_image.size == 0:
+    @staticmethod
+    def _patches_bbox(test_patch_info, reference_patches):
+        """Bounding box around the test patch and all reference patches (tracker anchor)"""
+        boxes = [test_patch_info['bbox']] + [p['bbox'] for p in reference_patches]
+        x0 = min(b[0] for b in boxes)
+        y0 = min(b[1] for b in boxes)
+        x1 = max(b[0] + b[2] for b in boxes)
+        y1 = max(b[1] + b[3] for b in boxes)
+        return (x0, y0, x1 - x0, y1 - y0)
+
+    @staticmethod
+    def _shift_geometry(test_patch_info, reference_patches, dx, dy):
+        """Copies of tracked patch geometry translated by (dx, dy)"""
+        def shift_bbox(bbox):
+            x, y, w, h = bbox
+            return (x + dx, y + dy, w, h)
+
+        test_patch_info = dict(test_patch_info, bbox=shift_bbox(test_patch_info['bbox']))
+        if test_patch_info.get('center'):
+            cx, cy = test_patch_info['center']
+            test_patch_info['center'] = (cx + dx, cy + dy)
+        if test_patch_info.get('contour') is not None:
+            test_patch_info['contour'] = test_patch_info['contour'] + np.array([dx, dy], dtype=np.int32)
+
+        reference_patches = [dict(p, bbox=shift_bbox(p['bbox']),
+                                  center_x=p['center_x'] + dx, center_y=p['center_y'] + dy)
+                             for p in reference_patches]
+        return test_patch_info, reference_patches
+
+    @staticmethod
+    def _patch_center(test_patch_info):
+        if test_patch_info.get('center'):
+            return test_patch_info['center']
+        x, y, w, h = test_patch_info['bbox']
+        return (x + w // 2, y + h // 2)
+
+    @staticmethod
+    def _patch_size(test_patch_info):
+        """Side of the square with the test patch's box area, the card's scale in pixels"""
+        _, _, w, h = test_patch_info['bbox']
+        return float(np.sqrt(w * h))
+
+    def _calibrated_reference_patches(self, calibration, test_patch_info, image_shape):
+        """Reference patches placed from a calibration, or None if any falls outside the image"""
+        h_img, w_img = image_shape[:2]
+        patches = []
+        for x, y, w, h in calibration.reference_bboxes(self._patch_center(test_patch_info),
+                                                       self._patch_size(test_patch_info)):
+            if x < 0 or y < 0 or x + w > w_img or y + h > h_img:
+                return None
+            patches.append({'bbox': (x, y, w, h), 'area': w * h, 'aspect_ratio': w / h if h else 0,
+                            'center_x': x + w // 2, 'center_y': y + h // 2})
+        return patches
+
+    def _recalibrate(self, image, debug, result_folder, analysis_id, tracker, drift, renditions=None,
+                     encoder=None):
+        """Analyze from scratch after a calibration no longer matches the image"""
+        result = self.analyze_ph_strip(image, debug=debug, result_folder=result_folder,
+                                       analysis_id=analysis_id, tracker=tracker, renditions=renditions,
+                                       encoder=encoder)
+        result["calibration_drift"] = True
+        result["drift"] = None if np.isinf(drift) else round(float(drift), 2)
+        return result
+
+    def _extract_average_color_circle(self, segment, center, radius_ratio=0.4):
+        """Mean HSV inside a circle; segment may be an image or a FrameContext ROI"""
+        if segment is None:
             return (0,0,0)
-        h_img, w_img = segment_image.shape[:2]
+        ctx = as_frame_context(segment)
+        if ctx.image.size == 0:
+            return (0,0,0)
+        h_img, w_img = ctx.image.shape[:2]
         x_c, y_c = center
         radius = int(min(w_img, h_img) * radius_ratio)
         mask = np.zeros((h_img, w_img), dtype=np.uint8)
         cv2.circle(mask, (x_c, y_c), radius, 255, -1)
-        hsv = cv2.cvtColor(segment_image, cv2.COLOR_BGR2HSV)
-        masked_hsv = cv2.bitwise_and(hsv, hsv, mask=mask)
-        pixels = masked_hsv[mask==255]
-        if len(pixels) == 0:
+        if cv2.countNonZero(mask) == 0:
             return (0,0,0)
-        avg_hsv = np.mean(pixels, axis=0)
+        avg_hsv = cv2.mean(ctx.hsv, mask=mask)[:3]
         return tuple(np.clip(avg_hsv, [0,0,0],[179,255,255]).astype(int))
 
     # ---------------------- NEW: Map continuous value to hardcoded list ----------------------
@@ -220,15 +457,28 @@ class PHStripAnalyzer:
         return vis
 
     # ---------------------- Main Analysis ----------------------
-    def analyze_ph_strip(self, image_path, debug=False, result_folder=None, analysis_id=None):
+    def analyze_ph_strip(self, image_path, debug=False, result_folder=None, analysis_id=None,
+                         tracker: Optional[RoiTracker] = None, calibration: Optional[PHCalibration] = None,
+                         renditions: Optional[Sequence[Rendition]] = None, encoder=None):
         """
         Analyze pH strip with Flask app compatibility
         
         Args:
-            image_path: Path to the image file
+            image_path: Path to the image file, or a decoded BGR frame
             debug: Enable debug mode (now only affects console output)
             result_folder: Folder to save result images (for web app)
             analysis_id: Unique ID for this analysis (for web app)
+            tracker: RoiTracker shared across consecutive frames of one strip;
+                reuses the patch geometry instead of re-detecting it
+            calibration: PHCalibration from an earlier image of the same colour
+                card; only the test patch is detected and the cached model is
+                used. If the re-sampled references have drifted (lighting
+                changed) the image is analyzed from scratch and the result
+                reports "calibration_drift"
+            renditions: Sizes/encoders the result image is saved in
+                (imaging.DEFAULT_RENDITIONS if None)
+            encoder: result_encoder.ResultEncoder that writes the renditions
+                in the background (default: written before returning)
             
         Returns:
             Dictionary with analysis results compatible with Flask app
@@ -237,48 +487,70 @@ class PHStripAnalyzer:
         self.debug_mode = False  # Force disable debug image display
         
         try:
-            image = cv2.imread(image_path)
+            # Large JPEGs are decoded at reduced scale, just above the working size
+            image, decode_scale = load_image(image_path, min_dim=self.working_max_dim)
             if image is None:
                 return {
                     "success": False,
-                    "error": f"Could not load image from {image_path}"
+                    "error": f"Could not load image from {describe_source(image_path)}"
                 }
             
-            output_image = image.copy()
+            tracked = tracker.lookup(image) if tracker else None
+            if tracked:
+                (test_patch_info, reference_patches), (dx, dy) = tracked
+                test_patch_info, reference_patches = self._shift_geometry(
+                    test_patch_info, reference_patches, dx, dy)
+                full_ctx = FrameContext(image)
+            else:
+                # Detection runs on a downsampled frame, colour sampling on the full one
+                work = WorkingImage(image, self.working_max_dim, source_scale=decode_scale)
+                full_ctx = work.full_context
+
+                # Step 1: Detect test patch
+                test_patch_info = self.detect_test_patch_contour(work)
+                if not test_patch_info:
+                    return {
+                        "success": False,
+                        "error": "Could not detect test patch in the image"
+                    }
 
-            # Step 1: Detect test patch
-            test_patch_info = self.detect_test_patch_contour(image)
-            if not test_patch_info:
-                return {
-                    "success": False,
-                    "error": "Could not detect test patch in the image"
-                }
+            if calibration is not None and not tracked:
+                # References sit at known offsets from the test patch on a calibrated card
+                reference_patches = self._calibrated_reference_patches(
+                    calibration, test_patch_info, image.shape)
+                if reference_patches is None:
+                    return self._recalibrate(image, debug, result_folder, analysis_id, tracker,
+                                             drift=float('inf'), renditions=renditions, encoder=encoder)
+            elif not tracked:
+                # Step 2: Detect reference patches (before sampling, so the HSV frame it builds is reused)
+                reference_patches = self.detect_reference_patches(work, test_patch_bbox=test_patch_info['bbox'])
+                if len(reference_patches) < 1:  # Changed from 3 to 1 since we're mapping to hardcoded values
+                    return {
+                        "success": False,
+                        "error": f"Need at least 1 reference patch for analysis, found {len(reference_patches)}"
+                    }
+
+            if tracker and not tracked:
+                tracker.store(image, self._patches_bbox(test_patch_info, reference_patches),
+                              (test_patch_info, reference_patches))
 
             x, y, w_patch, h_patch = test_patch_info['bbox']
-            test_roi = image[y:y+h_patch, x:x+w_patch]
+            test_roi = full_ctx.roi((x, y, w_patch, h_patch))
             cx, cy = w_patch//2, h_patch//2
 
-            # Step 2: Extract test patch HSV
+            # Step 3: Extract test patch HSV
             test_patch_color_hsv = self._extract_average_color_circle(test_roi, (cx, cy))
             # Removed debug display
             # debug_test = test_roi.copy()
             # cv2.putText(debug_test, f"Test HSV: {test_patch_color_hsv}", (5,20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,0,255), 1)
             # self._show_debug("Test Patch HSV", debug_test, wait_ms=1000)
 
-            # Step 3: Detect reference patches
-            reference_patches = self.detect_reference_patches(image, test_patch_bbox=test_patch_info['bbox'])
-            if len(reference_patches) < 1:  # Changed from 3 to 1 since we're mapping to hardcoded values
-                return {
-                    "success": False,
-                    "error": f"Need at least 1 reference patch for analysis, found {len(reference_patches)}"
-                }
-
-            # Step 4: Extract HSV for reference patches and train KNN Regressor
+            # Step 4: Extract HSV for reference patches
             X_train, y_train = [], []
             self.reference_segments_data = []
             for i, patch in enumerate(reference_patches):
                 x, y, w, h = patch['bbox']
-                roi = image[y:y+h, x:x+w]
+                roi = full_ctx.roi((x, y, w, h))
                 cx, cy = w//2, h//2
                 avg_hsv = self._extract_average_color_circle(roi, (cx, cy))
                 label = self.fixed_ph_labels[i] if i < len(self.fixed_ph_labels) else 0
@@ -286,23 +558,28 @@ class PHStripAnalyzer:
                 y_train.append(label)
                 self.reference_segments_data.append({'label': label,'color': avg_hsv,'bbox':(x,y,w,h)})
 
-            # Train KNN Regressor
-            n_neighbors = min(3, len(X_train))  # Use 3 neighbors or less if we don't have enough data
-            self.knn_model = KNeighborsRegressor(n_neighbors=n_neighbors, weights='distance')
-            self.knn_model.fit(np.array(X_train), np.array(y_train))
-
-            # Predict pH using regression (get continuous value first)
-            continuous_ph_value = self.knn_model.predict(np.array(test_patch_color_hsv).reshape(1, -1))[0]
+            drift = None
+            if calibration is not None:
+                # Cached model is only valid under the lighting it was fitted in
+                drift = calibration.drift(X_train)
+                if drift > CALIBRATION_DRIFT_THRESHOLD:
+                    return self._recalibrate(image, debug, result_folder, analysis_id, tracker, drift=drift,
+                                             renditions=renditions, encoder=encoder)
+                self.calibration = calibration
+            else:
+                # Train KNN Regressor (kept as a calibration for later images of the same card)
+                self.calibration = PHCalibration(X_train, y_train, [p['bbox'] for p in reference_patches],
+                                                 self._patch_center(test_patch_info),
+                                                 self._patch_size(test_patch_info))
+            self.knn_model = self.calibration.knn_model
+            n_neighbors = self.calibration.n_neighbors
+
+            # Predict pH using regression (get continuous value first), and the
+            # distance to the nearest reference for debugging
+            continuous_ph_value, min_distance = self.calibration.predict(test_patch_color_hsv)
             
             # Map continuous value to hardcoded pH list
             estimated_ph_value = self._map_to_hardcoded_ph(continuous_ph_value)
-            
-            # Calculate distance to nearest neighbors for debugging
-            from sklearn.neighbors import NearestNeighbors
-            nn_for_distance = NearestNeighbors(n_neighbors=1)
-            nn_for_distance.fit(np.array(X_train))
-            distances, indices = nn_for_distance.kneighbors(np.array(test_patch_color_hsv).reshape(1, -1))
-            min_distance = distances[0][0]
 
             if debug:  # Only console debug output
                 print(f"Debug: Using {n_neighbors} neighbors for regression")
@@ -312,28 +589,29 @@ class PHStripAnalyzer:
                 print(f"Debug: Available hardcoded pH values: {self.fixed_ph_labels}")
                 print(f"Debug: Reference pH values used: {y_train}")
 
-            # Create visualization
-            vis_image = self.visualize_results(output_image, test_patch_info, reference_patches, estimated_ph_value)
-
-            # Save only the final annotated result image
+            # Save only the final annotated result image; visualize_results makes
+            # the one full-frame copy, and only when it is saved
             result_images = []
+            result_renditions = {}
             if result_folder and analysis_id:
-                os.makedirs(result_folder, exist_ok=True)
-                
-                # Save only the final annotated result image
-                result_image_path = os.path.join(result_folder, f"{analysis_id}_ph_result.jpg")
-                cv2.imwrite(result_image_path, vis_image)
-                result_images.append(result_image_path)
+                vis_image = self.visualize_results(image, test_patch_info, reference_patches, estimated_ph_value)
+                result_renditions = save_renditions(vis_image, result_folder, f"{analysis_id}_ph_result.jpg",
+                                                    renditions, encoder)
+                result_images.append(primary_rendition(result_renditions))
 
             # Return results in format expected by Flask app - ONLY hardcoded values
             return {
                 "success": True,
                 "estimated_ph": float(estimated_ph_value),  # Only hardcoded value
                 "test_patch_color_hsv": test_patch_color_hsv,
-                "annotated_image": vis_image,
                 "min_distance_to_reference": float(min_distance),
                 "detected_reference_patches_count": len(reference_patches),
+                "tracked": bool(tracked),
+                "calibrated": calibration is not None,
+                "calibration_drift": False,
+                "drift": None if drift is None else round(drift, 2),
                 "result_images": result_images,
+                "result_renditions": result_renditions,
                 
                 # Legacy format for backward compatibility
                 "estimated_ph_value": float(estimated_ph_value)  # Only hardcoded value
@@ -351,7 +629,8 @@ if __name__ == "__main__":
     image_path = r"C:\Users\dell\Downloads\test10.jpeg"
 
     try:
-        results = analyzer.analyze_ph_strip(image_path, debug=True)  # debug=True only for console output
+        results = analyzer.analyze_ph_strip(image_path, debug=True,  # debug=True only for console output
+                                            result_folder="result_images", analysis_id="standalone")
         
         if results["success"]:
             print("\n--- pH Test Strip Analysis Results ---")
@@ -361,7 +640,7 @@ if __name__ == "__main__":
             print(f"Min Distance to Reference: {results['min_distance_to_reference']:.2f}")
 
             # Only show final result in standalone mode
-            cv2.imshow("Annotated pH Strip", results["annotated_image"])
+            cv2.imshow("Annotated pH Strip", cv2.imread(results["result_images"][0]))
             cv2.waitKey(0)
             cv2.destroyAllWindows()
         else:
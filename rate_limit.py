@@ -0,0 +1,140 @@
+"""
+In-process token-bucket rate limiting
+Each client has a bucket that refills continuously up to a burst size;
+a request takes its cost in tokens or is refused with the time until
+enough tokens are back. Authenticated users and anonymous IPs have
+separate buckets and limits, and a request's cost depends on the endpoint
+(and, for /analyze, the test type), so one FOB analysis uses up more of a
+client's quota than a pH one.
+
+Buckets live in an LRU-ordered dict: lookups are O(1), and a bucket idle
+long enough to have refilled completely is dropped from the old end,
+since a fresh bucket would behave the same. Limits are per process; with
+several gunicorn workers each enforces its own.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Mapping, Optional, Union
+
+MAX_BUCKETS = 10000
+
+# endpoint -> cost, or test type -> cost ("default" for other test types)
+Costs = Mapping[str, Union[float, Mapping[str, float]]]
+
+
+class TokenBucketLimiter:
+    """Token buckets keyed by client"""
+
+    def __init__(self, per_minute: float, burst: float, max_buckets: int = MAX_BUCKETS,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = per_minute / 60.0  # tokens per second
+        self.burst = float(burst)
+        self.max_buckets = max_buckets
+        # Seconds after which an untouched bucket is full again
+        self.refill_time = self.burst / self.rate
+        self.stats = {"allowed": 0, "limited": 0, "evicted": 0}
+        self._clock = clock
+        self._buckets: "OrderedDict[Hashable, List[float]]" = OrderedDict()  # key -> [tokens, updated]
+        self._lock = threading.Lock()
+
+    def consume(self, key: Hashable, cost: float = 1.0) -> float:
+        """
+        Take ``cost`` tokens from ``key``'s bucket.
+
+        Returns:
+            0.0 if the tokens were taken, otherwise the seconds until they
+            will be available (nothing is taken)
+        """
+        # A request dearer than the whole bucket is charged the whole bucket
+        cost = min(cost, self.burst)
+        with self._lock:
+            now = self._clock()
+            self._evict_idle(now)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._buckets.popitem(last=False)
+                    self.stats["evicted"] += 1
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                self._buckets.move_to_end(key)
+
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+                self.stats["allowed"] += 1
+            else:
+                wait = (cost - tokens) / self.rate
+                self.stats["limited"] += 1
+            self._buckets[key] = [tokens, now]
+            return wait
+
+    def _evict_idle(self, now: float):
+        while self._buckets:
+            key, (_, updated) = next(iter(self._buckets.items()))
+            if now - updated < self.refill_time:
+                break
+            del self._buckets[key]
+            self.stats["evicted"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._buckets)
+
+
+class RateLimiter:
+    """Per-user and per-IP token buckets with weighted request costs"""
+
+    def __init__(self, ip_limiter: TokenBucketLimiter, user_limiter: TokenBucketLimiter,
+                 costs: Optional[Costs] = None, default_cost: float = 1.0):
+        self.ip_limiter = ip_limiter
+        self.user_limiter = user_limiter
+        self.costs = dict(costs or {})
+        self.default_cost = default_cost
+
+    def cost(self, endpoint: Optional[str], test_type: Optional[str] = None) -> float:
+        cost = self.costs.get(endpoint, self.default_cost)
+        if isinstance(cost, Mapping):
+            return float(cost.get(test_type, cost.get("default", self.default_cost)))
+        return float(cost)
+
+    def check(self, user_id: Optional[Any], ip: Optional[str], endpoint: Optional[str],
+              test_type: Optional[str] = None) -> float:
+        """
+        Charge a request to the user's bucket (or the IP's when anonymous).
+
+        Returns:
+            0.0 if allowed, otherwise seconds until it would be
+        """
+        cost = self.cost(endpoint, test_type)
+        if user_id is not None:
+            return self.user_limiter.consume(user_id, cost)
+        return self.ip_limiter.consume(ip or "unknown", cost)
+
+    def clear(self):
+        self.ip_limiter.clear()
+        self.user_limiter.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        return {
+            "ip": dict(self.ip_limiter.stats, buckets=len(self.ip_limiter)),
+            "user": dict(self.user_limiter.stats, buckets=len(self.user_limiter)),
+        }
+
+
+def create_rate_limiter(config: Mapping[str, Any]) -> RateLimiter:
+    """RateLimiter from the RATE_LIMIT_* settings of an app config"""
+    max_buckets = config.get("RATE_LIMIT_MAX_BUCKETS", MAX_BUCKETS)
+    return RateLimiter(
+        ip_limiter=TokenBucketLimiter(config.get("RATE_LIMIT_PER_MINUTE", 50),
+                                      config.get("RATE_LIMIT_BURST", 20), max_buckets),
+        user_limiter=TokenBucketLimiter(config.get("RATE_LIMIT_USER_PER_MINUTE", 120),
+                                        config.get("RATE_LIMIT_USER_BURST", 40), max_buckets),
+        costs=config.get("RATE_LIMIT_COSTS")
+    )
@@ -0,0 +1,88 @@
+"""
+Sparse fieldsets for analysis responses
+``fields=result,results.confidence`` returns only the listed keys of an
+/analyze response; ``profile=compact`` is a predefined fieldset per test
+type without the duplicated values (pH / estimated_ph, message / result /
+diagnosis) and the per-pad explanations. A dotted name selects keys inside
+a nested object, or inside every entry of a mapping of objects such as the
+urinalysis ``results``.
+"""
+from typing import Any, Dict, Mapping, Optional, Set
+
+# key -> None for the whole value, or the set of nested keys to keep
+FieldSet = Dict[str, Optional[Set[str]]]
+
+PROFILES = ("full", "compact")
+# Kept in every compact response when present
+_COMPACT_COMMON = "success,test_type,analysis_id,request_id,result_images,result_thumbnail,saved,pending"
+COMPACT_FIELDS = {
+    "fob": _COMPACT_COMMON + ",result",
+    "ph": _COMPACT_COMMON + ",pH,medical_status,calibration",
+    "urinalysis": _COMPACT_COMMON + ",pads_detected,results.result,results.confidence",
+}
+
+
+def parse_fields(spec: str) -> FieldSet:
+    """'a,b.c,b.d' -> {'a': None, 'b': {'c', 'd'}}"""
+    fields: FieldSet = {}
+    for name in spec.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        key, _, sub = name.partition(".")
+        if not sub or fields.get(key, set()) is None:
+            fields[key] = None
+        else:
+            fields.setdefault(key, set()).add(sub)
+    return fields
+
+
+def requested_fields(test_type: str, fields: Optional[str] = None,
+                     profile: Optional[str] = None) -> Optional[FieldSet]:
+    """
+    The fieldset a request asks for, or None for the full response.
+
+    ``fields`` takes precedence over ``profile``.
+
+    Raises:
+        ValueError: unknown profile or an empty field list
+    """
+    if fields is not None:
+        parsed = parse_fields(fields)
+        if not parsed:
+            raise ValueError("fields must name at least one field")
+        return parsed
+    if profile in (None, "", "full"):
+        return None
+    if profile != "compact":
+        raise ValueError(f"Unknown profile. Available: {', '.join(PROFILES)}")
+    return parse_fields(COMPACT_FIELDS[test_type])
+
+
+def wants(fields: Optional[FieldSet], key: str, sub: Optional[str] = None) -> bool:
+    """Whether ``key`` (or ``key.sub``) is part of the response"""
+    if fields is None:
+        return True
+    if key not in fields:
+        return False
+    return sub is None or fields[key] is None or sub in fields[key]
+
+
+def _pick(value: Any, keys: Set[str]) -> Any:
+    if not isinstance(value, Mapping):
+        return value
+    if any(isinstance(v, Mapping) for v in value.values()) and not keys & value.keys():
+        # Mapping of objects (e.g. pad code -> pad result): select inside each entry
+        return {k: _pick(v, keys) for k, v in value.items()}
+    return {k: v for k, v in value.items() if k in keys}
+
+
+def select_fields(response: Mapping[str, Any], fields: Optional[FieldSet]) -> Dict[str, Any]:
+    """Copy of ``response`` restricted to ``fields`` (unknown names are ignored)"""
+    if fields is None:
+        return dict(response)
+    selected = {}
+    for key, sub in fields.items():
+        if key in response:
+            selected[key] = response[key] if sub is None else _pick(response[key], sub)
+    return selected
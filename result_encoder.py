@@ -0,0 +1,181 @@
+"""
+Background encoding of result images
+The analyzers hand their annotated image to a bounded queue instead of
+encoding every rendition on the request thread. The result paths are
+known up front, so /analyze responds immediately, and
+/result_images briefly waits for an encode still in flight instead of
+returning 404.
+
+Each rendition is written to a temporary file and renamed into place, so
+a reader never sees a partially written image.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from imaging import DEFAULT_RENDITIONS, Rendition, rendition_filename, write_rendition
+
+logger = logging.getLogger(__name__)
+
+WORKERS = 1
+MAX_QUEUE = 32
+WAIT_TIMEOUT = 2.0  # seconds a request waits for an in-flight encode
+
+_STOP = object()
+
+
+class _EncodeJob:
+    __slots__ = ("image", "paths", "renditions", "done", "submitted")
+
+    def __init__(self, image: np.ndarray, paths: List[str], renditions: Sequence[Rendition]):
+        self.image = image
+        self.paths = paths
+        self.renditions = renditions
+        self.done = threading.Event()
+        self.submitted = time.perf_counter()
+
+
+class ResultEncoder:
+    """Bounded background queue that encodes and writes result image renditions"""
+
+    def __init__(self, workers: int = WORKERS, max_queue: int = MAX_QUEUE):
+        self.stats = {"queued": 0, "inline": 0, "encoded": 0, "failed": 0}
+        self._latency = {"encode_total": 0.0, "encode_max": 0.0, "wait_total": 0.0, "wait_max": 0.0}
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._in_flight: Dict[str, _EncodeJob] = {}
+        self._closed = False
+        self._lock = threading.Lock()
+        self._workers = [threading.Thread(target=self._run, name=f"result-encoder-{i}", daemon=True)
+                         for i in range(workers)]
+        for worker in self._workers:
+            worker.start()
+        atexit.register(self.close)
+
+    def submit(self, image: np.ndarray, result_folder: str, filename: str,
+               renditions: Optional[Sequence[Rendition]] = None) -> Dict[str, str]:
+        """
+        Schedule every rendition of ``image`` and return their eventual paths.
+
+        ``image`` is encoded later and must not be modified afterwards. When
+        the queue is full (or the encoder is closed) the renditions are
+        encoded on the calling thread instead.
+
+        Returns:
+            Rendition name -> path
+        """
+        renditions = tuple(renditions or DEFAULT_RENDITIONS)
+        os.makedirs(result_folder, exist_ok=True)
+        paths = {r.name: os.path.join(result_folder, rendition_filename(filename, r)) for r in renditions}
+        job = _EncodeJob(image, [paths[r.name] for r in renditions], renditions)
+
+        with self._lock:
+            queued = not self._closed
+            if queued:
+                try:
+                    self._queue.put_nowait(job)
+                except queue.Full:
+                    queued = False
+            if queued:
+                self.stats["queued"] += 1
+                for path in job.paths:
+                    self._in_flight[os.path.abspath(path)] = job
+            else:
+                self.stats["inline"] += 1
+
+        if not queued:
+            self._encode(job)
+        return paths
+
+    def wait(self, path: str, timeout: float = WAIT_TIMEOUT) -> bool:
+        """
+        Block until ``path`` is written if it is still being encoded.
+
+        Returns:
+            False if the encode did not finish within ``timeout``
+        """
+        job = self._in_flight.get(os.path.abspath(path))
+        return job is None or job.done.wait(timeout)
+
+    def flush(self):
+        """Block until every image queued so far has been written (or has failed)"""
+        self._queue.join()
+
+    def close(self, timeout: float = 30.0):
+        """Stop accepting images and write everything still queued"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+        if any(worker.is_alive() for worker in self._workers):
+            logger.error(f"Result encoder did not drain within {timeout}s; "
+                         f"{self._queue.qsize()} queued images may be lost")
+
+    def metrics(self) -> Dict[str, float]:
+        """Counters plus queue depth and encode latency (milliseconds)"""
+        with self._lock:
+            stats = dict(self.stats)
+            latency = dict(self._latency)
+            in_flight = len({id(job) for job in self._in_flight.values()})
+        encoded = stats["encoded"] + stats["failed"]
+        return dict(
+            stats,
+            queue_depth=self._queue.qsize(),
+            in_flight=in_flight,
+            encode_ms_avg=round(latency["encode_total"] / encoded * 1000, 2) if encoded else 0.0,
+            encode_ms_max=round(latency["encode_max"] * 1000, 2),
+            queue_wait_ms_avg=round(latency["wait_total"] / encoded * 1000, 2) if encoded else 0.0,
+            queue_wait_ms_max=round(latency["wait_max"] * 1000, 2),
+        )
+
+    # ---------------------- Worker ----------------------
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is _STOP:
+                    return
+                waited = time.perf_counter() - job.submitted
+                elapsed = self._encode(job)
+                with self._lock:
+                    self._latency["wait_total"] += waited
+                    self._latency["wait_max"] = max(self._latency["wait_max"], waited)
+                    self._latency["encode_total"] += elapsed
+                    self._latency["encode_max"] = max(self._latency["encode_max"], elapsed)
+                    for path in job.paths:
+                        self._in_flight.pop(os.path.abspath(path), None)
+            finally:
+                self._queue.task_done()
+
+    def _encode(self, job: _EncodeJob) -> float:
+        start = time.perf_counter()
+        try:
+            for rendition, path in zip(job.renditions, job.paths):
+                write_rendition(job.image, rendition, path)
+            self.stats["encoded"] += 1
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error(f"Failed to encode result image {job.paths[0]}: {str(e)}")
+        finally:
+            # Waiting requests give up on a failed encode and 404 as before
+            job.done.set()
+            job.image = None
+        return time.perf_counter() - start
+
+
+def create_encoder(app) -> Optional[ResultEncoder]:
+    """ResultEncoder configured from app.config, or None when images are encoded inline"""
+    if not app.config.get("RESULT_ENCODE_BACKGROUND", True):
+        return None
+    return ResultEncoder(
+        workers=app.config.get("RESULT_ENCODE_WORKERS", WORKERS),
+        max_queue=app.config.get("RESULT_ENCODE_MAX_QUEUE", MAX_QUEUE)
+    )
@@ -0,0 +1,256 @@
+"""
+Precompressed, fingerprinted static assets
+A build step copies the frontend and static folders into a
+content-addressed build directory. It then:
+- writes gzip (and, with the optional ``brotli`` package, brotli)
+  variants of text assets
+- rewrites HTML references to content-hashed file names, so those assets
+  can be cached for a year
+
+At request time the server only picks the variant matching
+Accept-Encoding and streams the file; nothing is compressed per request.
+
+Usage:
+    python static_assets.py            # build (or refresh) the asset directory
+    python static_assets.py --force    # rebuild even if sources are unchanged
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+from typing import Dict, Mapping, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:
+    # brotli not installed: serve gzip variants only
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BUILD_DIR = os.path.join(ROOT_DIR, "asset_build")
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# URL prefix -> (source folder, extensions that prefix serves; None = all)
+ASSET_ROOTS: Dict[str, Tuple[str, Optional[Tuple[str, ...]]]] = {
+    "static": ("static", None),
+    "frontend": ("frontend", (".js", ".css", ".html")),
+}
+COMPRESSIBLE_EXTENSIONS = (".js", ".css", ".html", ".svg", ".json", ".txt", ".md", ".ico")
+# Variants must save at least this fraction of the original to be kept
+MIN_COMPRESSION_SAVING = 0.05
+FINGERPRINT_LENGTH = 10
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# src="..." / href="..." with an optional hand-written ?v= cache buster
+_REFERENCE_RE = re.compile(r'(?P<attr>\b(?:src|href))="(?P<url>[^"#?:]+)(?:\?v=[^"]*)?"')
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def fingerprinted_name(path: str, digest: str) -> str:
+    """analyze.js + digest -> analyze.<hash>.js"""
+    base, ext = posixpath.splitext(path)
+    return f"{base}.{digest[:FINGERPRINT_LENGTH]}{ext}"
+
+
+def _sources(roots: Mapping[str, Tuple[str, Optional[Tuple[str, ...]]]], base_dir: str):
+    """Yield (prefix, url path, file path) for every servable source file"""
+    for prefix, (folder, extensions) in roots.items():
+        top = os.path.join(base_dir, folder)
+        for dirpath, dirnames, filenames in os.walk(top):
+            dirnames.sort()
+            for fname in sorted(filenames):
+                if extensions is None or fname.lower().endswith(extensions):
+                    path = os.path.join(dirpath, fname)
+                    yield prefix, os.path.relpath(path, top).replace(os.sep, "/"), path
+
+
+def _source_state(roots, base_dir) -> Dict[str, list]:
+    state = {}
+    for prefix, url_path, path in _sources(roots, base_dir):
+        st = os.stat(path)
+        state[f"{prefix}/{url_path}"] = [st.st_mtime_ns, st.st_size]
+    return state
+
+
+def _rewrite_html(html: str, prefix: str, url_path: str, fingerprints: Dict[str, str]) -> str:
+    """Point references to built assets at their fingerprinted names"""
+    html_dir = posixpath.dirname(url_path)
+
+    def replace(match):
+        url = match.group("url")
+        if url.startswith("/"):
+            parts = url.lstrip("/").split("/", 1)
+            target_prefix, target = (parts[0], parts[1]) if len(parts) == 2 and parts[0] == "static" \
+                else ("frontend", url.lstrip("/"))
+        else:
+            target_prefix, target = prefix, posixpath.normpath(posixpath.join(html_dir, url))
+        fingerprinted = fingerprints.get(f"{target_prefix}/{target}")
+        if fingerprinted is None:
+            return match.group(0)
+        new_url = posixpath.join(posixpath.dirname(url), posixpath.basename(fingerprinted))
+        return f'{match.group("attr")}="{new_url}"'
+
+    return _REFERENCE_RE.sub(replace, html)
+
+
+def _write_variants(build_dir: str, name: str, data: bytes) -> Dict[str, str]:
+    """Write gzip/brotli variants of ``name`` worth keeping; returns encoding -> file name"""
+    variants = {}
+    candidates = [("gzip", ".gz", lambda d: gzip.compress(d, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        candidates.insert(0, ("br", ".br", lambda d: brotli.compress(d, quality=11)))
+    for encoding, suffix, compress in candidates:
+        compressed = compress(data)
+        if len(compressed) <= len(data) * (1 - MIN_COMPRESSION_SAVING):
+            with open(os.path.join(build_dir, name + suffix), "wb") as f:
+                f.write(compressed)
+            variants[encoding] = name + suffix
+    return variants
+
+
+def build_assets(build_dir: str = DEFAULT_BUILD_DIR, base_dir: str = ROOT_DIR,
+                 roots=ASSET_ROOTS) -> Dict:
+    """
+    Build the asset directory and return its manifest.
+
+    Files are stored once per distinct content (``<sha256>.<ext>``), so
+    copies of the same image under several folders cost one file.
+    """
+    # Built beside the target and swapped in, so a concurrent reader never
+    # sees a half-written directory
+    final_dir = build_dir
+    build_dir = f"{final_dir}.tmp-{os.getpid()}"
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+
+    sources = list(_sources(roots, base_dir))
+    contents = {}
+    fingerprints = {}
+    for prefix, url_path, path in sources:
+        with open(path, "rb") as f:
+            data = f.read()
+        key = f"{prefix}/{url_path}"
+        contents[key] = data
+        # HTML pages are entry points whose URLs must stay stable
+        if not url_path.lower().endswith(".html"):
+            fingerprints[key] = fingerprinted_name(url_path, _digest(data))
+
+    assets = {}
+    stored = {}
+    for prefix, url_path, path in sources:
+        key = f"{prefix}/{url_path}"
+        data = contents[key]
+        if url_path.lower().endswith(".html"):
+            data = _rewrite_html(data.decode("utf-8"), prefix, url_path, fingerprints).encode("utf-8")
+
+        digest = _digest(data)
+        ext = posixpath.splitext(url_path)[1].lower()
+        name = digest + ext
+        if name not in stored:
+            with open(os.path.join(build_dir, name), "wb") as f:
+                f.write(data)
+            stored[name] = _write_variants(build_dir, name, data) if ext in COMPRESSIBLE_EXTENSIONS else {}
+
+        entry = {
+            "file": name,
+            "encodings": stored[name],
+            "mimetype": mimetypes.guess_type(url_path)[0] or "application/octet-stream",
+        }
+        assets[key] = dict(entry, immutable=False)
+        if key in fingerprints:
+            assets[f"{prefix}/{fingerprints[key]}"] = dict(entry, immutable=True)
+
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "sources": _source_state(roots, base_dir),
+        "assets": assets,
+    }
+    with open(os.path.join(build_dir, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+
+    previous = f"{final_dir}.old-{os.getpid()}"
+    if os.path.isdir(final_dir):
+        os.rename(final_dir, previous)
+    os.rename(build_dir, final_dir)
+    shutil.rmtree(previous, ignore_errors=True)
+    logger.info(f"Built {len(sources)} static assets into {len(stored)} files in {final_dir}")
+    return manifest
+
+
+def load_assets(build_dir: str = DEFAULT_BUILD_DIR, base_dir: str = ROOT_DIR, roots=ASSET_ROOTS,
+                rebuild_if_stale: bool = True) -> Optional["AssetManifest"]:
+    """
+    Load the built manifest, rebuilding first if any source changed.
+
+    Returns None if there is no usable build (callers then serve sources directly).
+    """
+    manifest_path = os.path.join(build_dir, MANIFEST_NAME)
+    manifest = None
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        pass
+
+    stale = (manifest is None or manifest.get("version") != MANIFEST_VERSION
+             or manifest.get("sources") != _source_state(roots, base_dir))
+    if stale:
+        if not rebuild_if_stale:
+            return None
+        try:
+            manifest = build_assets(build_dir, base_dir, roots)
+        except OSError as e:
+            logger.warning(f"Static asset build failed, serving sources directly: {str(e)}")
+            return None
+    return AssetManifest(build_dir, manifest["assets"])
+
+
+class AssetManifest:
+    """Lookup of built assets by URL prefix and path"""
+
+    def __init__(self, build_dir: str, assets: Dict[str, Dict]):
+        self.build_dir = build_dir
+        self.assets = assets
+
+    def lookup(self, prefix: str, url_path: str) -> Optional[Dict]:
+        return self.assets.get(f"{prefix}/{url_path}")
+
+    def choose(self, entry: Dict, accept_encodings) -> Tuple[str, Optional[str]]:
+        """
+        (file path, content encoding) of the best variant the client accepts.
+
+        ``accept_encodings`` is werkzeug's request.accept_encodings.
+        """
+        best, best_quality = None, 0
+        for encoding in ("br", "gzip"):
+            quality = accept_encodings[encoding] if encoding in entry["encodings"] else 0
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        name = entry["encodings"][best] if best else entry["file"]
+        return os.path.join(self.build_dir, name), best
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Precompress and fingerprint static assets")
+    parser.add_argument("--build-dir", default=DEFAULT_BUILD_DIR)
+    parser.add_argument("--force", action="store_true", help="Rebuild even if sources are unchanged")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    if args.force:
+        build_assets(args.build_dir)
+    else:
+        load_assets(args.build_dir)
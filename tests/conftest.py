@@ -10,6 +10,8 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from app import app as flask_app
 from models import db, User
+from auth import user_cache
+from app import rate_limiter
 
 @pytest.fixture
 def app():
@@ -19,8 +21,13 @@ def app():
         'SQLALCHEMY_DATABASE_URI': 'sqlite:///:memory:',  # In-memory database for testing
         'SECRET_KEY': 'test-secret-key',
         'WTF_CSRF_ENABLED': False,
+        'RATE_LIMIT_ENABLED': False,  # tests that need it switch it on
     })
     
+    # Ids are reused once tables are recreated, so cached users must go too
+    user_cache.clear()
+    rate_limiter.clear()
+    
     # Create tables
     with flask_app.app_context():
         db.create_all()
@@ -0,0 +1,144 @@
+"""
+Test write-behind analysis persistence
+"""
+import threading
+import uuid
+import pytest
+from models import db, User, Analysis, AnalysisSummary
+from analysis_writer import AnalysisWriter
+
+
+@pytest.fixture
+def user_id(auth_headers):
+    return User.query.filter_by(email='test@example.com').first().id
+
+
+@pytest.fixture
+def writer(app):
+    writer = AnalysisWriter(app, batch_size=4, flush_interval=0.01)
+    yield writer
+    writer.close()
+
+
+def _submit(writer, user_id, test_type='fob', **fields):
+    provisional_id = uuid.uuid4().hex
+    response = {'result': 'negative', 'analysis_id': provisional_id}
+    fields = dict({'user_id': user_id, 'test_type': test_type, 'result': 'negative', 'raw_data': '{}',
+                   'request_id': provisional_id}, **fields)
+    assert writer.submit(provisional_id, fields, response)
+    return provisional_id
+
+
+class TestAnalysisWriter:
+    """Test the background group-committer"""
+
+    def test_group_commits_in_batches(self, app, writer, user_id):
+        for _ in range(10):
+            _submit(writer, user_id)
+
+        writer.flush()
+
+        assert Analysis.query.count() == 10
+        assert writer.stats['written'] == 10
+        assert 3 <= writer.stats['batches'] <= 10
+        assert AnalysisSummary.query.filter_by(user_id=user_id).one().total == 10
+
+    def test_close_drains_queue(self, app, user_id):
+        writer = AnalysisWriter(app, batch_size=4, flush_interval=1.0)
+        for _ in range(6):
+            _submit(writer, user_id)
+
+        writer.close()
+
+        assert Analysis.query.count() == 6
+        assert writer.submit('late', {}, {}) is False
+
+    def test_bad_row_does_not_lose_batch(self, app, writer, user_id):
+        _submit(writer, user_id)
+        _submit(writer, user_id, result=None)  # violates NOT NULL
+        _submit(writer, user_id)
+
+        writer.flush()
+
+        assert Analysis.query.count() == 2
+        assert writer.stats['failed'] == 1
+
+    def test_status(self, app, writer, user_id):
+        written = _submit(writer, user_id)
+        failed = _submit(writer, user_id, result=None)
+        writer.flush()
+
+        assert writer.status(written, user_id) is None
+        assert Analysis.query.filter_by(request_id=written).one().user_id == user_id
+        assert writer.status(failed, user_id) == 'failed'
+        assert writer.status(failed, user_id + 1) is None
+
+
+class TestWriteBehindAnalyze:
+    """Test save_analysis with write-behind enabled"""
+
+    def test_provisional_id_then_history(self, app, client, auth_headers, writer, monkeypatch):
+        import app as app_module
+        monkeypatch.setattr(app_module, 'analysis_writer', writer)
+        user = User.query.filter_by(email='test@example.com').first()
+        response = {'success': True, 'test_type': 'fob', 'result': 'negative', 'analysis_id': 'abc123'}
+
+        app_module.save_analysis(user, response, test_type='fob', result='negative')
+
+        assert response['saved'] == 'pending'
+        assert response['pending'] is True
+        assert response['analysis_id'] is None
+        assert response['request_id'] == 'abc123'
+
+        writer.flush()
+        data = client.get('/history', headers=auth_headers).get_json()
+        assert data['count'] == 1
+        assert data['analyses'][0]['result'] == 'negative'
+        assert data['analyses'][0]['request_id'] == 'abc123'
+
+    def test_pending_id_resolves(self, app, client, auth_headers, writer, monkeypatch):
+        import app as app_module
+        monkeypatch.setattr(app_module, 'analysis_writer', writer)
+        user = User.query.filter_by(email='test@example.com').first()
+        # Hold the writer so the analysis stays queued
+        release = threading.Event()
+        write = writer._write
+        monkeypatch.setattr(writer, '_write', lambda batch: release.wait(5) and write(batch))
+        response = {'success': True, 'test_type': 'fob', 'result': 'negative', 'analysis_id': 'def456'}
+        app_module.save_analysis(user, response, test_type='fob', result='negative')
+
+        pending = client.get('/history/pending/def456', headers=auth_headers)
+        assert pending.status_code == 202
+        assert pending.get_json()['saved'] == 'pending'
+
+        release.set()
+        writer.flush()
+        resolved = client.get('/history/pending/def456', headers=auth_headers)
+        assert resolved.status_code == 200
+        assert resolved.get_json()['analysis']['details']['result'] == 'negative'
+        assert client.get('/history/pending/unknown', headers=auth_headers).status_code == 404
+
+    def test_failed_write_is_reported(self, app, client, auth_headers, writer, monkeypatch):
+        import app as app_module
+        monkeypatch.setattr(app_module, 'analysis_writer', writer)
+        user = User.query.filter_by(email='test@example.com').first()
+        response = {'success': True, 'test_type': 'fob', 'analysis_id': 'bad789'}
+
+        app_module.save_analysis(user, response, test_type='fob', result=None)  # violates NOT NULL
+        writer.flush()
+
+        failed = client.get('/history/pending/bad789', headers=auth_headers)
+        assert failed.status_code == 500
+        assert failed.get_json()['saved'] is False
+
+    def test_direct_save_stores_request_id(self, app, client, auth_headers):
+        import app as app_module
+        user = User.query.filter_by(email='test@example.com').first()
+        response = {'success': True, 'test_type': 'fob', 'result': 'negative', 'analysis_id': 'ghi012'}
+
+        app_module.save_analysis(user, response, test_type='fob', result='negative')
+
+        assert response['saved'] is True
+        assert isinstance(response['analysis_id'], int)
+        resolved = client.get('/history/pending/ghi012', headers=auth_headers).get_json()
+        assert resolved['analysis']['id'] == response['analysis_id']
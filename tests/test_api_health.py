@@ -1,6 +1,8 @@
 """
 Test API health and basic endpoints
 """
+import os
+import uuid
 import pytest
 
 def test_health_check(client):
@@ -32,3 +34,55 @@ def test_method_not_allowed(client):
     """Test method not allowed error"""
     response = client.post('/health')  # Health endpoint only accepts GET
     assert response.status_code == 405
+
+def test_result_images_are_immutable(client, app):
+    """Test result images get long-lived private immutable caching"""
+    filename = f"test_{uuid.uuid4().hex}.png"
+    path = os.path.join(app.root_path, 'result_images', filename)
+    with open(path, 'wb') as f:
+        f.write(b'not really a png')
+    try:
+        response = client.get(f'/result_images/{filename}')
+        cache_control = response.headers['Cache-Control']
+        assert response.status_code == 200
+        assert 'immutable' in cache_control
+        assert 'max-age=31536000' in cache_control
+        assert 'private' in cache_control
+        assert 'public' not in cache_control
+        response.close()
+    finally:
+        os.remove(path)
+
+def test_result_image_size_parameter(client, monkeypatch, tmp_path):
+    """Test ?size= serves the named rendition and rejects unknown sizes"""
+    import app as app_module
+    monkeypatch.setattr(app_module, 'RESULT_IMAGES_FOLDER', str(tmp_path))
+    (tmp_path / 'abc_fob_result.jpg').write_bytes(b'full image')
+    (tmp_path / 'abc_fob_result.thumb.webp').write_bytes(b'thumbnail')
+
+    response = client.get('/result_images/abc_fob_result.jpg?size=thumb')
+    assert response.status_code == 200
+    assert response.data == b'thumbnail'
+    assert response.mimetype == 'image/webp'
+    response.close()
+
+    response = client.get('/result_images/abc_fob_result.jpg')
+    assert response.data == b'full image'
+    response.close()
+
+    assert client.get('/result_images/abc_fob_result.jpg?size=huge').status_code == 400
+
+def test_inline_thumbnail(app, monkeypatch, tmp_path):
+    """Test the smallest rendition is embedded only when it fits the size cap"""
+    import app as app_module
+    thumb = tmp_path / 'abc.thumb.webp'
+    thumb.write_bytes(b'RIFF....WEBP')
+    response = {"result_renditions": {"thumb": str(thumb), "full": str(tmp_path / 'abc.jpg')}}
+
+    app_module.inline_thumbnail(response)
+    assert response["result_thumbnail"].startswith("data:image/webp;base64,")
+
+    monkeypatch.setitem(app.config, 'RESULT_INLINE_MAX_BYTES', 4)
+    response.pop("result_thumbnail")
+    app_module.inline_thumbnail(response)
+    assert "result_thumbnail" not in response
@@ -1,8 +1,12 @@
 """
 Test authentication endpoints
 """
+import threading
 import pytest
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
 from models import User, db
+from auth import UserCache, user_cache, PasswordHasher, PasswordHasherBusy
 
 class TestRegistration:
     """Test user registration"""
@@ -254,6 +258,16 @@ class TestProtectedRoutes:
         
         assert response.status_code == 200
     
+    def test_profile_conditional_get(self, client, auth_headers):
+        """Test /profile answers 304 until the profile changes"""
+        etag = client.get('/profile', headers=auth_headers).headers['ETag']
+        conditional = dict(auth_headers, **{'If-None-Match': etag})
+        
+        assert client.get('/profile', headers=conditional).status_code == 304
+        
+        client.post('/update-profile', headers=auth_headers, json={'username': 'changed'})
+        assert client.get('/profile', headers=conditional).status_code == 200
+    
     def test_access_with_invalid_token(self, client):
         """Test accessing protected route with invalid token"""
         response = client.get('/profile', headers={
@@ -261,3 +275,155 @@ class TestProtectedRoutes:
         })
         
         assert response.status_code == 401
+
+
+class TestUserCache:
+    """Test the auth decorators' user cache"""
+    
+    def _user_selects(self, app, client, headers, path='/profile'):
+        """Run one request and return the SELECTs it issued against users"""
+        statements = []
+        
+        def capture(conn, cursor, statement, *args):
+            if statement.lstrip().upper().startswith('SELECT') and 'FROM users' in statement:
+                statements.append(statement)
+        
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', capture)
+            try:
+                response = client.get(path, headers=headers)
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', capture)
+        assert response.status_code == 200
+        return statements
+    
+    def test_second_request_skips_user_query(self, app, client, auth_headers):
+        """Test the user is read once and then served from the cache"""
+        user_cache.clear()
+        before = user_cache.snapshot()
+        
+        assert len(self._user_selects(app, client, auth_headers)) == 1
+        assert self._user_selects(app, client, auth_headers) == []
+        
+        after = user_cache.snapshot()
+        assert after['hits'] - before['hits'] == 1
+        assert after['misses'] - before['misses'] == 1
+    
+    def test_update_profile_invalidates(self, client, auth_headers):
+        client.get('/profile', headers=auth_headers)
+        client.post('/update-profile', headers=auth_headers, json={'username': 'renamed'})
+        
+        data = client.get('/profile', headers=auth_headers).get_json()
+        
+        assert data['user']['username'] == 'renamed'
+    
+    def test_change_password_invalidates(self, client, auth_headers):
+        client.post('/change-password', headers=auth_headers,
+                    json={'current_password': 'password123', 'new_password': 'newpass456'})
+        
+        response = client.post('/change-password', headers=auth_headers,
+                               json={'current_password': 'password123', 'new_password': 'other789'})
+        
+        assert response.status_code == 401
+    
+    def test_delete_account_invalidates(self, client, auth_headers):
+        client.get('/profile', headers=auth_headers)
+        client.delete('/delete-account', headers=auth_headers)
+        
+        response = client.get('/profile', headers=auth_headers)
+        
+        assert response.status_code == 401
+    
+    def test_lru_eviction(self):
+        cache = UserCache(max_size=2, ttl=60)
+        for user_id in (1, 2, 3):
+            cache.put(User(id=user_id, username=f'u{user_id}', email=f'u{user_id}@example.com'))
+        
+        assert cache.get(1) is None
+        assert cache.get(3)['username'] == 'u3'
+        assert cache.snapshot()['evictions'] == 1
+    
+    def test_ttl_expiry(self, monkeypatch):
+        cache = UserCache(max_size=2, ttl=30)
+        cache.put(User(id=1, username='u1', email='u1@example.com'))
+        
+        import auth
+        now = auth.time.monotonic()
+        monkeypatch.setattr(auth.time, 'monotonic', lambda: now + 31)
+        
+        assert cache.get(1) is None
+
+
+@pytest.fixture
+def blocked_hasher():
+    """A one-slot hasher whose slot is held until the returned event is set"""
+    hasher = PasswordHasher(workers=1, max_queue=0, timeout=5.0)
+    release = threading.Event()
+    started = threading.Event()
+    
+    def block():
+        started.set()
+        release.wait(5)
+    
+    thread = threading.Thread(target=hasher.run, args=(block,))
+    thread.start()
+    started.wait(5)
+    yield hasher, release
+    release.set()
+    thread.join()
+
+class TestPasswordHasher:
+    """Test bounded password hashing"""
+    
+    def test_hash_and_verify(self):
+        hasher = PasswordHasher()
+        password_hash = hasher.hash_password('secret123')
+        
+        assert hasher.verify_password(password_hash, 'secret123') is True
+        assert hasher.verify_password(password_hash, 'wrong') is False
+    
+    def test_concurrent_call_waits_for_its_turn(self):
+        hasher = PasswordHasher()
+        release, started = threading.Event(), threading.Event()
+        thread = threading.Thread(target=hasher.run, args=(lambda: started.set() or release.wait(5),))
+        thread.start()
+        started.wait(5)
+        threading.Timer(0.05, release.set).start()
+        
+        assert hasher.run(lambda: 'done') == 'done'
+        thread.join()
+        assert hasher.stats == {'completed': 2, 'rejected': 0, 'timeouts': 0}
+    
+    def test_full_queue_rejects_immediately(self, blocked_hasher):
+        hasher, _ = blocked_hasher
+        
+        with pytest.raises(PasswordHasherBusy):
+            hasher.hash_password('secret123')
+        assert hasher.stats['rejected'] == 1
+    
+    def test_queued_call_times_out(self):
+        hasher = PasswordHasher(workers=1, max_queue=1, timeout=0.05)
+        release, started = threading.Event(), threading.Event()
+        thread = threading.Thread(target=hasher.run, args=(lambda: started.set() or release.wait(5),))
+        thread.start()
+        started.wait(5)
+        
+        with pytest.raises(PasswordHasherBusy):
+            hasher.hash_password('secret123')
+        assert hasher.stats['timeouts'] == 1
+        release.set()
+        thread.join()
+    
+    def test_login_returns_503_when_busy(self, client, blocked_hasher, monkeypatch):
+        import app as app_module
+        with client.application.app_context():
+            user = User(username='busyuser', email='busy@example.com',
+                        password_hash=generate_password_hash('password123'))
+            db.session.add(user)
+            db.session.commit()
+        monkeypatch.setattr(app_module, 'password_hasher', blocked_hasher[0])
+        
+        response = client.post('/login', json={'email': 'busy@example.com', 'password': 'password123'})
+        
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
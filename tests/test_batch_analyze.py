@@ -0,0 +1,100 @@
+"""
+Test the offline batch runner
+"""
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import pytest
+from batch_analyze import (infer_test_type, discover_images, read_manifest, load_completed_keys,
+                           item_key, run_batch)
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SAMPLE_FOB = os.path.join(ROOT, 'static', 'sample-images', 'fob', 'real test.jpeg')
+
+
+@pytest.fixture
+def archive(tmp_path):
+    """Archive with one FOB photo and one photo of unknown type"""
+    if not os.path.exists(SAMPLE_FOB):
+        pytest.skip("Sample FOB image not available")
+    (tmp_path / 'fob').mkdir()
+    (tmp_path / 'misc').mkdir()
+    shutil.copy(SAMPLE_FOB, tmp_path / 'fob' / 'a.jpeg')
+    shutil.copy(SAMPLE_FOB, tmp_path / 'misc' / 'b.jpeg')
+    (tmp_path / 'fob' / 'notes.txt').write_text('not an image')
+    return tmp_path
+
+
+class TestInputs:
+    """Test directory and manifest discovery"""
+
+    def test_infer_test_type(self):
+        assert infer_test_type(os.path.join('archive', 'PH', '2024', 'x.jpg')) == 'ph'
+        assert infer_test_type(os.path.join('archive', 'x.jpg')) is None
+
+    def test_discover_images(self, archive):
+        items = list(discover_images(str(archive)))
+
+        assert [os.path.basename(i['path']) for i in items] == ['a.jpeg', 'b.jpeg']
+        assert [i['test_type'] for i in items] == ['fob', None]
+
+    def test_csv_manifest(self, tmp_path):
+        manifest = tmp_path / 'list.csv'
+        manifest.write_text('path,test_type\nimgs/1.jpg,ph\nfob/2.jpg,\n')
+        items = list(read_manifest(str(manifest)))
+
+        assert items[0] == {'path': str(tmp_path / 'imgs' / '1.jpg'), 'test_type': 'ph'}
+        assert items[1]['test_type'] == 'fob'
+
+    def test_text_and_jsonl_manifests(self, tmp_path):
+        (tmp_path / 'list.txt').write_text('# comment\nurinalysis/1.jpg\n\n')
+        (tmp_path / 'list.jsonl').write_text('{"path": "/data/2.jpg", "test_type": "fob"}\n')
+
+        assert [i['test_type'] for i in read_manifest(str(tmp_path / 'list.txt'))] == ['urinalysis']
+        assert list(read_manifest(str(tmp_path / 'list.jsonl'))) == [{'path': '/data/2.jpg', 'test_type': 'fob'}]
+
+
+class TestResume:
+    """Test resumable JSONL output"""
+
+    def test_torn_last_line_is_ignored(self, tmp_path):
+        """Test a line cut short by a crash is skipped and the file is re-terminated"""
+        output = tmp_path / 'out.jsonl'
+        output.write_text('{"key": "fob:a.jpg", "ok": true}\n{"key": "fob:b.j')
+
+        assert load_completed_keys(str(output)) == {'fob:a.jpg'}
+        assert output.read_text().endswith('\n')
+
+    def test_missing_output(self, tmp_path):
+        assert load_completed_keys(str(tmp_path / 'none.jsonl')) == set()
+
+    def test_run_and_resume(self, archive, tmp_path):
+        """Test results are streamed once per image and a rerun skips them"""
+        output = str(tmp_path / 'results.jsonl')
+        items = list(discover_images(str(archive)))
+
+        summary = run_batch(items, output, workers=1, progress_stream=io.StringIO())
+        records = [json.loads(line) for line in open(output)]
+
+        assert summary['done'] == 2
+        assert summary['ok'] == 1 and summary['failed'] == 1
+        assert {r['key'] for r in records} == {item_key(i) for i in items}
+        fob = next(r for r in records if r['test_type'] == 'fob')
+        assert fob['result']['result'] in ('positive', 'negative', 'invalid')
+
+        progress = io.StringIO()
+        summary = run_batch(items, output, workers=1, progress_stream=progress)
+        assert summary['done'] == 0 and summary['skipped'] == 2
+        assert len(open(output).readlines()) == 2
+        assert '0/0 images' in progress.getvalue()
+
+
+def test_batch_does_not_import_flask_or_database():
+    """Test the batch runner stays independent of the web app"""
+    code = ("import sys, batch_analyze; batch_analyze.analyze_item({'path': 'missing.jpg', 'test_type': 'fob'}); "
+            "bad = [m for m in ('flask', 'flask_sqlalchemy', 'sqlalchemy', 'models', 'app') if m in sys.modules]; "
+            "sys.exit(1 if bad else 0)")
+    assert subprocess.run([sys.executable, '-c', code], cwd=ROOT).returncode == 0
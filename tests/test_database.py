@@ -0,0 +1,42 @@
+"""
+Test database engine configuration
+"""
+from sqlalchemy import create_engine, text
+from database import engine_options, configure_engine
+
+
+class TestEngineOptions:
+    """Test per-backend engine options"""
+
+    def test_postgres_pool_settings(self):
+        options = engine_options('postgresql://u:p@db.example.com/rapidtest',
+                                 {'DB_POOL_SIZE': 8, 'DB_MAX_OVERFLOW': 4})
+
+        assert options['pool_size'] == 8
+        assert options['max_overflow'] == 4
+        assert options['pool_pre_ping'] is True
+        assert options['pool_recycle'] == 1800
+
+    def test_sqlite_keeps_default_pool(self):
+        assert engine_options('sqlite:///rapidtest.db', {}) == {}
+
+
+class TestSqlitePragmas:
+    """Test SQLite connections are tuned"""
+
+    def test_file_database_uses_wal(self, tmp_path):
+        engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+        configure_engine(engine)
+
+        with engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert conn.execute(text('PRAGMA synchronous')).scalar() == 1  # NORMAL
+            assert conn.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+        engine.dispose()
+
+    def test_memory_database_untouched(self):
+        engine = create_engine('sqlite:///:memory:')
+        configure_engine(engine)
+
+        with engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'memory'
@@ -0,0 +1,230 @@
+"""
+Test analysis history pagination
+"""
+from datetime import datetime, timedelta
+import pytest
+from sqlalchemy import event, text
+from models import db, User, Analysis
+from migrations import upgrade, applied_migrations, add_column, MIGRATIONS
+
+
+@pytest.fixture
+def history(client, auth_headers):
+    """Seed 30 analyses (alternating fob/ph) for the logged-in user; some share a timestamp"""
+    with client.application.app_context():
+        user = User.query.filter_by(email='test@example.com').first()
+        base = datetime(2024, 1, 1)
+        for i in range(30):
+            db.session.add(Analysis(
+                user_id=user.id,
+                test_type='fob' if i % 2 else 'ph',
+                result=f'result {i}',
+                raw_data='{}',
+                # Pairs of rows share created_at to exercise the id tie-breaker
+                created_at=base + timedelta(minutes=i // 2)
+            ))
+        db.session.commit()
+    return auth_headers
+
+
+def _all_pages(client, headers, **params):
+    ids, cursor = [], None
+    while True:
+        query = dict(params, **({'cursor': cursor} if cursor else {}))
+        data = client.get('/history', headers=headers, query_string=query).get_json()
+        ids.extend(a['id'] for a in data['analyses'])
+        cursor = data['next_cursor']
+        if not cursor:
+            return ids
+
+
+class TestHistoryPagination:
+    """Test keyset pagination of /history"""
+
+    def test_first_page(self, client, history):
+        data = client.get('/history?limit=10', headers=history).get_json()
+
+        assert data['count'] == 10
+        assert data['next_cursor']
+        created = [a['created_at'] for a in data['analyses']]
+        assert created == sorted(created, reverse=True)
+
+    def test_pages_cover_history_exactly_once(self, client, history):
+        """Test walking the cursors visits every row once, newest first"""
+        ids = _all_pages(client, history, limit=7)
+
+        assert len(ids) == 30
+        assert len(set(ids)) == 30
+
+    def test_filter_by_test_type(self, client, history):
+        ids = _all_pages(client, history, limit=4, test_type='fob')
+
+        assert len(ids) == 15
+
+    def test_page_size_is_capped(self, client, history, app):
+        app.config['HISTORY_MAX_PAGE_SIZE'] = 5
+        try:
+            data = client.get('/history?limit=1000', headers=history).get_json()
+        finally:
+            app.config['HISTORY_MAX_PAGE_SIZE'] = 100
+
+        assert data['count'] == 5
+        assert data['limit'] == 5
+
+    def test_last_page_has_no_cursor(self, client, history):
+        data = client.get('/history?limit=100', headers=history).get_json()
+
+        assert data['count'] == 30
+        assert data['next_cursor'] is None
+
+    def test_invalid_cursor(self, client, history):
+        response = client.get('/history?cursor=not-a-cursor', headers=history)
+
+        assert response.status_code == 400
+
+
+class TestHistoryDetail:
+    """Test raw_data is only loaded by the detail endpoint"""
+
+    def test_list_query_does_not_select_raw_data(self, client, history, app):
+        statements = []
+
+        def capture(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', capture)
+            try:
+                data = client.get('/history?limit=10', headers=history).get_json()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', capture)
+
+        assert data['count'] == 10
+        assert 'raw_data' not in data['analyses'][0]
+        assert not [s for s in statements if 'raw_data' in s]
+
+    def test_detail_includes_parsed_raw_data(self, client, history, app):
+        with app.app_context():
+            analysis = Analysis.query.first()
+            analysis.raw_data = '{"estimated_ph": 6.5}'
+            db.session.commit()
+            analysis_id = analysis.id
+
+        response = client.get(f'/history/{analysis_id}', headers=history)
+
+        assert response.status_code == 200
+        data = response.get_json()['analysis']
+        assert data['id'] == analysis_id
+        assert data['details'] == {'estimated_ph': 6.5}
+
+    def test_detail_of_other_user_is_not_found(self, client, history, app):
+        with app.app_context():
+            other = User(username='other', email='other@example.com')
+            other.set_password('OtherPass123!')
+            db.session.add(other)
+            db.session.commit()
+            analysis = Analysis(user_id=other.id, test_type='fob', result='negative', raw_data='{}')
+            db.session.add(analysis)
+            db.session.commit()
+            analysis_id = analysis.id
+
+        response = client.get(f'/history/{analysis_id}', headers=history)
+
+        assert response.status_code == 404
+
+    def test_detail_requires_auth(self, client):
+        response = client.get('/history/1')
+
+        assert response.status_code == 401
+
+
+class TestHistoryETag:
+    """Test conditional GET of /history"""
+
+    def test_etag_is_weak_and_private(self, client, history):
+        response = client.get('/history?limit=10', headers=history)
+
+        assert response.headers['ETag'].startswith('W/')
+        assert 'private' in response.headers['Cache-Control']
+
+    def test_matching_etag_returns_304_without_loading_rows(self, client, history, app):
+        etag = client.get('/history?limit=10', headers=history).headers['ETag']
+        statements = []
+
+        def capture(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', capture)
+            try:
+                response = client.get('/history?limit=10', headers=dict(history, **{'If-None-Match': etag}))
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', capture)
+
+        assert response.status_code == 304
+        assert response.data == b''
+        assert not [s for s in statements if 'analyses.result' in s]
+
+    def test_new_analysis_changes_etag(self, client, history, app):
+        etag = client.get('/history?limit=10', headers=history).headers['ETag']
+        with app.app_context():
+            user = User.query.filter_by(email='test@example.com').first()
+            db.session.add(Analysis(user_id=user.id, test_type='fob', result='negative', raw_data='{}'))
+            db.session.commit()
+
+        response = client.get('/history?limit=10', headers=dict(history, **{'If-None-Match': etag}))
+
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_page_parameters_are_part_of_etag(self, client, history):
+        first = client.get('/history?limit=10', headers=history).headers['ETag']
+        other = client.get('/history?limit=5', headers=history).headers['ETag']
+
+        assert first != other
+
+
+class TestHistoryIndexes:
+    """Test the history query is served from the composite indexes"""
+
+    def _plan(self, app, sql):
+        with app.app_context():
+            if db.engine.dialect.name != 'sqlite':
+                pytest.skip("Query plan check is SQLite-specific")
+            rows = db.session.execute(text('EXPLAIN QUERY PLAN ' + sql)).fetchall()
+            return ' '.join(str(row[-1]) for row in rows)
+
+    def test_filtered_history_uses_composite_index(self, app):
+        plan = self._plan(app, "SELECT id FROM analyses WHERE user_id = 1 AND test_type = 'ph' "
+                               "AND (created_at < '2024-01-01' OR (created_at = '2024-01-01' AND id < 5)) "
+                               "ORDER BY created_at DESC, id DESC LIMIT 51")
+
+        assert 'ix_analyses_user_type_created' in plan
+        assert 'TEMP B-TREE' not in plan
+
+    def test_unfiltered_history_uses_user_index(self, app):
+        plan = self._plan(app, "SELECT id FROM analyses WHERE user_id = 1 "
+                               "ORDER BY created_at DESC, id DESC LIMIT 51")
+
+        assert 'ix_analyses_user_created' in plan
+        assert 'TEMP B-TREE' not in plan
+
+
+class TestMigrations:
+    """Test schema migrations"""
+
+    def test_upgrade_is_idempotent(self, app):
+        with app.app_context():
+            upgrade(db.engine)
+            assert upgrade(db.engine) == []
+            assert applied_migrations(db.engine) == [m[0] for m in MIGRATIONS]
+
+    def test_add_column_skips_existing_column(self, app):
+        with app.app_context(), db.engine.begin() as conn:
+            conn.execute(text("CREATE TABLE legacy (id INTEGER PRIMARY KEY)"))
+            add_column("legacy", "request_id", "VARCHAR(32)")(conn)
+            add_column("legacy", "request_id", "VARCHAR(32)")(conn)
+
+            columns = [row[1] for row in conn.execute(text("PRAGMA table_info(legacy)"))]
+            conn.execute(text("DROP TABLE legacy"))
+        assert columns == ["id", "request_id"]
@@ -0,0 +1,115 @@
+"""
+Test image quality validation
+"""
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+from utils import validate_image_quality, compute_quality_metrics, get_image_orientation
+
+
+def _textured(height, width, base=128, amplitude=60):
+    """Create a sharp, mid-brightness test image"""
+    rng = np.random.default_rng(0)
+    noise = rng.integers(-amplitude, amplitude, (height, width, 3))
+    return np.clip(base + noise, 0, 255).astype(np.uint8)
+
+
+@pytest.fixture
+def write_image(tmp_path):
+    """Write an image array to disk and return its path"""
+    def _write(image, name="image.jpg"):
+        path = str(tmp_path / name)
+        cv2.imwrite(path, image)
+        return path
+    return _write
+
+
+class TestImageValidation:
+    """Test validate_image_quality"""
+
+    def test_valid_image(self, write_image):
+        """Test a normal image passes"""
+        is_valid, error = validate_image_quality(write_image(_textured(400, 300)))
+        assert is_valid, error
+        assert error is None
+
+    def test_missing_file(self, tmp_path):
+        """Test a missing file is rejected"""
+        is_valid, error = validate_image_quality(str(tmp_path / "missing.jpg"))
+        assert not is_valid
+        assert "not found" in error
+
+    def test_invalid_file(self, tmp_path):
+        """Test a non-image file is rejected"""
+        path = tmp_path / "fake.jpg"
+        path.write_bytes(b"definitely not an image")
+        is_valid, error = validate_image_quality(str(path))
+        assert not is_valid
+        assert "invalid image" in error.lower()
+
+    def test_unsupported_format(self, tmp_path):
+        """Test formats OpenCV cannot decode are rejected from the header"""
+        path = str(tmp_path / "image.gif")
+        Image.fromarray(_textured(200, 200)).save(path)
+        is_valid, error = validate_image_quality(path)
+        assert not is_valid
+        assert "invalid image" in error.lower()
+
+    def test_too_small(self, write_image):
+        """Test images below the minimum size are rejected"""
+        is_valid, error = validate_image_quality(write_image(_textured(50, 300)))
+        assert not is_valid
+        assert "too small" in error.lower()
+
+    def test_too_large(self, write_image):
+        """Test oversize images are rejected"""
+        image = np.zeros((120, 5200, 3), dtype=np.uint8)
+        is_valid, error = validate_image_quality(write_image(image, "wide.png"))
+        assert not is_valid
+        assert "too large" in error.lower()
+
+    def test_too_dark(self, write_image):
+        """Test dark images are rejected"""
+        is_valid, error = validate_image_quality(write_image(_textured(300, 300, base=8, amplitude=8)))
+        assert not is_valid
+        assert "too dark" in error.lower()
+
+    def test_blank_image(self, write_image):
+        """Test uniform images are rejected"""
+        image = np.full((300, 300, 3), 128, dtype=np.uint8)
+        is_valid, error = validate_image_quality(write_image(image, "blank.png"))
+        assert not is_valid
+        assert "blank" in error.lower()
+
+    def test_blurry_image(self, write_image):
+        """Test out-of-focus images are rejected"""
+        gradient = np.tile(np.linspace(60, 200, 600, dtype=np.uint8), (400, 1))
+        image = cv2.cvtColor(gradient, cv2.COLOR_GRAY2BGR)
+        is_valid, error = validate_image_quality(write_image(image, "blurry.png"))
+        assert not is_valid
+        assert "blurry" in error.lower()
+
+    def test_glare(self, write_image):
+        """Test images dominated by saturated highlights are rejected"""
+        image = _textured(400, 400, base=100)
+        image[:, :220] = 255
+        is_valid, error = validate_image_quality(write_image(image, "glare.png"))
+        assert not is_valid
+        assert "glare" in error.lower()
+
+
+class TestQualityMetrics:
+    """Test compute_quality_metrics and header-based helpers"""
+
+    def test_metrics_keys(self):
+        """Test all metrics are reported"""
+        metrics = compute_quality_metrics(_textured(100, 100))
+        assert set(metrics) == {"brightness", "contrast", "sharpness", "glare"}
+        assert 100 < metrics["brightness"] < 160
+        assert metrics["glare"] == 0.0
+
+    def test_orientation(self, write_image):
+        """Test orientation is read from the header"""
+        assert get_image_orientation(write_image(_textured(300, 200), "p.jpg")) == 'portrait'
+        assert get_image_orientation(write_image(_textured(200, 300), "l.jpg")) == 'landscape'
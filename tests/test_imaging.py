@@ -0,0 +1,303 @@
+"""
+Test shared image preprocessing helpers
+"""
+import cv2
+import numpy as np
+import pytest
+from imaging import (WorkingImage, FrameContext, as_working_image, as_frame_context,
+                     read_image_header, reduced_decode_factor, load_image, RoiTracker,
+                     Rendition, DEFAULT_RENDITIONS, rendition_filename, renditions_from_config,
+                     encode_rendition, save_renditions, primary_rendition, box_kernel)
+
+
+@pytest.fixture
+def large_jpeg(tmp_path):
+    """Write a 2400x1200 JPEG and return its path"""
+    path = tmp_path / "large.jpg"
+    image = np.random.randint(0, 255, (1200, 2400, 3), dtype=np.uint8)
+    cv2.imwrite(str(path), image)
+    return str(path)
+
+
+class TestWorkingImage:
+    """Test working-resolution normalization"""
+
+    def test_large_image_is_downscaled(self):
+        """Test images above the target are shrunk to the target long side"""
+        full = np.zeros((2000, 4000, 3), dtype=np.uint8)
+        work = WorkingImage(full, 1000)
+
+        assert work.image.shape[:2] == (500, 1000)
+        assert work.scale == pytest.approx(0.25)
+        assert work.is_downscaled
+
+    def test_small_image_is_not_upscaled(self):
+        """Test images below the target are used as-is"""
+        full = np.zeros((300, 400, 3), dtype=np.uint8)
+        work = WorkingImage(full, 1000)
+
+        assert work.image is full
+        assert work.scale == 1.0
+        assert not work.is_rescaled
+
+    def test_fit_width_upscales(self):
+        """Test fit_width normalizes to an exact width in both directions"""
+        full = np.zeros((1344, 768, 3), dtype=np.uint8)
+        work = WorkingImage.fit_width(full, 800)
+
+        assert work.image.shape[1] == 800
+        assert work.scale > 1.0
+
+    def test_constant_scaling(self):
+        """Test lengths scale linearly and areas quadratically"""
+        work = WorkingImage(np.zeros((2000, 2000, 3), dtype=np.uint8), 1000)
+
+        assert work.length(80) == 40
+        assert work.area(1500) == pytest.approx(375)
+        assert work.kernel(21, odd=True) % 2 == 1
+        assert work.length(1) >= 1
+
+    def test_bbox_back_mapping(self):
+        """Test working-resolution boxes map back to full-resolution pixels"""
+        work = WorkingImage(np.zeros((2000, 2000, 3), dtype=np.uint8), 1000)
+
+        assert work.to_full_bbox((10, 20, 30, 40)) == (20, 40, 60, 80)
+        assert work.to_full_point((5, 7)) == (10, 14)
+
+    def test_as_working_image_passthrough(self):
+        """Test existing WorkingImages are not wrapped again"""
+        full = np.zeros((200, 200, 3), dtype=np.uint8)
+        work = WorkingImage(full, 100)
+
+        assert as_working_image(work) is work
+        assert as_working_image(full).image is full
+
+
+class TestReducedDecode:
+    """Test header reading and reduced-resolution decoding"""
+
+    def test_read_header(self, large_jpeg):
+        """Test dimensions and format come from the header"""
+        header = read_image_header(large_jpeg)
+
+        assert header.width == 2400
+        assert header.height == 1200
+        assert header.format == 'JPEG'
+        assert header.orientation == 1
+
+    def test_read_header_invalid_file(self, tmp_path):
+        """Test unreadable files return None"""
+        path = tmp_path / "broken.jpg"
+        path.write_bytes(b"not an image")
+
+        assert read_image_header(str(path)) is None
+
+    def test_decode_factor_stays_above_target(self, large_jpeg):
+        """Test the chosen reduction keeps the image at or above the target"""
+        header = read_image_header(large_jpeg)
+
+        assert reduced_decode_factor(header, min_dim=1000) == 2
+        assert reduced_decode_factor(header, min_dim=500) == 4
+        assert reduced_decode_factor(header, min_dim=2000) == 1
+        assert reduced_decode_factor(header, min_width=300) == 8
+        assert reduced_decode_factor(header) == 1
+
+    def test_load_image_reduced(self, large_jpeg):
+        """Test large JPEGs decode at reduced scale"""
+        image, decode_scale = load_image(large_jpeg, min_dim=1000)
+
+        assert image.shape[:2] == (600, 1200)
+        assert decode_scale == pytest.approx(0.5)
+
+    def test_load_image_full(self, large_jpeg):
+        """Test a full decode without a target"""
+        image, decode_scale = load_image(large_jpeg)
+
+        assert image.shape[:2] == (1200, 2400)
+        assert decode_scale == 1.0
+
+
+class TestFrameContext:
+    """Test per-frame caching of derived views"""
+
+    def test_views_are_memoized(self):
+        """Test gray, HSV and blurs are computed once and reused"""
+        ctx = FrameContext(np.random.randint(0, 255, (50, 60, 3), dtype=np.uint8))
+
+        assert ctx.gray is ctx.gray
+        assert ctx.hsv is ctx.hsv
+        assert ctx.median_blur(5) is ctx.median_blur(5)
+        assert ctx.gaussian_blur(5) is not ctx.gaussian_blur(7)
+        assert ctx.gray.shape == (50, 60)
+
+    def test_cached_computes_once(self):
+        """Test custom derived values are computed on first use only"""
+        ctx = FrameContext(np.zeros((10, 10, 3), dtype=np.uint8))
+        calls = []
+
+        def compute():
+            calls.append(1)
+            return 42
+
+        assert ctx.cached('answer', compute) == 42
+        assert ctx.cached('answer', compute) == 42
+        assert len(calls) == 1
+
+    def test_roi_slices_parent_views(self):
+        """Test ROI contexts reuse the parent's conversions when available"""
+        image = np.random.randint(0, 255, (40, 40, 3), dtype=np.uint8)
+        ctx = FrameContext(image)
+        parent_hsv = ctx.hsv
+
+        roi = ctx.roi((5, 10, 20, 15))
+
+        assert roi.image.shape[:2] == (15, 20)
+        assert np.shares_memory(roi.hsv, parent_hsv)
+        assert np.array_equal(roi.hsv, cv2.cvtColor(image[10:25, 5:25], cv2.COLOR_BGR2HSV))
+
+    def test_roi_converts_locally_without_parent_view(self):
+        """Test ROI contexts convert only their own pixels otherwise"""
+        image = np.random.randint(0, 255, (40, 40, 3), dtype=np.uint8)
+        roi = FrameContext(image).roi((0, 0, 10, 10))
+
+        assert np.array_equal(roi.gray, cv2.cvtColor(image[:10, :10], cv2.COLOR_BGR2GRAY))
+
+    def test_working_image_shares_context_when_not_rescaled(self):
+        """Test detection and sampling share one context at full resolution"""
+        work = WorkingImage(np.zeros((100, 100, 3), dtype=np.uint8), 200)
+        assert work.full_context is work.context
+
+        work = WorkingImage(np.zeros((400, 400, 3), dtype=np.uint8), 200)
+        assert work.full_context is not work.context
+        assert as_frame_context(work.context) is work.context
+
+
+@pytest.fixture
+def textured_frame():
+    """600x800 frame with a textured 'strip' on a plain background"""
+    rng = np.random.RandomState(0)
+    frame = np.full((600, 800, 3), 90, dtype=np.uint8)
+    blocks = rng.randint(0, 255, (40, 12, 3)).astype(np.uint8)
+    frame[100:500, 300:420] = cv2.resize(blocks, (120, 400), interpolation=cv2.INTER_NEAREST)
+    return frame
+
+
+class TestRoiTracker:
+    """Test geometry reuse across consecutive frames"""
+
+    def test_unchanged_frame_hits(self, textured_frame):
+        """Test the same frame returns the stored geometry with no offset"""
+        tracker = RoiTracker()
+        tracker.store(textured_frame, (300, 100, 120, 400), {"box": 1})
+
+        assert tracker.lookup(textured_frame) == ({"box": 1}, (0, 0))
+        assert tracker.stats == {"hits": 1, "misses": 0}
+
+    def test_small_motion_is_tracked(self, textured_frame):
+        """Test a shifted strip reports the offset it moved by"""
+        tracker = RoiTracker()
+        tracker.store(textured_frame, (300, 100, 120, 400), "geometry")
+        moved = np.roll(textured_frame, (12, -9), axis=(0, 1))
+
+        geometry, offset = tracker.lookup(moved)
+        assert geometry == "geometry"
+        assert offset == (-9, 12)
+
+    def test_offsets_accumulate_from_detection(self, textured_frame):
+        """Test offsets stay relative to where the geometry was detected"""
+        tracker = RoiTracker()
+        tracker.store(textured_frame, (300, 100, 120, 400), "geometry")
+        tracker.lookup(np.roll(textured_frame, 8, axis=1))
+
+        _, offset = tracker.lookup(np.roll(textured_frame, 16, axis=1))
+        assert offset == (16, 0)
+
+    def test_large_motion_misses(self, textured_frame):
+        """Test motion beyond the search window falls back to detection"""
+        tracker = RoiTracker()
+        tracker.store(textured_frame, (300, 100, 120, 400), "geometry")
+
+        assert tracker.lookup(np.roll(textured_frame, 150, axis=0)) is None
+        assert tracker.misses == 1
+
+    def test_different_content_misses(self, textured_frame):
+        """Test a different strip in the same place is not matched"""
+        tracker = RoiTracker()
+        tracker.store(textured_frame, (300, 100, 120, 400), "geometry")
+        other = textured_frame.copy()
+        other[100:500, 300:420] = np.random.RandomState(1).randint(0, 255, (400, 120, 3))
+
+        assert tracker.lookup(other) is None
+
+    def test_frame_size_change_misses(self, textured_frame):
+        """Test a frame of another size is never matched"""
+        tracker = RoiTracker()
+        tracker.store(textured_frame, (300, 100, 120, 400), "geometry")
+
+        assert tracker.lookup(textured_frame[:500]) is None
+
+    def test_reset(self, textured_frame):
+        """Test reset forgets the geometry"""
+        tracker = RoiTracker()
+        tracker.store(textured_frame, (300, 100, 120, 400), "geometry")
+        tracker.reset()
+
+        assert tracker.lookup(textured_frame) is None
+
+
+class TestRenditions:
+    """Test multi-size result image encoding"""
+
+    @pytest.fixture
+    def result_image(self):
+        return np.random.RandomState(0).randint(0, 255, (800, 1200, 3), dtype=np.uint8)
+
+    def test_filenames(self):
+        """Test the full rendition keeps the legacy name and others add theirs"""
+        assert rendition_filename("abc_fob_result.jpg", Rendition("full")) == "abc_fob_result.jpg"
+        assert rendition_filename("abc_fob_result.jpg", Rendition("thumb", 320, "webp")) == \
+            "abc_fob_result.thumb.webp"
+
+    def test_thumbnail_is_downscaled(self, result_image):
+        """Test max_dim bounds the long side and keeps the aspect ratio"""
+        data = encode_rendition(result_image, Rendition("thumb", 300, "webp", 70))
+        decoded = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+        assert decoded.shape[:2] == (200, 300)
+        assert data[8:12] == b"WEBP"
+
+    def test_small_image_not_upscaled(self):
+        """Test images below max_dim keep their size"""
+        image = np.zeros((50, 80, 3), dtype=np.uint8)
+        data = encode_rendition(image, Rendition("thumb", 320, "jpeg", 70))
+
+        assert cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR).shape[:2] == (50, 80)
+
+    def test_save_renditions(self, result_image, tmp_path):
+        """Test every default rendition is written and the full one is primary"""
+        paths = save_renditions(result_image, str(tmp_path), "abc_ph_result.jpg")
+
+        assert set(paths) == {r.name for r in DEFAULT_RENDITIONS}
+        assert primary_rendition(paths) == str(tmp_path / "abc_ph_result.jpg")
+        assert cv2.imread(paths["full"]).shape[:2] == (800, 1200)
+        assert (tmp_path / "abc_ph_result.thumb.webp").stat().st_size < (tmp_path / "abc_ph_result.jpg").stat().st_size
+
+    def test_config_rejects_unknown_format(self):
+        """Test an unsupported encoder is reported at startup"""
+        with pytest.raises(ValueError):
+            renditions_from_config([{"name": "full", "format": "png"}])
+
+
+class TestBoxKernel:
+    """Test shared morphology kernels"""
+
+    def test_shared_and_read_only(self):
+        kernel = box_kernel(3)
+
+        assert kernel is box_kernel(3)
+        assert kernel.shape == (3, 3) and kernel.dtype == np.uint8
+        with pytest.raises(ValueError):
+            kernel[0, 0] = 0
+
+    def test_rectangular(self):
+        assert box_kernel(3, 20).shape == (3, 20)
@@ -0,0 +1,103 @@
+"""
+Test NumPy-aware JSON encoding and response compression
+"""
+import gzip
+import json
+import numpy as np
+import pytest
+from flask import jsonify
+from werkzeug.datastructures import Accept
+import json_responses
+from json_responses import dumps, compress_response
+
+
+@pytest.fixture(params=['orjson', 'stdlib'])
+def encoder(request, monkeypatch):
+    """Run a test with orjson (skipped when missing) and with the stdlib fallback"""
+    if request.param == 'orjson':
+        if json_responses.orjson is None:
+            pytest.skip("orjson not installed")
+    else:
+        monkeypatch.setattr(json_responses, 'orjson', None)
+    return request.param
+
+
+class TestNumpyEncoding:
+    """Test NumPy values serialize like their Python equivalents with either encoder"""
+
+    def test_scalars_and_arrays(self, encoder):
+        payload = {
+            'hsv': (np.int64(12), np.uint8(200), np.int32(7)),
+            'ph': np.float32(4.5),
+            'ok': np.bool_(True),
+            'matrix': np.arange(6, dtype=np.uint8).reshape(2, 3),
+        }
+
+        assert json.loads(dumps(payload)) == {
+            'hsv': [12, 200, 7], 'ph': 4.5, 'ok': True, 'matrix': [[0, 1, 2], [3, 4, 5]]
+        }
+
+    def test_non_finite_values_are_null(self, encoder):
+        payload = {'nan': float('nan'), 'inf': np.float32('inf'), 'ok': 1.5,
+                   'array': np.array([1.0, np.nan, -np.inf])}
+
+        encoded = dumps(payload)
+
+        assert 'NaN' not in encoded and 'Infinity' not in encoded
+        assert json.loads(encoded) == {'nan': None, 'inf': None, 'ok': 1.5, 'array': [1.0, None, None]}
+
+    def test_provider_matches_across_encoders(self, app, encoder):
+        payload = {'ph': np.float64(6.5), 'hsv': np.array([1, 2, 3], dtype=np.uint8), 'bad': np.nan}
+        with app.test_request_context():
+            response = jsonify(payload)
+
+        assert response.get_json() == {'ph': 6.5, 'hsv': [1, 2, 3], 'bad': None}
+
+    def test_jsonify_uses_provider(self, app):
+        with app.test_request_context():
+            response = jsonify({'test_patch_color_hsv': (np.int64(60), np.int64(100), np.int64(200))})
+
+        assert response.get_json() == {'test_patch_color_hsv': [60, 100, 200]}
+
+    def test_unsupported_type_still_raises(self, encoder):
+        with pytest.raises(TypeError):
+            dumps({'x': object()})
+
+
+class TestCompression:
+    """Test negotiated gzip of JSON responses"""
+
+    def _response(self, app, size):
+        with app.test_request_context():
+            return jsonify({'data': 'x' * size})
+
+    def test_large_json_is_gzipped(self, app):
+        response = compress_response(self._response(app, 5000), Accept([('gzip', 1)]))
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert json.loads(gzip.decompress(response.get_data())) == {'data': 'x' * 5000}
+
+    def test_small_json_is_not_compressed(self, app):
+        response = compress_response(self._response(app, 10), Accept([('gzip', 1)]))
+
+        assert 'Content-Encoding' not in response.headers
+
+    def test_not_compressed_without_accept_encoding(self, app):
+        response = compress_response(self._response(app, 5000), Accept([('identity', 1)]))
+
+        assert 'Content-Encoding' not in response.headers
+
+    def test_history_is_gzipped_end_to_end(self, client, auth_headers, app):
+        from models import db, User, Analysis
+        with app.app_context():
+            user = User.query.filter_by(email='test@example.com').first()
+            for i in range(40):
+                db.session.add(Analysis(user_id=user.id, test_type='fob', result=f'negative {i}', raw_data='{}'))
+            db.session.commit()
+
+        response = client.get('/history', headers=dict(auth_headers, **{'Accept-Encoding': 'gzip'}))
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert json.loads(gzip.decompress(response.data))['count'] == 40
+        assert response.headers['ETag'].startswith('W/')
@@ -0,0 +1,86 @@
+"""
+Test large uploads give the same readings as the original-size image
+"""
+import os
+import cv2
+import numpy as np
+import pytest
+from fob_analyzer import analyze_fob
+from imaging import FrameContext, load_image
+from urinalysis_strip_analyzer import WORKING_WIDTH, analyze_urinalysis, estimate_tilt
+
+SAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', 'static', 'sample-images')
+TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), '..', 'templates')
+LARGE_SIZE = (2304, 4032)  # width, height of a typical phone photo
+
+
+def sample(test_type, name):
+    path = os.path.join(SAMPLE_DIR, test_type, name)
+    if not os.path.exists(path):
+        pytest.skip("Sample image not available")
+    return path
+
+
+def upscale(path, tmp_path, size=LARGE_SIZE):
+    """Write ``path`` upscaled to ``size`` as a high-quality JPEG"""
+    large = cv2.resize(cv2.imread(path), size, interpolation=cv2.INTER_CUBIC)
+    large_path = str(tmp_path / f"large-{os.path.basename(path)}")
+    cv2.imwrite(large_path, large, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return large_path
+
+
+def pad(path, tmp_path, border=800):
+    """Write ``path`` with a replicated border, keeping the strip at its pixel size"""
+    large = cv2.copyMakeBorder(cv2.imread(path), border, border, border // 2, border // 2,
+                               cv2.BORDER_REPLICATE)
+    large_path = str(tmp_path / f"padded-{os.path.basename(path)}")
+    cv2.imwrite(large_path, large, [cv2.IMWRITE_JPEG_QUALITY, 95])
+    return large_path
+
+
+class TestFobLargeUpload:
+    """Test FOB reads large JPEGs exactly like their full decode"""
+
+    @pytest.mark.parametrize('name', ['real test.jpeg', 'real test positive.jpeg'])
+    def test_matches_full_decode(self, name, tmp_path):
+        path = sample('fob', name)
+        large_path = pad(path, tmp_path)  # 3200 px long side, eligible for a 1/2 decode
+
+        from_file = analyze_fob(large_path, templates_dir=TEMPLATES_DIR, result_folder=None)
+        full_decode = analyze_fob(cv2.imread(large_path), templates_dir=TEMPLATES_DIR, result_folder=None)
+        original = analyze_fob(path, templates_dir=TEMPLATES_DIR, result_folder=None)
+
+        assert from_file['status'] == 'ok'
+        assert from_file['result'] == full_decode['result'] == original['result']
+        assert from_file['lines'] == full_decode['lines']
+
+
+class TestUrinalysisLargeUpload:
+    """Test tilt and pad readings survive reduced decoding"""
+
+    @pytest.mark.parametrize('name', ['uri-test-1.jpeg', 'uri-test-3.jpeg', 'uri-test-4.jpg'])
+    def test_tilt_matches_original(self, name, tmp_path):
+        path = sample('urinalysis', name)
+        large, _ = load_image(upscale(path, tmp_path), min_width=WORKING_WIDTH)
+
+        original_tilt = estimate_tilt(FrameContext(cv2.imread(path)))
+        large_tilt = estimate_tilt(FrameContext(large))
+        assert abs(large_tilt) < 45
+        assert large_tilt == pytest.approx(original_tilt, abs=1.0)
+
+    def test_upright_outline_is_not_turned_sideways(self):
+        frame = np.full((400, 200, 3), 255, dtype=np.uint8)
+        cv2.rectangle(frame, (50, 20), (150, 380), (0, 0, 0), 3)
+
+        assert estimate_tilt(FrameContext(frame)) == pytest.approx(0.0, abs=1.0)
+
+    @pytest.mark.parametrize('name', ['uri-test-1.jpeg', 'uri-test-3.jpeg'])
+    def test_pad_results_match_original(self, name, tmp_path):
+        path = sample('urinalysis', name)
+
+        original = analyze_urinalysis(path, result_folder=None)
+        large = analyze_urinalysis(upscale(path, tmp_path), result_folder=None)
+
+        assert large['success'] and original['success']
+        assert ({code: pad['result'] for code, pad in large['results'].items()}
+                == {code: pad['result'] for code, pad in original['results'].items()})
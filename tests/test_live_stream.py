@@ -0,0 +1,254 @@
+"""
+Test live camera frame streaming
+"""
+import threading
+import cv2
+import numpy as np
+import pytest
+from live_stream import LiveStream, StreamRegistry, TooManyStreams, precheck_frame, decode_frame
+
+
+def _scene(seed):
+    """Sharp, mid-brightness 320x240 frame made of random 16px blocks"""
+    rng = np.random.RandomState(seed)
+    blocks = rng.randint(40, 215, (15, 20, 3)).astype(np.uint8)
+    return cv2.resize(blocks, (320, 240), interpolation=cv2.INTER_NEAREST)
+
+
+class BlockingAnalyzer:
+    """Fake analyzer that blocks until released, recording each frame it sees"""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.frames = []
+
+    def __call__(self, frame):
+        self.frames.append(frame)
+        self.started.set()
+        self.release.wait(5)
+        return "positive"
+
+
+class TestPrecheck:
+    """Test the cheap pre-analysis checks"""
+
+    def test_blank_frame_has_no_strip(self):
+        """Test a featureless frame is rejected as 'no strip'"""
+        assert precheck_frame(np.full((240, 320), 128, np.uint8), 0.0) == "no_strip"
+
+    def test_dark_frame(self):
+        """Test a dark frame is rejected before edge detection"""
+        assert precheck_frame(np.full((240, 320), 5, np.uint8), 0.0) == "too_dark"
+
+    def test_moving_frame(self):
+        """Test a frame that differs from the last one asks to hold still"""
+        gray = cv2.cvtColor(_scene(1), cv2.COLOR_BGR2GRAY)
+        assert precheck_frame(gray, 50.0) == "hold_still"
+
+    def test_good_frame_passes(self):
+        """Test a sharp, still frame goes on to analysis"""
+        gray = cv2.cvtColor(_scene(1), cv2.COLOR_BGR2GRAY)
+        assert precheck_frame(gray, 0.0) is None
+
+
+class TestLiveStream:
+    """Test latest-frame-wins scheduling"""
+
+    def test_stale_frames_are_dropped(self):
+        """Test only the newest frame is analyzed while the worker is busy"""
+        analyzer = BlockingAnalyzer()
+        stream = LiveStream("fob", analyze_frame=analyzer)
+        try:
+            # Two identical frames: the first is 'hold still', the second is analyzed
+            stream.submit(_scene(1))
+            stream.results_after(0, timeout=2)
+            stream.submit(_scene(1))
+            assert analyzer.started.wait(2)
+
+            # Worker is busy: these replace each other in the single pending slot
+            stream.submit(_scene(2))
+            stream.submit(_scene(3))
+            last = stream.submit(_scene(3))
+            analyzer.release.set()
+
+            results = stream.results_after(last - 1, timeout=2)
+            assert [r["seq"] for r in results] == [last]
+            assert stream.stats["dropped"] == 2
+            assert len(analyzer.frames) == 1
+        finally:
+            analyzer.release.set()
+            stream.close()
+
+    def test_unchanged_scene_reuses_result(self):
+        """Test a still scene is analyzed once and then answered from cache"""
+        calls = []
+        stream = LiveStream("fob", analyze_frame=lambda f: calls.append(1) or "negative")
+        try:
+            for _ in range(4):
+                seq = stream.submit(_scene(1))
+                stream.results_after(seq - 1, timeout=2)
+
+            assert stream.latest_result()["result"] == "negative"
+            assert stream.latest_result().get("reused")
+            assert len(calls) == 1
+        finally:
+            stream.close()
+
+    def test_submit_after_close(self):
+        """Test a closed stream rejects frames"""
+        stream = LiveStream("fob", analyze_frame=lambda f: "negative")
+        stream.close()
+        with pytest.raises(RuntimeError):
+            stream.submit(_scene(1))
+
+    def test_unsupported_test_type(self):
+        """Test unknown test types are rejected"""
+        with pytest.raises(ValueError):
+            LiveStream("glucose")
+
+
+class TestStreamRegistry:
+    """Test stream bookkeeping"""
+
+    def test_capacity(self):
+        """Test opening beyond capacity fails fast"""
+        registry = StreamRegistry(max_streams=1)
+        stream = registry.open("fob", analyze_frame=lambda f: None)
+        try:
+            with pytest.raises(RuntimeError):
+                registry.open("fob", analyze_frame=lambda f: None)
+        finally:
+            registry.close(stream.stream_id)
+
+    def test_streams_per_client(self):
+        """Test one client cannot hold every stream"""
+        registry = StreamRegistry(max_per_client=1)
+        mine = registry.open("fob", analyze_frame=lambda f: None, client="1.2.3.4")
+        theirs = registry.open("fob", analyze_frame=lambda f: None, client="5.6.7.8")
+        try:
+            with pytest.raises(TooManyStreams):
+                registry.open("fob", analyze_frame=lambda f: None, client="1.2.3.4")
+
+            registry.close(mine.stream_id)
+            mine = registry.open("fob", analyze_frame=lambda f: None, client="1.2.3.4")
+        finally:
+            registry.close(mine.stream_id)
+            registry.close(theirs.stream_id)
+
+    def test_streams_are_bound_to_their_owner(self):
+        """Test another user cannot read or close a stream"""
+        registry = StreamRegistry()
+        stream = registry.open("fob", analyze_frame=lambda f: None, owner=1)
+        try:
+            assert registry.get(stream.stream_id, 1) is stream
+            assert registry.get(stream.stream_id, 2) is None
+            assert registry.get(stream.stream_id) is None
+            assert not registry.close(stream.stream_id, 2)
+            assert not stream.closed
+        finally:
+            registry.close(stream.stream_id, 1)
+
+    def test_analysis_slots_are_shared(self):
+        """Test streams beyond the slot count wait for a running analysis"""
+        registry = StreamRegistry(analysis_slots=1)
+        first, second = BlockingAnalyzer(), BlockingAnalyzer()
+        streams = [registry.open("fob", analyze_frame=first), registry.open("fob", analyze_frame=second)]
+        try:
+            for stream in streams:
+                # The first frame of a stream is 'hold still', the second is analyzed
+                stream.submit(_scene(1))
+                stream.results_after(0, timeout=2)
+                stream.submit(_scene(1))
+            assert first.started.wait(2)
+            assert not second.started.wait(0.2)
+
+            first.release.set()
+            assert second.started.wait(2)
+        finally:
+            first.release.set()
+            second.release.set()
+            for stream in streams:
+                registry.close(stream.stream_id)
+
+    def test_idle_streams_are_evicted(self):
+        """Test streams without recent frames are closed"""
+        registry = StreamRegistry(idle_timeout=0)
+        stream = registry.open("fob", analyze_frame=lambda f: None)
+
+        assert registry.get(stream.stream_id) is None
+        assert stream.closed
+
+
+class TestStreamRoutes:
+    """Test the HTTP stream endpoints"""
+
+    def test_stream_lifecycle(self, client):
+        """Test open, submit, poll and close"""
+        response = client.post('/stream', json={'test_type': 'fob'})
+        assert response.status_code == 201
+        stream_id = response.get_json()['stream_id']
+
+        encoded = cv2.imencode('.png', np.full((240, 320, 3), 128, np.uint8))[1].tobytes()
+        response = client.post(f'/stream/{stream_id}/frame', data=encoded,
+                               content_type='application/octet-stream')
+        assert response.status_code == 202
+        seq = response.get_json()['seq']
+
+        response = client.get(f'/stream/{stream_id}?after={seq - 1}&wait=2')
+        assert response.get_json()['results'][0]['status'] == 'no_strip'
+
+        assert client.delete(f'/stream/{stream_id}').status_code == 200
+        assert client.get(f'/stream/{stream_id}').status_code == 404
+
+    def test_frame_post_waits_for_its_result(self, client):
+        """Test ?wait= returns the submitted frame's own result"""
+        stream_id = client.post('/stream', json={'test_type': 'fob'}).get_json()['stream_id']
+        encoded = cv2.imencode('.png', np.full((240, 320, 3), 128, np.uint8))[1].tobytes()
+
+        response = client.post(f'/stream/{stream_id}/frame?wait=2', data=encoded,
+                               content_type='application/octet-stream')
+
+        assert response.status_code == 200
+        body = response.get_json()
+        assert body['latest']['seq'] == body['seq']
+        assert body['latest']['status'] == 'no_strip'
+        client.delete(f'/stream/{stream_id}')
+
+    def test_stream_is_scoped_to_its_owner(self, client, auth_headers):
+        """Test an anonymous client cannot use a signed-in user's stream"""
+        stream_id = client.post('/stream', json={'test_type': 'fob'}, headers=auth_headers).get_json()['stream_id']
+        encoded = cv2.imencode('.png', np.full((240, 320, 3), 128, np.uint8))[1].tobytes()
+
+        assert client.post(f'/stream/{stream_id}/frame', data=encoded,
+                           content_type='application/octet-stream').status_code == 404
+        assert client.get(f'/stream/{stream_id}').status_code == 404
+        assert client.delete(f'/stream/{stream_id}').status_code == 404
+        assert client.get(f'/stream/{stream_id}', headers=auth_headers).status_code == 200
+        assert client.delete(f'/stream/{stream_id}', headers=auth_headers).status_code == 200
+
+    def test_streams_per_client_limit(self, client):
+        """Test an anonymous IP gets 429 past LIVE_STREAM_MAX_PER_CLIENT open streams"""
+        ids = [client.post('/stream', json={'test_type': 'ph'}).get_json()['stream_id'] for _ in range(2)]
+        try:
+            assert client.post('/stream', json={'test_type': 'ph'}).status_code == 429
+        finally:
+            for stream_id in ids:
+                client.delete(f'/stream/{stream_id}')
+
+    def test_invalid_frame(self, client):
+        """Test undecodable frames are rejected"""
+        stream_id = client.post('/stream', json={'test_type': 'ph'}).get_json()['stream_id']
+        response = client.post(f'/stream/{stream_id}/frame', data=b'not an image',
+                               content_type='application/octet-stream')
+        assert response.status_code == 400
+        client.delete(f'/stream/{stream_id}')
+
+    def test_invalid_test_type(self, client):
+        """Test opening a stream requires a known test type"""
+        assert client.post('/stream', json={'test_type': 'glucose'}).status_code == 400
+
+
+def test_decode_frame_empty():
+    """Test empty payloads decode to None"""
+    assert decode_frame(b'') is None
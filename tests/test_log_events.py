@@ -0,0 +1,111 @@
+"""
+Test structured, lazy and sampled event logging
+"""
+import json
+import logging
+import numpy as np
+import pytest
+import log_events
+from log_events import (EventMessage, StructuredFormatter, configure_sampling, log_event, summarize,
+                        MAX_FIELD_CHARS, MAX_ITEMS)
+
+
+@pytest.fixture(autouse=True)
+def reset_sampling():
+    yield
+    configure_sampling({})
+
+
+@pytest.fixture
+def event_logger():
+    logger = logging.getLogger("test_log_events")
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+class TestSummarize:
+    """Test field summaries stay small"""
+
+    def test_arrays_are_never_stringified(self):
+        image = np.zeros((1200, 1600, 3), dtype=np.uint8)
+
+        assert summarize(image) == "<ndarray shape=(1200, 1600, 3) dtype=uint8>"
+        assert summarize({"annotated_image": image})["annotated_image"].startswith("<ndarray")
+
+    def test_numpy_scalars(self):
+        assert summarize(np.float64(4.5)) == 4.5
+
+    def test_long_string_is_capped(self):
+        summary = summarize("x" * 1000)
+
+        assert summary.startswith("x" * MAX_FIELD_CHARS)
+        assert summary.endswith("<1000 chars>")
+
+    def test_containers_are_capped(self):
+        summary = summarize(list(range(100)))
+
+        assert len(summary) == MAX_ITEMS + 1
+        assert summary[-1] == f"...{100 - MAX_ITEMS} more"
+
+    def test_depth_is_capped(self):
+        assert summarize({"a": {"b": {"c": {"d": 1}}}}) == {"a": {"b": {"c": "<dict len=1>"}}}
+
+
+class TestLogEvent:
+    """Test laziness and sampling"""
+
+    def test_message_format(self, event_logger, caplog):
+        with caplog.at_level(logging.INFO, logger="test_log_events"):
+            log_event(event_logger, "analysis.result", test_type="ph", ph=np.float64(4.2))
+
+        assert caplog.records[0].getMessage() == "analysis.result test_type=ph ph=4.2"
+
+    def test_message_is_lazy(self, event_logger, monkeypatch):
+        """Test nothing is summarized when the level is disabled"""
+        calls = []
+        monkeypatch.setattr(log_events, "summarize", lambda value, depth=0: calls.append(value))
+        event_logger.setLevel(logging.WARNING)
+
+        log_event(event_logger, "analysis.result", result={"big": "dict"})
+
+        assert calls == []
+
+    def test_sampling(self, event_logger, caplog):
+        configure_sampling({"analysis.result": 0.0, "other": 1.0})
+        with caplog.at_level(logging.INFO, logger="test_log_events"):
+            for _ in range(20):
+                log_event(event_logger, "analysis.result", n=1)
+            log_event(event_logger, "other", n=1)
+            log_event(event_logger, "unlisted", n=1)
+
+        assert [r.msg.event for r in caplog.records] == ["other", "unlisted"]
+
+    def test_partial_sampling(self, event_logger, caplog, monkeypatch):
+        monkeypatch.setattr(log_events._random, "random", iter([0.05, 0.5, 0.09, 0.95]).__next__)
+        configure_sampling({"analysis.result": 0.1})
+        with caplog.at_level(logging.INFO, logger="test_log_events"):
+            for _ in range(4):
+                log_event(event_logger, "analysis.result")
+
+        assert len(caplog.records) == 2
+
+
+class TestStructuredFormatter:
+    """Test JSON log lines"""
+
+    def test_event_record(self):
+        record = logging.LogRecord("app", logging.INFO, __file__, 1,
+                                   EventMessage("analysis.result", {"image": np.zeros((4, 4)), "ph": 4.2}),
+                                   None, None)
+        entry = json.loads(StructuredFormatter().format(record))
+
+        assert entry["event"] == "analysis.result"
+        assert entry["ph"] == 4.2
+        assert entry["image"] == "<ndarray shape=(4, 4) dtype=float64>"
+
+    def test_plain_record(self):
+        record = logging.LogRecord("app", logging.WARNING, __file__, 1, "pad %s is dark", ("pad_1",), None)
+        entry = json.loads(StructuredFormatter().format(record))
+
+        assert entry["message"] == "pad pad_1 is dark"
+        assert entry["level"] == "WARNING"
@@ -0,0 +1,190 @@
+"""
+Test pH colour-card calibration sessions
+"""
+import io
+import os
+import cv2
+import numpy as np
+import pytest
+from ph_strip_analyzer import PHStripAnalyzer, PHCalibration, CalibrationSessions
+
+SAMPLE_IMAGE = os.path.join(os.path.dirname(__file__), '..', 'static', 'sample-images', 'ph', 'test3.jpeg')
+
+
+@pytest.fixture
+def calibration():
+    """Three-patch calibration with the test patch at (100, 100)"""
+    return PHCalibration(
+        reference_colors=[(10, 150, 150), (30, 150, 150), (60, 150, 150)],
+        labels=[4.5, 6.0, 8.0],
+        reference_bboxes=[(200, 90, 20, 20), (240, 90, 20, 20), (280, 90, 20, 20)],
+        test_patch_center=(100, 100)
+    )
+
+
+@pytest.fixture
+def sample_image():
+    image = cv2.imread(SAMPLE_IMAGE)
+    if image is None:
+        pytest.skip("Sample pH image not available")
+    return image
+
+
+class TestPHCalibration:
+    """Test the cached reference model"""
+
+    def test_predict_matches_reference(self, calibration):
+        """Test a reference colour predicts its own label"""
+        ph, distance = calibration.predict((30, 150, 150))
+
+        assert ph == pytest.approx(6.0)
+        assert distance == 0.0
+
+    def test_reference_bboxes_follow_test_patch(self, calibration):
+        """Test reference boxes move with the test patch"""
+        assert calibration.reference_bboxes((110, 95))[0] == (210, 85, 20, 20)
+
+    def test_reference_bboxes_scale_with_test_patch(self, calibration):
+        """Test offsets are kept in test-patch units, not pixels"""
+        scaled = PHCalibration([(10, 150, 150)], [4.5], [(200, 90, 20, 20)], (100, 100), test_patch_size=20)
+
+        assert scaled.reference_bboxes((50, 50), 10) == [(100, 45, 10, 10)]
+
+    def test_drift_is_zero_for_same_colors(self, calibration):
+        """Test identical references do not drift"""
+        assert calibration.drift([(10, 150, 150), (30, 150, 150), (60, 150, 150)]) == 0.0
+
+    def test_drift_treats_hue_as_circular(self, calibration):
+        """Test hue 179 is close to hue 0"""
+        wrapped = PHCalibration([(0, 100, 100)], [7.0], [(0, 0, 5, 5)], (0, 0))
+
+        assert wrapped.drift([(179, 100, 100)]) == pytest.approx(1.0)
+
+    def test_drift_with_missing_patches(self, calibration):
+        """Test a different patch count counts as drift"""
+        assert calibration.drift([(10, 150, 150)]) == float('inf')
+
+
+class TestCalibrationSessions:
+    """Test the session store"""
+
+    def test_create_and_get(self, calibration):
+        sessions = CalibrationSessions()
+        session_id = sessions.create(calibration, owner=1)
+
+        assert sessions.get(session_id, owner=1) is calibration
+
+    def test_other_owner_is_rejected(self, calibration):
+        """Test sessions are bound to the user who created them"""
+        sessions = CalibrationSessions()
+        session_id = sessions.create(calibration, owner=1)
+
+        assert sessions.get(session_id, owner=2) is None
+        assert sessions.get(session_id) is None
+
+    def test_expired_sessions(self, calibration):
+        sessions = CalibrationSessions(ttl=0)
+        session_id = sessions.create(calibration)
+
+        assert sessions.get(session_id) is None
+        assert len(sessions) == 0
+
+    def test_capacity_drops_oldest(self, calibration):
+        sessions = CalibrationSessions(max_sessions=1)
+        first = sessions.create(calibration)
+        second = sessions.create(calibration)
+
+        assert sessions.get(first) is None
+        assert sessions.get(second) is calibration
+
+    def test_invalidate(self, calibration):
+        sessions = CalibrationSessions()
+        session_id = sessions.create(calibration)
+
+        assert sessions.invalidate(session_id)
+        assert sessions.get(session_id) is None
+
+
+class TestCalibratedAnalysis:
+    """Test analyzing strips against a cached calibration"""
+
+    def test_reuse_gives_same_result(self, sample_image):
+        """Test a calibrated analysis matches a full one"""
+        analyzer = PHStripAnalyzer()
+        full = analyzer.analyze_ph_strip(sample_image)
+        calibration = analyzer.calibration
+
+        shifted = np.roll(sample_image, (8, 12), axis=(0, 1))
+        result = PHStripAnalyzer().analyze_ph_strip(shifted, calibration=calibration)
+
+        assert result["success"]
+        assert result["calibrated"]
+        assert not result["calibration_drift"]
+        assert result["estimated_ph"] == full["estimated_ph"]
+
+    @pytest.mark.parametrize('scale', [0.5, 0.75])
+    def test_reuse_on_smaller_image(self, sample_image, scale):
+        """Test a calibration from one resolution samples the same patches on a downscaled copy"""
+        analyzer = PHStripAnalyzer()
+        full = analyzer.analyze_ph_strip(sample_image)
+
+        small = cv2.resize(sample_image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        result = PHStripAnalyzer().analyze_ph_strip(small, calibration=analyzer.calibration)
+
+        assert result["success"]
+        assert result["calibrated"]
+        assert not result["calibration_drift"]
+        assert result["estimated_ph"] == full["estimated_ph"]
+
+    def test_lighting_change_is_detected(self, sample_image):
+        """Test darker lighting invalidates the calibration and falls back to full analysis"""
+        analyzer = PHStripAnalyzer()
+        analyzer.analyze_ph_strip(sample_image)
+
+        darker = (sample_image * 0.6).astype(np.uint8)
+        result = PHStripAnalyzer().analyze_ph_strip(darker, calibration=analyzer.calibration)
+
+        assert result["success"]
+        assert result["calibration_drift"]
+        assert not result["calibrated"]
+
+
+    def test_result_carries_no_image(self, sample_image, tmp_path):
+        """Test the annotated frame is saved, not returned in the result"""
+        result = PHStripAnalyzer().analyze_ph_strip(sample_image, result_folder=str(tmp_path), analysis_id='abc')
+
+        assert result["success"]
+        assert not any(isinstance(v, np.ndarray) for v in result.values())
+        assert os.path.exists(result["result_images"][0])
+
+
+class TestCalibrationRoutes:
+    """Test the calibration endpoints"""
+
+    @pytest.fixture(autouse=True)
+    def result_folder(self, monkeypatch, tmp_path):
+        monkeypatch.setattr('app.RESULT_IMAGES_FOLDER', str(tmp_path))
+
+    def _upload(self, image):
+        return (io.BytesIO(cv2.imencode('.jpg', image)[1].tobytes()), 'strip.jpg')
+
+    def test_calibrate_then_analyze(self, client, sample_image):
+        response = client.post('/ph/calibrations', data={'image': self._upload(sample_image)},
+                               content_type='multipart/form-data')
+        assert response.status_code == 201
+        calibration_id = response.get_json()['calibration_id']
+
+        response = client.post('/analyze', data={'image': self._upload(sample_image), 'test_type': 'ph',
+                                                 'calibration_id': calibration_id},
+                               content_type='multipart/form-data')
+        assert response.status_code == 200
+        assert response.get_json()['calibration']['status'] == 'used'
+
+        assert client.delete(f'/ph/calibrations/{calibration_id}').status_code == 200
+        assert client.get(f'/ph/calibrations/{calibration_id}').status_code == 404
+
+    def test_unknown_session(self, client, sample_image):
+        response = client.post('/analyze', data={'image': self._upload(sample_image), 'test_type': 'ph',
+                                                 'calibration_id': 'missing'},
+                               content_type='multipart/form-data')
+        assert response.status_code == 404
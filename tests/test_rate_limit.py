@@ -0,0 +1,209 @@
+"""
+Test the in-process token-bucket rate limiter
+"""
+import pytest
+from rate_limit import RateLimiter, TokenBucketLimiter, create_rate_limiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+class TestTokenBucket:
+    """Test refill, burst and eviction"""
+
+    def test_burst_then_limited(self, clock):
+        limiter = TokenBucketLimiter(per_minute=60, burst=3, clock=clock)
+
+        assert [limiter.consume("a") for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert limiter.consume("a") == pytest.approx(1.0)
+        assert limiter.stats["limited"] == 1
+
+    def test_refills_over_time(self, clock):
+        limiter = TokenBucketLimiter(per_minute=60, burst=2, clock=clock)
+        limiter.consume("a", 2)
+
+        clock.now = 1.0
+        assert limiter.consume("a") == 0.0
+        assert limiter.consume("a") > 0
+
+    def test_refused_request_takes_nothing(self, clock):
+        limiter = TokenBucketLimiter(per_minute=60, burst=5, clock=clock)
+        limiter.consume("a", 4)
+
+        assert limiter.consume("a", 3) == pytest.approx(2.0)
+        assert limiter.consume("a", 1) == 0.0
+
+    def test_cost_above_burst_is_capped(self, clock):
+        limiter = TokenBucketLimiter(per_minute=60, burst=2, clock=clock)
+
+        assert limiter.consume("a", 10) == 0.0
+        assert limiter.consume("a", 10) == pytest.approx(2.0)
+
+    def test_keys_are_independent(self, clock):
+        limiter = TokenBucketLimiter(per_minute=60, burst=1, clock=clock)
+        limiter.consume("a")
+
+        assert limiter.consume("b") == 0.0
+
+    def test_idle_buckets_are_evicted(self, clock):
+        limiter = TokenBucketLimiter(per_minute=60, burst=2, clock=clock)
+        limiter.consume("a")
+        limiter.consume("b")
+
+        clock.now = 1.0
+        limiter.consume("b")
+        clock.now = 2.5  # "a" is full again, "b" is not
+        limiter.consume("c")
+
+        assert len(limiter) == 2
+        assert limiter.stats["evicted"] == 1
+
+    def test_least_recently_used_goes_when_full(self, clock):
+        limiter = TokenBucketLimiter(per_minute=60, burst=1, max_buckets=2, clock=clock)
+        limiter.consume("a")
+        limiter.consume("b")
+        limiter.consume("a")  # refused, but touches "a"
+        limiter.consume("c")
+
+        assert len(limiter) == 2
+        assert limiter.consume("a") > 0  # still tracked and empty
+        assert limiter.consume("b") == 0.0  # forgotten, starts full
+
+
+class TestRateLimiter:
+    """Test costs and user / IP buckets"""
+
+    @pytest.fixture
+    def limiter(self, clock):
+        return RateLimiter(
+            ip_limiter=TokenBucketLimiter(60, 5, clock=clock),
+            user_limiter=TokenBucketLimiter(60, 10, clock=clock),
+            costs={"analyze": {"fob": 5, "default": 1}, "analyze_video_upload": 8}
+        )
+
+    def test_costs(self, limiter):
+        assert limiter.cost("analyze", "fob") == 5
+        assert limiter.cost("analyze", "ph") == 1
+        assert limiter.cost("analyze_video_upload", "fob") == 8
+        assert limiter.cost("open_stream") == 1
+
+    def test_fob_uses_more_quota_than_ph(self, limiter):
+        assert limiter.check(None, "1.2.3.4", "analyze", "fob") == 0.0
+        assert limiter.check(None, "1.2.3.4", "analyze", "fob") > 0
+        assert limiter.check(None, "5.6.7.8", "analyze", "ph") == 0.0
+
+    def test_users_have_their_own_buckets(self, limiter):
+        limiter.check(None, "1.2.3.4", "analyze", "fob")
+
+        # Same IP, signed in: charged to the user
+        assert limiter.check(7, "1.2.3.4", "analyze", "fob") == 0.0
+        assert limiter.check(7, "1.2.3.4", "analyze", "fob") == 0.0
+        assert limiter.check(7, "1.2.3.4", "analyze", "fob") > 0
+
+    def test_snapshot(self, limiter):
+        limiter.check(None, "1.2.3.4", "analyze", "ph")
+
+        snapshot = limiter.snapshot()
+        assert snapshot["ip"]["allowed"] == 1 and snapshot["ip"]["buckets"] == 1
+        assert snapshot["user"]["buckets"] == 0
+
+    def test_from_config(self):
+        limiter = create_rate_limiter({"RATE_LIMIT_PER_MINUTE": 30, "RATE_LIMIT_BURST": 4,
+                                       "RATE_LIMIT_COSTS": {"analyze": 2}})
+
+        assert limiter.ip_limiter.burst == 4
+        assert limiter.ip_limiter.rate == 0.5
+        assert limiter.cost("analyze", "fob") == 2
+
+
+class TestRateLimitedRoutes:
+    """Test the analysis endpoints answer 429 once a bucket is empty"""
+
+    @pytest.fixture(autouse=True)
+    def enabled(self, app, monkeypatch):
+        monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', True)
+        monkeypatch.setattr('app.rate_limiter', create_rate_limiter({
+            "RATE_LIMIT_PER_MINUTE": 6, "RATE_LIMIT_BURST": 5,
+            "RATE_LIMIT_USER_PER_MINUTE": 6, "RATE_LIMIT_USER_BURST": 10,
+            "RATE_LIMIT_COSTS": app.config['RATE_LIMIT_COSTS'],
+        }))
+
+    def _post(self, client, test_type, **kwargs):
+        # No image: the request is charged, then rejected with 400
+        return client.post('/analyze', data={'test_type': test_type},
+                           content_type='multipart/form-data', **kwargs)
+
+    def test_fob_is_limited_with_retry_after(self, client):
+        assert self._post(client, 'fob').status_code == 400
+
+        response = self._post(client, 'fob')
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '50'
+        assert 'error' in response.get_json()
+
+    def test_ph_requests_fit_the_same_bucket_five_times(self, client):
+        statuses = [self._post(client, 'ph').status_code for _ in range(6)]
+
+        assert statuses == [400] * 5 + [429]
+
+    def test_authenticated_user_has_own_quota(self, client, auth_headers):
+        self._post(client, 'fob')
+
+        assert self._post(client, 'fob', headers=auth_headers).status_code == 400
+        assert self._post(client, 'fob', headers=auth_headers).status_code == 400
+        assert self._post(client, 'fob', headers=auth_headers).status_code == 429
+
+    def test_forwarded_for_is_used_behind_trusted_proxy(self, app, client, monkeypatch):
+        monkeypatch.setitem(app.config, 'RATE_LIMIT_TRUSTED_PROXIES', 1)
+        self._post(client, 'fob', headers={'X-Forwarded-For': '10.0.0.1'})
+
+        assert self._post(client, 'fob', headers={'X-Forwarded-For': '10.0.0.2'}).status_code == 400
+        assert self._post(client, 'fob', headers={'X-Forwarded-For': '10.0.0.2'}).status_code == 429
+
+    def test_production_trusts_one_proxy(self):
+        from config import ProductionConfig
+
+        assert ProductionConfig.RATE_LIMIT_TRUSTED_PROXIES == 1
+
+    def test_clients_behind_one_proxy_get_separate_buckets(self, app, client, monkeypatch):
+        monkeypatch.setitem(app.config, 'RATE_LIMIT_TRUSTED_PROXIES', 1)
+        proxy = {'REMOTE_ADDR': '10.1.0.1'}
+
+        # The client sends a spoofed entry; the proxy appends the real address
+        first = {'X-Forwarded-For': '1.1.1.1, 203.0.113.5'}
+        second = {'X-Forwarded-For': '1.1.1.1, 203.0.113.6'}
+        assert self._post(client, 'fob', headers=first, environ_base=proxy).status_code == 400
+        assert self._post(client, 'fob', headers=first, environ_base=proxy).status_code == 429
+        assert self._post(client, 'fob', headers=second, environ_base=proxy).status_code == 400
+
+    def test_flooding_stream_frames_is_limited(self, client):
+        stream_id = client.post('/stream', json={'test_type': 'ph'}).get_json()['stream_id']
+        try:
+            # 3 tokens left after opening the stream, at 0.25 per frame
+            statuses = [client.post(f'/stream/{stream_id}/frame', data=b'not an image',
+                                    content_type='application/octet-stream').status_code
+                        for _ in range(13)]
+        finally:
+            client.delete(f'/stream/{stream_id}')
+
+        assert statuses == [400] * 12 + [429]
+
+    def test_disabled(self, app, client, monkeypatch):
+        monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', False)
+
+        assert [self._post(client, 'fob').status_code for _ in range(3)] == [400] * 3
+
+    def test_health_reports_buckets(self, client):
+        self._post(client, 'ph')
+
+        assert client.get('/health').get_json()['rate_limiter']['ip']['allowed'] == 1
@@ -0,0 +1,130 @@
+"""
+Test sparse response fieldsets and the compact profile
+"""
+import io
+import os
+import pytest
+from response_fields import parse_fields, requested_fields, select_fields, wants
+from urinalysis_strip_analyzer import UrinalysisAnalyzer
+
+SAMPLE_DIR = os.path.join(os.path.dirname(__file__), '..', 'static', 'sample-images')
+
+URINALYSIS_RESPONSE = {
+    "success": True,
+    "test_type": "urinalysis",
+    "analysis_id": "abc",
+    "results": {
+        "GLU": {"test_name": "Glucose", "result": "NEG", "confidence": 0.9, "explanation": "K=3 nearest: ..."},
+        "pH": {"test_name": "pH", "result": "6.0", "confidence": 0.8, "explanation": "K=3 nearest: ..."},
+    },
+    "pads_detected": 10,
+    "diagnosis": "All urinalysis parameters within normal ranges.",
+    "message": "Urinalysis strip analyzed successfully",
+}
+
+
+class TestFieldSets:
+    """Test parsing and selecting fields"""
+
+    def test_parse(self):
+        assert parse_fields("result, results.confidence,results.result,,") == \
+            {"result": None, "results": {"confidence", "result"}}
+
+    def test_whole_key_wins_over_nested(self):
+        assert parse_fields("results.result,results") == {"results": None}
+        assert parse_fields("results,results.result") == {"results": None}
+
+    def test_select_top_level(self):
+        selected = select_fields(URINALYSIS_RESPONSE, parse_fields("success,diagnosis,missing"))
+
+        assert selected == {"success": True, "diagnosis": URINALYSIS_RESPONSE["diagnosis"]}
+
+    def test_select_inside_each_pad(self):
+        selected = select_fields(URINALYSIS_RESPONSE, parse_fields("results.result"))
+
+        assert selected == {"results": {"GLU": {"result": "NEG"}, "pH": {"result": "6.0"}}}
+
+    def test_no_fieldset_is_full_response(self):
+        assert requested_fields("fob") is None
+        assert requested_fields("fob", profile="full") is None
+        assert select_fields(URINALYSIS_RESPONSE, None) == URINALYSIS_RESPONSE
+
+    def test_compact_profile(self):
+        fields = requested_fields("urinalysis", profile="compact")
+        selected = select_fields(URINALYSIS_RESPONSE, fields)
+
+        assert "message" not in selected and "diagnosis" not in selected
+        assert selected["results"]["GLU"] == {"result": "NEG", "confidence": 0.9}
+        assert not wants(fields, "results", "explanation")
+
+    def test_fields_override_profile(self):
+        assert requested_fields("ph", fields="pH", profile="compact") == {"pH": None}
+
+    def test_invalid_requests(self):
+        with pytest.raises(ValueError):
+            requested_fields("ph", profile="tiny")
+        with pytest.raises(ValueError):
+            requested_fields("ph", fields=" , ")
+
+    def test_wants(self):
+        assert wants(None, "results", "explanation")
+        assert wants({"results": None}, "results", "explanation")
+        assert not wants({"results": {"result"}}, "results", "explanation")
+        assert not wants({"result": None}, "results")
+
+
+class TestLazyExplanations:
+    """Test urinalysis explanations are only built on request"""
+
+    def test_explain_off(self):
+        analyzer = UrinalysisAnalyzer()
+        result, confidence, explanation = analyzer.find_best_match_knn([30, 120, 200], "GLU", explain=False)
+
+        assert explanation is None
+        assert (result, confidence) == analyzer.find_best_match_knn([30, 120, 200], "GLU")[:2]
+
+    def test_blood_explanation(self):
+        result, _, explanation = UrinalysisAnalyzer().find_best_match_knn([30, 120, 200], "BLO")
+
+        assert result.endswith("(Hemo)")
+        assert explanation.startswith("Classified as Hemo")
+
+    def test_analyze_pads_without_explanations(self):
+        results = UrinalysisAnalyzer().analyze_pads({"pad_1": [30, 120, 200], "pad_2": [20, 80, 220]},
+                                                    explain=False)
+
+        assert results and all("explanation" not in pad for pad in results.values())
+
+
+class TestAnalyzeRoute:
+    """Test /analyze honours fields and profile"""
+
+    @pytest.fixture(autouse=True)
+    def result_folder(self, monkeypatch, tmp_path):
+        monkeypatch.setattr('app.RESULT_IMAGES_FOLDER', str(tmp_path))
+
+    def _post(self, client, test_type, sample, **params):
+        path = os.path.join(SAMPLE_DIR, test_type, sample)
+        if not os.path.exists(path):
+            pytest.skip("Sample image not available")
+        with open(path, 'rb') as f:
+            data = dict(params, image=(io.BytesIO(f.read()), sample), test_type=test_type)
+        return client.post('/analyze', data=data, content_type='multipart/form-data')
+
+    def test_compact_ph(self, client):
+        response = self._post(client, 'ph', 'test3.jpeg', profile='compact')
+
+        assert response.status_code == 200
+        body = response.get_json()
+        assert 'pH' in body and 'medical_status' in body
+        assert not {'estimated_ph', 'message', 'diagnosis', 'result'} & body.keys()
+
+    def test_fields(self, client):
+        response = self._post(client, 'ph', 'test3.jpeg', fields='pH,analysis_id')
+
+        assert set(response.get_json()) == {'pH', 'analysis_id'}
+
+    def test_unknown_profile(self, client):
+        response = self._post(client, 'ph', 'test3.jpeg', profile='tiny')
+
+        assert response.status_code == 400
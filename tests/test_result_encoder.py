@@ -0,0 +1,116 @@
+"""
+Test background result image encoding
+"""
+import os
+import threading
+import numpy as np
+import pytest
+import imaging
+from imaging import DEFAULT_RENDITIONS, save_renditions
+from result_encoder import ResultEncoder
+
+
+@pytest.fixture
+def encoder():
+    encoder = ResultEncoder(workers=1, max_queue=4)
+    yield encoder
+    encoder.close()
+
+
+@pytest.fixture
+def result_image():
+    return np.random.RandomState(0).randint(0, 255, (400, 600, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def blocked_writes(monkeypatch):
+    """Hold every background write until the event is set"""
+    release = threading.Event()
+    write = imaging.write_rendition
+
+    def blocked(image, rendition, path):
+        if threading.current_thread().name.startswith("result-encoder"):
+            release.wait(5)
+        write(image, rendition, path)
+
+    monkeypatch.setattr('result_encoder.write_rendition', blocked)
+    yield release
+    release.set()
+
+
+class TestResultEncoder:
+    """Test the bounded encoding queue"""
+
+    def test_paths_returned_before_encode(self, encoder, result_image, tmp_path, blocked_writes):
+        paths = save_renditions(result_image, str(tmp_path), "abc_fob_result.jpg", encoder=encoder)
+
+        assert set(paths) == {r.name for r in DEFAULT_RENDITIONS}
+        assert not os.path.exists(paths["full"])
+        assert encoder.metrics()["in_flight"] == 1
+
+        blocked_writes.set()
+        encoder.flush()
+
+        assert all(os.path.exists(path) for path in paths.values())
+        metrics = encoder.metrics()
+        assert metrics["encoded"] == 1
+        assert metrics["in_flight"] == 0
+        assert metrics["queue_depth"] == 0
+        assert metrics["encode_ms_max"] > 0
+
+    def test_wait_for_in_flight_encode(self, encoder, result_image, tmp_path, blocked_writes):
+        paths = encoder.submit(result_image, str(tmp_path), "abc_ph_result.jpg")
+
+        assert not encoder.wait(paths["full"], timeout=0.05)
+        threading.Timer(0.05, blocked_writes.set).start()
+        assert encoder.wait(paths["full"], timeout=5)
+        assert os.path.exists(paths["full"])
+
+    def test_wait_for_unknown_path_returns_immediately(self, encoder, tmp_path):
+        assert encoder.wait(str(tmp_path / "missing.jpg"), timeout=5)
+
+    def test_full_queue_encodes_inline(self, result_image, tmp_path, blocked_writes):
+        encoder = ResultEncoder(workers=1, max_queue=1)
+        try:
+            # First job occupies the worker, second fills the queue
+            encoder.submit(result_image, str(tmp_path), "a.jpg")
+            for _ in range(100):
+                if encoder.metrics()["queue_depth"] == 0:
+                    break
+                threading.Event().wait(0.01)
+            encoder.submit(result_image, str(tmp_path), "b.jpg")
+            paths = encoder.submit(result_image, str(tmp_path), "c.jpg")
+
+            assert os.path.exists(paths["full"])
+            assert encoder.stats["inline"] == 1
+        finally:
+            blocked_writes.set()
+            encoder.close()
+
+    def test_close_drains_queue(self, result_image, tmp_path):
+        encoder = ResultEncoder(workers=2, max_queue=8)
+        names = [f"{i}.jpg" for i in range(5)]
+        paths = [encoder.submit(result_image, str(tmp_path), name) for name in names]
+        encoder.close()
+
+        assert all(os.path.exists(p) for rendition_paths in paths for p in rendition_paths.values())
+        # Closed encoders still write, on the calling thread
+        assert os.path.exists(encoder.submit(result_image, str(tmp_path), "late.jpg")["full"])
+
+
+def test_result_image_route_waits_for_encode(client, monkeypatch, tmp_path, result_image, blocked_writes):
+    """Test /result_images serves an image that was still encoding when requested"""
+    import app as app_module
+    encoder = ResultEncoder(workers=1, max_queue=4)
+    monkeypatch.setattr(app_module, 'result_encoder', encoder)
+    monkeypatch.setattr(app_module, 'RESULT_IMAGES_FOLDER', str(tmp_path))
+    try:
+        encoder.submit(result_image, str(tmp_path), "abc_fob_result.jpg")
+        threading.Timer(0.05, blocked_writes.set).start()
+
+        response = client.get('/result_images/abc_fob_result.jpg?size=thumb')
+        assert response.status_code == 200
+        assert response.mimetype == 'image/webp'
+        response.close()
+    finally:
+        encoder.close()
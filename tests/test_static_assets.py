@@ -0,0 +1,110 @@
+"""
+Test precompressed, fingerprinted static assets
+"""
+import gzip
+import os
+import pytest
+from static_assets import build_assets, load_assets, AssetManifest
+
+SCRIPT = b"function hello() { return 'hello world'; }\n" * 50
+
+
+@pytest.fixture
+def sources(tmp_path):
+    """A small frontend/ and static/ tree with a duplicated image"""
+    frontend = tmp_path / 'src' / 'frontend'
+    static = tmp_path / 'src' / 'static'
+    (frontend / 'img').mkdir(parents=True)
+    (static / 'img').mkdir(parents=True)
+    (frontend / 'app.js').write_bytes(SCRIPT)
+    (frontend / 'index.html').write_text(
+        '<script src="app.js?v=2"></script><link href="/static/style.css">'
+        '<script src="https://cdn.example.com/x.js"></script>')
+    (static / 'style.css').write_bytes(b'body { color: black; }\n' * 40)
+    for folder in (frontend, static):
+        (folder / 'img' / 'strip.jpg').write_bytes(b'\xff\xd8 same image bytes')
+    roots = {'static': ('static', None), 'frontend': ('frontend', ('.js', '.css', '.html', '.jpg'))}
+    return str(tmp_path / 'src'), roots, str(tmp_path / 'build')
+
+
+class TestBuild:
+    """Test the asset build"""
+
+    def test_fingerprinted_alias(self, sources):
+        base_dir, roots, build_dir = sources
+        assets = build_assets(build_dir, base_dir, roots)['assets']
+
+        aliases = [k for k, v in assets.items() if v['immutable'] and k.startswith('frontend/app.')]
+        assert len(aliases) == 1
+        assert assets[aliases[0]]['file'] == assets['frontend/app.js']['file']
+        assert not assets['frontend/app.js']['immutable']
+
+    def test_html_references_are_rewritten(self, sources):
+        base_dir, roots, build_dir = sources
+        assets = build_assets(build_dir, base_dir, roots)['assets']
+
+        with open(os.path.join(build_dir, assets['frontend/index.html']['file'])) as f:
+            html = f.read()
+        assert 'src="app.js' not in html
+        assert '?v=2' not in html
+        assert 'href="/static/style.' in html and 'href="/static/style.css"' not in html
+        assert 'src="https://cdn.example.com/x.js"' in html
+
+    def test_gzip_variant_and_dedup(self, sources):
+        base_dir, roots, build_dir = sources
+        assets = build_assets(build_dir, base_dir, roots)['assets']
+
+        entry = assets['frontend/app.js']
+        with open(os.path.join(build_dir, entry['encodings']['gzip']), 'rb') as f:
+            assert gzip.decompress(f.read()) == SCRIPT
+        assert assets['frontend/img/strip.jpg']['file'] == assets['static/img/strip.jpg']['file']
+        assert assets['static/img/strip.jpg']['encodings'] == {}
+
+    def test_stale_build_is_rebuilt(self, sources):
+        base_dir, roots, build_dir = sources
+        first = load_assets(build_dir, base_dir, roots)
+        os.utime(os.path.join(base_dir, 'frontend', 'app.js'), ns=(1, 1))
+        with open(os.path.join(base_dir, 'frontend', 'app.js'), 'ab') as f:
+            f.write(b'// changed\n')
+
+        second = load_assets(build_dir, base_dir, roots)
+
+        assert second.lookup('frontend', 'app.js')['file'] != first.lookup('frontend', 'app.js')['file']
+
+
+class TestServing:
+    """Test variant selection and cache headers"""
+
+    @pytest.fixture
+    def built(self, sources, monkeypatch):
+        import app as app_module
+        base_dir, roots, build_dir = sources
+        manifest = load_assets(build_dir, base_dir, roots)
+        monkeypatch.setattr(app_module, 'static_assets', manifest)
+        return manifest
+
+    def test_gzip_when_accepted(self, client, built):
+        response = client.get('/app.js', headers={'Accept-Encoding': 'gzip, deflate'})
+
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert gzip.decompress(response.data) == SCRIPT
+        assert 'no-cache' in response.headers['Cache-Control']
+
+    def test_identity_without_accept_encoding(self, client, built):
+        response = client.get('/app.js', headers={'Accept-Encoding': 'identity'})
+
+        assert 'Content-Encoding' not in response.headers
+        assert response.data == SCRIPT
+
+    def test_fingerprinted_name_is_immutable(self, client, built):
+        alias = next(k for k, v in built.assets.items() if v['immutable'] and k.startswith('frontend/app.'))
+
+        response = client.get('/' + alias.split('/', 1)[1], headers={'Accept-Encoding': 'gzip'})
+
+        assert response.status_code == 200
+        assert 'immutable' in response.headers['Cache-Control']
+        assert 'max-age=31536000' in response.headers['Cache-Control']
+
+    def test_unknown_file_falls_back_to_sources(self, client, built):
+        assert client.get('/static/favicon.ico').status_code == 200
@@ -0,0 +1,130 @@
+"""
+Test analysis summary tables and /stats
+"""
+import json
+from datetime import datetime, timedelta
+import pytest
+from models import db, User, Analysis, AnalysisSummary, AnalysisDailySummary, GLOBAL_SUMMARY_USER
+from analysis_stats import is_abnormal, record_analysis, rebuild_summaries, get_stats
+
+RESPONSES = [
+    ('fob', {'result': 'positive'}),
+    ('fob', {'result': 'negative'}),
+    ('ph', {'estimated_ph': 4.2}),
+    ('ph', {'estimated_ph': 6.1}),
+    ('urinalysis', {'results': {'GLU': {'result': 'NEG'}, 'NIT': {'result': 'POS'}}}),
+]
+
+
+def _add(user_id, test_type, response, created_at=None):
+    analysis = Analysis(user_id=user_id, test_type=test_type, result=response.get('result', ''),
+                        raw_data=json.dumps(response), created_at=created_at or datetime.utcnow())
+    db.session.add(analysis)
+    record_analysis(analysis, response)
+    db.session.commit()
+    return analysis
+
+
+def _summary_rows():
+    return (sorted((r.user_id, r.test_type, r.total, r.abnormal) for r in AnalysisSummary.query),
+            sorted((r.user_id, r.day, r.test_type, r.total, r.abnormal) for r in AnalysisDailySummary.query))
+
+
+@pytest.fixture
+def user_id(auth_headers):
+    return User.query.filter_by(email='test@example.com').first().id
+
+
+class TestIsAbnormal:
+    """Test abnormal-result classification"""
+
+    @pytest.mark.parametrize('test_type,response,expected', [
+        ('fob', {'result': 'positive'}, True),
+        ('fob', {'result': 'negative'}, False),
+        ('ph', {'estimated_ph': 4.0}, False),
+        ('ph', {'pH': 5.2}, True),
+        ('urinalysis', {'results': {'GLU': {'result': 'NEG'}}}, False),
+        ('urinalysis', {'results': {'BLO': 'Pos'}}, True),
+    ])
+    def test_classification(self, test_type, response, expected):
+        assert is_abnormal(test_type, response) is expected
+
+
+class TestSummaryTables:
+    """Test incremental maintenance and rebuild of the summary tables"""
+
+    def test_insert_updates_user_and_global_rows(self, app, user_id):
+        for test_type, response in RESPONSES:
+            _add(user_id, test_type, response)
+
+        stats = get_stats(user_id)
+        assert stats['total'] == 5
+        assert stats['abnormal'] == 3
+        assert stats['by_test_type']['ph'] == {'total': 2, 'abnormal': 1}
+        assert get_stats(GLOBAL_SUMMARY_USER)['total'] == 5
+
+    def test_rollback_discards_counters(self, app, user_id):
+        analysis = Analysis(user_id=user_id, test_type='fob', result='positive', raw_data='{}')
+        db.session.add(analysis)
+        record_analysis(analysis, {'result': 'positive'})
+        db.session.rollback()
+
+        assert AnalysisSummary.query.count() == 0
+        assert AnalysisDailySummary.query.count() == 0
+
+    def test_rebuild_matches_incremental(self, app, user_id):
+        base = datetime.utcnow() - timedelta(days=3)
+        for i, (test_type, response) in enumerate(RESPONSES * 2):
+            _add(user_id, test_type, response, created_at=base + timedelta(days=i % 3))
+        incremental = _summary_rows()
+
+        result = rebuild_summaries()
+
+        assert result['analyses'] == 10
+        assert _summary_rows() == incremental
+
+    def test_daily_window(self, app, user_id):
+        today = datetime.utcnow()
+        _add(user_id, 'fob', {'result': 'negative'}, created_at=today)
+        _add(user_id, 'fob', {'result': 'negative'}, created_at=today - timedelta(days=40))
+
+        stats = get_stats(user_id, days=30, today=today.date())
+
+        assert stats['total'] == 2
+        assert len(stats['daily']) == 1
+
+
+class TestStatsEndpoint:
+    """Test /stats"""
+
+    def test_requires_auth(self, client):
+        assert client.get('/stats').status_code == 401
+
+    def test_user_and_global_rollups(self, client, auth_headers, app):
+        with app.app_context():
+            user = User.query.filter_by(email='test@example.com').first()
+            other = User(username='other', email='other@example.com')
+            other.set_password('password123')
+            db.session.add(other)
+            db.session.commit()
+            _add(user.id, 'fob', {'result': 'positive'})
+            _add(other.id, 'ph', {'estimated_ph': 4.0})
+
+        data = client.get('/stats?days=7', headers=auth_headers).get_json()
+
+        assert data['days'] == 7
+        assert data['user']['total'] == 1
+        assert data['user']['abnormal'] == 1
+        assert data['global']['total'] == 2
+        assert set(data['global']['by_test_type']) == {'fob', 'ph'}
+
+    def test_delete_account_drops_user_rows(self, client, auth_headers, app):
+        with app.app_context():
+            user_id = User.query.filter_by(email='test@example.com').first().id
+            _add(user_id, 'fob', {'result': 'negative'})
+
+        client.delete('/delete-account', headers=auth_headers)
+
+        with app.app_context():
+            assert AnalysisSummary.query.filter_by(user_id=user_id).count() == 0
+            assert get_stats(GLOBAL_SUMMARY_USER)['total'] == 1
@@ -0,0 +1,166 @@
+"""
+Test video-file analysis frame gating and aggregation
+"""
+import cv2
+import numpy as np
+import pytest
+from video_analysis import analyze_video, aggregate_frame_results
+
+
+def _scene(seed):
+    """Sharp, mid-brightness 320x240 frame made of random 16px blocks"""
+    rng = np.random.RandomState(seed)
+    blocks = rng.randint(40, 215, (15, 20, 3)).astype(np.uint8)
+    return cv2.resize(blocks, (320, 240), interpolation=cv2.INTER_NEAREST)
+
+
+def _write_video(tmp_path, seeds):
+    """Write a 10 fps MJPG video with one frame per scene seed"""
+    path = str(tmp_path / "strip.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 10.0, (320, 240))
+    if not writer.isOpened():
+        pytest.skip("MJPG video writer not available")
+    for seed in seeds:
+        writer.write(_scene(seed))
+    writer.release()
+    return path
+
+
+class _NoFrameCount(cv2.VideoCapture):
+    """VideoCapture whose container reports no frame count or fps, like some WebM files"""
+
+    def get(self, prop):
+        if prop in (cv2.CAP_PROP_FRAME_COUNT, cv2.CAP_PROP_FPS):
+            return 0.0
+        return super().get(prop)
+
+
+@pytest.fixture
+def two_scene_video(tmp_path):
+    """Write a 10 fps MJPG video: 10 frames of one scene, then 10 of another"""
+    return _write_video(tmp_path, [1] * 10 + [2] * 10)
+
+
+class TestAnalyzeVideo:
+    """Test frame sampling and gating"""
+
+    def test_only_scene_changes_are_analyzed(self, two_scene_video):
+        """Test identical consecutive frames reuse the previous analysis"""
+        calls = []
+
+        def fake_analyzer(frame):
+            calls.append(frame.shape)
+            return "positive"
+
+        result = analyze_video(two_scene_video, "fob", sample_fps=10.0, analyze_frame=fake_analyzer,
+                               min_stable_frames=1)
+
+        assert result["success"]
+        assert result["result"] == "positive"
+        assert result["stability_score"] == 1.0
+        assert len(calls) == 2
+        assert result["frames"]["analyzed"] == 2
+        assert result["frames"]["skipped_unchanged"] > 0
+
+    def test_sample_fps_skips_frames(self, two_scene_video):
+        """Test frames between samples are grabbed but not decoded"""
+        result = analyze_video(two_scene_video, "fob", sample_fps=2.0, analyze_frame=lambda f: "negative")
+
+        assert result["frames"]["decoded"] == 20
+        assert result["frames"]["sampled"] == 4
+
+    def test_no_readable_frame_is_error(self, two_scene_video):
+        """Test a video where every analysis fails reports an error"""
+        result = analyze_video(two_scene_video, "fob", sample_fps=10.0, analyze_frame=lambda f: None,
+                               min_stable_frames=1)
+
+        assert not result["success"]
+        assert result["frames"]["failed"] == 2
+
+    def test_static_clip_is_read_several_times(self, tmp_path):
+        """Test an unchanging clip is analyzed up to the stable minimum"""
+        path = _write_video(tmp_path, [1] * 10)
+
+        result = analyze_video(path, "fob", sample_fps=10.0, analyze_frame=lambda f: "negative")
+
+        assert result["frames"]["analyzed"] == 3
+        assert result["stable"]
+        assert result["stability_score"] == 1.0
+
+    def test_too_few_reads_are_not_stable(self, tmp_path):
+        """Test a single successful read does not score as perfectly stable"""
+        path = _write_video(tmp_path, [1] * 3)
+
+        result = analyze_video(path, "fob", sample_fps=10.0, analyze_frame=lambda f: "negative")
+
+        assert result["success"]
+        assert result["frames"]["analyzed"] == 2
+        assert not result["stable"]
+        assert result["stability_score"] == pytest.approx(2 / 3.0, abs=1e-3)
+
+    def test_long_video_is_refused_up_front(self, two_scene_video):
+        """Test the container's duration is checked before decoding"""
+        result = analyze_video(two_scene_video, "fob", max_seconds=1.0, analyze_frame=lambda f: "negative")
+
+        assert not result["success"]
+        assert result["too_long"]
+        assert result["frames"]["decoded"] == 0
+
+    def test_frames_read_are_capped(self, two_scene_video, monkeypatch):
+        """Test the limit also holds when the container reports no frame count"""
+        monkeypatch.setattr(cv2, 'VideoCapture', _NoFrameCount)
+
+        result = analyze_video(two_scene_video, "fob", max_frames=5, analyze_frame=lambda f: "negative")
+
+        assert result["too_long"]
+        assert result["frames"]["decoded"] == 6
+
+    def test_unreadable_video(self, tmp_path):
+        """Test a missing file is reported instead of raising"""
+        result = analyze_video(str(tmp_path / "missing.avi"), "fob")
+
+        assert not result["success"]
+
+    def test_unsupported_test_type(self, two_scene_video):
+        """Test unknown test types are rejected"""
+        result = analyze_video(two_scene_video, "glucose")
+
+        assert not result["success"]
+
+
+class TestAnalyzeVideoRoute:
+    """Test the /analyze-video endpoint"""
+
+    def test_too_long_is_422(self, app, client, two_scene_video, monkeypatch):
+        monkeypatch.setitem(app.config, 'VIDEO_MAX_SECONDS', 1.0)
+        with open(two_scene_video, 'rb') as f:
+            response = client.post('/analyze-video', data={'test_type': 'fob', 'video': (f, 'strip.avi')},
+                                   content_type='multipart/form-data')
+
+        assert response.status_code == 422
+        assert 'too long' in response.get_json()['error']
+
+
+class TestAggregateFrameResults:
+    """Test combining per-frame results"""
+
+    def test_majority_vote(self):
+        """Test scalar results are decided by majority"""
+        result, score = aggregate_frame_results(["positive", "positive", "negative", "positive"])
+
+        assert result == "positive"
+        assert score == pytest.approx(0.75)
+
+    def test_per_pad_vote(self):
+        """Test urinalysis results are voted pad by pad"""
+        frames = [{"GLU": "Negative", "PRO": "Trace"},
+                  {"GLU": "Negative", "PRO": "30"},
+                  {"GLU": "Negative", "PRO": "Trace"}]
+        result, score = aggregate_frame_results(frames)
+
+        assert result == {"GLU": "Negative", "PRO": "Trace"}
+        assert score == pytest.approx((1.0 + 2 / 3.0) / 2)
+
+    def test_empty(self):
+        """Test no results gives no answer"""
+        assert aggregate_frame_results([]) == (None, 0.0)
@@ -2,12 +2,21 @@ import cv2
 import numpy as np
 import os
 import logging
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Dict, List, Tuple, Optional, Any, Sequence
 from collections import Counter
+from imaging import (FrameContext, ImageSource, Rendition, WorkingImage, box_kernel, describe_source, load_image,
+                     primary_rendition, save_renditions, source_basename)
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
+# Frame width (px) that pad detection is tuned for. Images are normalized to this
+# width before rotation and detection; pad colours are sampled from the full image.
+WORKING_WIDTH = 800
+
+# Pad mask opening kernel, shared by every call
+PAD_KERNEL = box_kernel(5)
+
 # Reference HSV data for urinalysis tests
 urinalysis_refs = {
     "BLO": {
@@ -174,10 +183,11 @@ class UrinalysisAnalyzer:
         
         return distance
     
-    def find_best_match_knn(self, test_hsv: List[int], test_code: str) -> Tuple[str, float, str]:
-        """KNN-based matching with voting"""
+    def find_best_match_knn(self, test_hsv: List[int], test_code: str,
+                            explain: bool = True) -> Tuple[str, float, Optional[str]]:
+        """KNN-based matching with voting; the explanation is only formatted (else None) when ``explain``"""
         if test_code not in self.reference_data:
-            return "Unknown", 0.0, "Test code not found in reference data."
+            return "Unknown", 0.0, "Test code not found in reference data." if explain else None
         
         ref_data = self.reference_data[test_code]
         blood_type = None
@@ -225,24 +235,10 @@ class UrinalysisAnalyzer:
             distance_confidence = max(0, 100 - (avg_distance / 150.0 * 100))
             final_confidence = min(100, distance_confidence + consensus_bonus)
             
-            # Build explanation
-            explanation_parts = []
-            
-            if test_code == 'BLO':
-                explanation_parts.append(f"Classified as {blood_type} (Hue={test_hsv[0]:.1f})")
-            
-            # List the K nearest neighbors
-            neighbor_list = ", ".join([f"{val}({dist:.1f})" for dist, val in nearest_neighbors])
-            explanation_parts.append(f"K={k_actual} nearest: {neighbor_list}")
-            
-            # Voting result
-            winner_votes = vote_counts.most_common(1)[0][1]
-            if winner_votes == k_actual:
-                explanation_parts.append(f"Unanimous vote for '{best_result}'")
-            else:
-                explanation_parts.append(f"Won by {winner_votes}/{k_actual} votes")
-            
-            explanation = " | ".join(explanation_parts)
+            explanation = None
+            if explain:
+                winner_votes = vote_counts.most_common(1)[0][1]
+                explanation = self._explain(test_hsv, blood_type, nearest_neighbors, best_result, winner_votes)
             
             # Add blood type indicator to result if BLO test
             if test_code == 'BLO':
@@ -250,10 +246,31 @@ class UrinalysisAnalyzer:
             
             return best_result, round(final_confidence, 1), explanation
         else:
-            return "Unknown", 0.0, "No valid neighbors found."
+            return "Unknown", 0.0, "No valid neighbors found." if explain else None
     
-    def analyze_pads(self, pad_hsv_dict: Dict[str, List[int]]) -> Dict[str, Dict]:
-        """Analyze pads with KNN"""
+    @staticmethod
+    def _explain(test_hsv, blood_type, nearest_neighbors, best_result, winner_votes) -> str:
+        """Human-readable account of a KNN vote"""
+        explanation_parts = []
+        
+        if blood_type:
+            explanation_parts.append(f"Classified as {blood_type} (Hue={test_hsv[0]:.1f})")
+        
+        # List the K nearest neighbors
+        k_actual = len(nearest_neighbors)
+        neighbor_list = ", ".join([f"{val}({dist:.1f})" for dist, val in nearest_neighbors])
+        explanation_parts.append(f"K={k_actual} nearest: {neighbor_list}")
+        
+        # Voting result
+        if winner_votes == k_actual:
+            explanation_parts.append(f"Unanimous vote for '{best_result}'")
+        else:
+            explanation_parts.append(f"Won by {winner_votes}/{k_actual} votes")
+        
+        return " | ".join(explanation_parts)
+    
+    def analyze_pads(self, pad_hsv_dict: Dict[str, List[int]], explain: bool = True) -> Dict[str, Dict]:
+        """Analyze pads with KNN; without ``explain`` the results carry no 'explanation'"""
         results = {}
         pad_keys = sorted(pad_hsv_dict.keys(), key=lambda x: int(x.split('_')[1]))
         
@@ -264,57 +281,78 @@ class UrinalysisAnalyzer:
             test_code = self.test_order[i]
             test_hsv = pad_hsv_dict[pad_key]
             
-            result, confidence, explanation = self.find_best_match_knn(test_hsv, test_code)
+            result, confidence, explanation = self.find_best_match_knn(test_hsv, test_code, explain)
             
             results[test_code] = {
                 'test_name': self.test_names.get(test_code, test_code),
                 'result': result,
                 'confidence': confidence,
-                'hsv': test_hsv,
-                'explanation': explanation
+                'hsv': test_hsv
             }
+            if explain:
+                results[test_code]['explanation'] = explanation
         
         return results
 
 
-def detect_pads(image_path, center_window=10, swatch_margin=100, expected_pads=10):
+def estimate_tilt(frame: FrameContext) -> Optional[float]:
+    """
+    Strip tilt in degrees from the largest edge contour, or None without edges.
+
+    minAreaRect reports angles in (-90, 0] before OpenCV 4.5.1 and in
+    [0, 90) since; both are folded into [-45, 45] so a strip that is
+    already upright is never turned on its side.
+    """
+    edges = frame.canny(50, 150, blur_ksize=5)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    angle = cv2.minAreaRect(max(contours, key=cv2.contourArea))[-1]
+    if angle < -45:
+        angle += 90
+    elif angle > 45:
+        angle -= 90
+    return angle
+
+
+def detect_pads(image_path, center_window=10, swatch_margin=100, expected_pads=10, draw=True):
     """
     Detect individual urinalysis test pads, extract HSV values from centers,
     correct slight tilt automatically, fill in missing pads if some are missed,
     and visualize with colored swatches.
+
+    With ``draw=False`` no visualization canvas is allocated and the
+    returned display and mask images are None.
     """
-    # --- Step 1: Load image ---
-    img = cv2.imread(image_path)
+    # --- Step 1: Load image (large JPEGs decode at reduced scale) ---
+    img, _ = load_image(image_path, min_width=WORKING_WIDTH)
     if img is None:
-        raise FileNotFoundError(f"Image not found: {image_path}")
+        raise FileNotFoundError(f"Image not found: {describe_source(image_path)}")
 
-    # --- Step 2: Auto-rotate using bounding rectangle angle ---
-    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-    blur = cv2.GaussianBlur(gray, (5, 5), 0)
-    edges = cv2.Canny(blur, 50, 150)
-    contours_edge, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    # --- Step 2: Resize for consistency (before rotation, so warping is cheap) ---
+    work = WorkingImage.fit_width(img, WORKING_WIDTH)
+    img_small = work.image
 
-    img_rotated = img
+    # --- Step 3: Auto-rotate using bounding rectangle angle ---
+    # Estimated on the decoded image: at the working width the largest edge
+    # contour is too coarse and can lock onto an axis-aligned outline
+    angle = estimate_tilt(work.full_context)
+
+    frame = work.context
     rotation_angle = 0
-    if contours_edge:
-        c = max(contours_edge, key=cv2.contourArea)
-        rect = cv2.minAreaRect(c)
-        angle = rect[-1]
-        if angle < -45:
-            angle = 90 + angle
+    M_inv = None
+    if angle is not None:
         rotation_angle = angle
 
-        (h, w) = img.shape[:2]
+        (h, w) = img_small.shape[:2]
         M = cv2.getRotationMatrix2D((w // 2, h // 2), angle, 1.0)
-        img_rotated = cv2.warpAffine(img, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE)
-
-    print(f"🌀 Auto-rotation correction: {rotation_angle:.2f}°")
+        frame = FrameContext(cv2.warpAffine(img_small, M, (w, h), flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE))
+        M_inv = cv2.invertAffineTransform(M)
 
-    # --- Step 3: Resize for consistency ---
-    target_width = 800
-    img_resized = cv2.resize(img_rotated, (target_width, int(img_rotated.shape[0] * target_width / img_rotated.shape[1])))
+    logger.debug("Auto-rotation correction: %.2f°", rotation_angle)
 
-    hsv = cv2.cvtColor(img_resized, cv2.COLOR_BGR2HSV)
+    img_resized = frame.image
+    hsv = frame.hsv
 
     # --- Step 4: Mask for non-white (remove background) ---
     lower = np.array([0, 20, 15])
@@ -322,8 +360,7 @@ def detect_pads(image_path, center_window=10, swatch_margin=100, expected_pads=1
     mask = cv2.inRange(hsv, lower, upper)
 
     # Reduced morphology → prevent connecting patches
-    kernel = np.ones((5, 5), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=2)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, PAD_KERNEL, iterations=2)
 
     # --- Step 5: Find contours (candidate pads) ---
     contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -382,32 +419,43 @@ def detect_pads(image_path, center_window=10, swatch_margin=100, expected_pads=1
                 filled_pads.append((avg_x, expected_y - avg_h//2, avg_w, avg_h))
 
         missing_count = expected_pads - num_detected
-        print(f"⚙️ Reconstructed {missing_count} missing pad{'s' if missing_count > 1 else ''} (total now = {expected_pads})")
+        logger.debug("Reconstructed %d missing pad(s) (total now = %d)", missing_count, expected_pads)
         pads = filled_pads
 
     # --- Step 8: Visualization canvas ---
     height, width = img_resized.shape[:2]
-    debug_img = np.zeros((height, width + swatch_margin, 3), dtype=np.uint8)
-    debug_img[:height, :width] = img_resized
+    debug_img = None
+    if draw:
+        debug_img = np.zeros((height, width + swatch_margin, 3), dtype=np.uint8)
+        debug_img[:height, :width] = img_resized
 
-    # --- Step 9: Extract HSV values ---
+    # --- Step 9: Extract HSV values (sampled from the full-resolution image) ---
     pad_hsv_dict = {}
+    full_h, full_w = img.shape[:2]
+    half_win = max(1, work.to_full_length(center_window // 2))
 
     for i, (x, y, w, h) in enumerate(pads):
         x_center = x + w // 2
         y_center = y + h // 2
 
-        half_win = center_window // 2
-        y0 = max(0, y_center - half_win)
-        y1 = min(hsv.shape[0], y_center + half_win + 1)
-        x0 = max(0, x_center - half_win)
-        x1 = min(hsv.shape[1], x_center + half_win + 1)
+        # Undo the rotation, then the resize, to find the pad centre in the original frame
+        src_x, src_y = x_center, y_center
+        if M_inv is not None:
+            src_x, src_y = M_inv @ np.array([x_center, y_center, 1.0])
+        fx, fy = work.to_full_point((src_x, src_y))
+
+        y0 = min(max(0, fy - half_win), full_h - 1)
+        y1 = max(y0 + 1, min(full_h, fy + half_win + 1))
+        x0 = min(max(0, fx - half_win), full_w - 1)
+        x1 = max(x0 + 1, min(full_w, fx + half_win + 1))
 
-        hsv_patch = hsv[y0:y1, x0:x1]
+        hsv_patch = work.full_context.roi((x0, y0, x1 - x0, y1 - y0)).hsv
         hsv_avg = hsv_patch.mean(axis=(0, 1)).astype(int).tolist()
         pad_hsv_dict[f"Pad_{i+1}"] = hsv_avg
 
         # --- Draw visuals ---
+        if debug_img is None:
+            continue
         # ✅ Better color coding: green = detected, blue = synthesized
         is_detected = i < num_detected or (i in range(len(pads)) and pads[i] in pads[:num_detected])
         color = (0, 255, 0) if is_detected else (255, 0, 0)
@@ -428,7 +476,9 @@ def detect_pads(image_path, center_window=10, swatch_margin=100, expected_pads=1
 
     # --- Step 10: Scale debug image for display ---
     display_height = 800
-    if debug_img.shape[0] > display_height:
+    if debug_img is None:
+        display_img, mask_display = None, None
+    elif debug_img.shape[0] > display_height:
         scale = display_height / debug_img.shape[0]
         display_img = cv2.resize(debug_img, (int(debug_img.shape[1]*scale), display_height))
         mask_display = cv2.resize(mask, (int(mask.shape[1]*scale), display_height))
@@ -442,9 +492,9 @@ def detect_pads(image_path, center_window=10, swatch_margin=100, expected_pads=1
     # Validate HSV values
     for pad_name, hsv_vals in pad_hsv_dict.items():
         if hsv_vals[2] < 30:  # Very dark
-            print(f"⚠️ WARNING: {pad_name} is very dark (V={hsv_vals[2]}). Poor lighting?")
+            logger.warning("%s is very dark (V=%s). Poor lighting?", pad_name, hsv_vals[2])
         if hsv_vals[1] < 10 and hsv_vals[2] > 200:  # Nearly white
-            print(f"⚠️ WARNING: {pad_name} appears to be background (S={hsv_vals[1]}, V={hsv_vals[2]})")
+            logger.warning("%s appears to be background (S=%s, V=%s)", pad_name, hsv_vals[1], hsv_vals[2])
 
     return pads, pad_hsv_dict, display_img, mask_display
 
@@ -490,8 +540,10 @@ def create_results_visualization(debug_img: np.ndarray, results: Dict) -> np.nda
     return final_img
 
 
-def analyze_urinalysis(image_path: str, debug: bool = False, result_folder: str = "result_images", 
-                       analysis_id: Optional[str] = None, k: int = 3) -> Dict[str, Any]:
+def analyze_urinalysis(image_path: ImageSource, debug: bool = False, result_folder: str = "result_images", 
+                       analysis_id: Optional[str] = None, k: int = 3,
+                       renditions: Optional[Sequence[Rendition]] = None, encoder=None,
+                       explain: bool = True) -> Dict[str, Any]:
     """
     Analyze urinalysis test strip using KNN-based color matching.
     
@@ -500,11 +552,17 @@ def analyze_urinalysis(image_path: str, debug: bool = False, result_folder: str
     and generating diagnostic results for 10 medical parameters.
     
     Args:
-        image_path: Path to the urinalysis test strip image
+        image_path: Path to the urinalysis test strip image, or a decoded BGR frame
         debug: Enable debug mode with console output (default: False)
         result_folder: Directory to save result images (default: "result_images")
         analysis_id: Unique identifier for this analysis (auto-generated if None)
         k: Number of neighbors for KNN algorithm (default: 3)
+        renditions: Sizes/encoders the result image is saved in
+            (imaging.DEFAULT_RENDITIONS if None)
+        encoder: result_encoder.ResultEncoder that writes the renditions in
+            the background (default: written before returning)
+        explain: Format a per-pad 'explanation' of the KNN vote (default: True);
+            skip it when the caller does not return explanations
         
     Returns:
         Dictionary with analysis results:
@@ -514,6 +572,7 @@ def analyze_urinalysis(image_path: str, debug: bool = False, result_folder: str
         - results (Dict): Test results for BLO, BIL, URO, KET, PRO, NIT, GLU, pH, SG, LEU
         - pads_detected (int): Number of pads detected
         - result_images (List[str]): Paths to result visualization images
+        - result_renditions (Dict[str, str]): Rendition name -> image path
         - message (str): Summary message
         
     Example:
@@ -522,21 +581,23 @@ def analyze_urinalysis(image_path: str, debug: bool = False, result_folder: str
         ...     print(f"Detected {result['pads_detected']} pads")
     """
     try:
-        logger.info(f"Starting urinalysis analysis: {image_path}")
+        logger.debug("Starting urinalysis analysis: %s", describe_source(image_path))
         
         # Detect pads and extract HSV
+        # The visualization canvas is only built when the result image is saved
         pads, hsv_dict, debug_img, mask_img = detect_pads(
             image_path,
             center_window=10,
             swatch_margin=150,
-            expected_pads=10
+            expected_pads=10,
+            draw=bool(result_folder)
         )
         
-        logger.info(f"Detected {len(pads)} pads")
+        logger.debug("Detected %d pads", len(pads))
         
         # Analyze with KNN
         analyzer = UrinalysisAnalyzer(k=k)
-        results = analyzer.analyze_pads(hsv_dict)
+        results = analyzer.analyze_pads(hsv_dict, explain=explain)
         
         # Log results
         if debug:
@@ -549,24 +610,21 @@ def analyze_urinalysis(image_path: str, debug: bool = False, result_folder: str
                     conf_icon = "✅" if data['confidence'] >= 70 else "⚠️" if data['confidence'] >= 50 else "❌"
                     logger.info(f"{data['test_name']}: {data['result']} | {data['confidence']:.1f}% {conf_icon}")
         
-        # Create visualization
-        final_visualization = create_results_visualization(debug_img, results)
-        
         # Save result images
         result_images = []
+        result_renditions = {}
         if result_folder:
-            os.makedirs(result_folder, exist_ok=True)
-            
+            final_visualization = create_results_visualization(debug_img, results)
             if analysis_id:
                 filename = f"{analysis_id}_urinalysis_result.jpg"
             else:
-                base_name = os.path.splitext(os.path.basename(image_path))[0]
-                filename = f"{base_name}_urinalysis_result.jpg"
+                filename = f"{source_basename(image_path)}_urinalysis_result.jpg"
             
-            output_path = os.path.join(result_folder, filename)
-            cv2.imwrite(output_path, final_visualization)
+            result_renditions = save_renditions(final_visualization, result_folder, filename, renditions,
+                                                encoder)
+            output_path = primary_rendition(result_renditions)
             result_images.append(output_path)
-            logger.info(f"Result saved to: {output_path}")
+            logger.debug("Result saved to: %s", output_path)
         
         # Format results for Flask response
         test_results = {}
@@ -574,9 +632,10 @@ def analyze_urinalysis(image_path: str, debug: bool = False, result_folder: str
             test_results[test_code] = {
                 'test_name': data['test_name'],  # Changed from 'name' to 'test_name' for consistency
                 'result': data['result'],
-                'confidence': data['confidence'] / 100.0,  # Convert to 0-1 range for frontend
-                'explanation': data['explanation']
+                'confidence': data['confidence'] / 100.0  # Convert to 0-1 range for frontend
             }
+            if explain:
+                test_results[test_code]['explanation'] = data['explanation']
         
         return {
             "success": True,
@@ -585,6 +644,7 @@ def analyze_urinalysis(image_path: str, debug: bool = False, result_folder: str
             "results": test_results,
             "pads_detected": len(pads),
             "result_images": result_images,
+            "result_renditions": result_renditions,
             "message": "Urinalysis strip analyzed successfully"
         }
         
@@ -6,24 +6,77 @@ import cv2
 import numpy as np
 import os
 import re
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Dict
 import logging
+from imaging import read_image_header, load_image
 
 logger = logging.getLogger(__name__)
 
+# Upload limits checked from the file header, before any pixel decode
+MIN_IMAGE_DIM = 100
+MAX_IMAGE_DIM = 5000
+# Formats OpenCV can decode (Pillow format names)
+SUPPORTED_IMAGE_FORMATS = {'JPEG', 'MPO', 'PNG', 'BMP', 'WEBP', 'TIFF'}
+
+# Quality metrics are computed on a thumbnail of this long side
+QUALITY_THUMBNAIL_DIM = 256
+MIN_BRIGHTNESS = 20
+MAX_BRIGHTNESS = 235
+MIN_CONTRAST = 5
+MIN_SHARPNESS = 10.0  # Laplacian variance on the thumbnail
+MAX_GLARE_FRACTION = 0.25  # share of near-saturated thumbnail pixels
+GLARE_LEVEL = 250
+
 class ImageValidationError(Exception):
     """Custom exception for image validation errors"""
     pass
 
+def compute_quality_metrics(image: np.ndarray) -> Dict[str, float]:
+    """
+    Compute brightness, contrast, sharpness and glare for a (thumbnail) image.
+    
+    Args:
+        image: BGR or grayscale image, ideally already thumbnail-sized
+        
+    Returns:
+        Dictionary with brightness (mean), contrast (std dev), sharpness
+        (Laplacian variance) and glare (fraction of near-saturated pixels)
+    """
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    mean, std = cv2.meanStdDev(gray)
+    _, lap_std = cv2.meanStdDev(cv2.Laplacian(gray, cv2.CV_16S))
+    glare_pixels = cv2.countNonZero(cv2.compare(gray, GLARE_LEVEL, cv2.CMP_GE))
+    
+    return {
+        "brightness": float(mean[0][0]),
+        "contrast": float(std[0][0]),
+        "sharpness": float(lap_std[0][0]) ** 2,
+        "glare": glare_pixels / float(gray.size)
+    }
+
+def _make_thumbnail(img: np.ndarray, max_dim: int = QUALITY_THUMBNAIL_DIM) -> np.ndarray:
+    """Shrink an image to at most max_dim pixels on its long side"""
+    height, width = img.shape[:2]
+    scale = max_dim / float(max(height, width))
+    if scale < 1.0:
+        size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+        img = cv2.resize(img, size, interpolation=cv2.INTER_AREA)
+    return img
+
 def validate_image_quality(image_path: str) -> Tuple[bool, Optional[str]]:
     """
     Validate image quality for medical test analysis.
     
+    Format and dimensions are checked from the file header, so oversize or
+    unsupported uploads are rejected before any pixels are decoded. The
+    remaining checks run on a small thumbnail.
+    
     Checks for:
     - Valid image file
+    - Minimum and maximum resolution
     - Appropriate brightness levels
-    - Minimum resolution
-    - Valid color channels
+    - Contrast (blank or corrupted images)
+    - Blur and glare
     
     Args:
         image_path: Path to the image file
@@ -39,50 +92,74 @@ def validate_image_quality(image_path: str) -> Tuple[bool, Optional[str]]:
         ...     print(f"Validation failed: {error}")
     """
     try:
+        invalid_format = "Invalid image file format. Please upload a valid image (PNG, JPG, JPEG)"
+        
         # Check if file exists
         if not os.path.exists(image_path):
             return False, "Image file not found"
         
-        # Try to read the image
-        img = cv2.imread(image_path)
-        if img is None:
-            return False, "Invalid image file format. Please upload a valid image (PNG, JPG, JPEG)"
+        # Check format and dimensions from the header alone
+        header = read_image_header(image_path)
+        if header is not None:
+            if header.format not in SUPPORTED_IMAGE_FORMATS:
+                return False, invalid_format
+            width, height = header.width, header.height
+            size_error = _check_dimensions(width, height)
+            if size_error:
+                return False, size_error
         
-        # Check image dimensions
-        height, width = img.shape[:2]
-        if height < 100 or width < 100:
-            return False, f"Image too small ({width}x{height}). Minimum size is 100x100 pixels"
+        # Decode only as much as the thumbnail needs (full decode if the header was unreadable)
+        img, _ = load_image(image_path, min_dim=QUALITY_THUMBNAIL_DIM if header else None)
+        if img is None:
+            return False, invalid_format
         
-        # Check if image is too large (memory concerns)
-        if height > 5000 or width > 5000:
-            return False, f"Image too large ({width}x{height}). Maximum size is 5000x5000 pixels"
+        if header is None:
+            height, width = img.shape[:2]
+            size_error = _check_dimensions(width, height)
+            if size_error:
+                return False, size_error
         
-        # Check brightness levels
-        if len(img.shape) == 3:
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        else:
-            gray = img
-            
-        avg_brightness = np.mean(gray)
+        thumb = _make_thumbnail(img)
+        del img
+        metrics = compute_quality_metrics(thumb)
         
-        if avg_brightness < 20:
+        if metrics["brightness"] < MIN_BRIGHTNESS:
             return False, "Image is too dark. Please use better lighting or adjust camera settings"
         
-        if avg_brightness > 235:
+        if metrics["brightness"] > MAX_BRIGHTNESS:
             return False, "Image is too bright (overexposed). Please reduce lighting or adjust camera settings"
         
         # Check for completely uniform images (likely corrupted)
-        std_dev = np.std(gray)
-        if std_dev < 5:
+        if metrics["contrast"] < MIN_CONTRAST:
             return False, "Image appears to be blank or corrupted. Please upload a clear photo of the test strip"
         
-        logger.info(f"Image validation passed: {width}x{height}, brightness={avg_brightness:.1f}, std={std_dev:.1f}")
+        if metrics["sharpness"] < MIN_SHARPNESS:
+            return False, "Image is too blurry. Please hold the camera steady and make sure the strip is in focus"
+        
+        if metrics["glare"] > MAX_GLARE_FRACTION:
+            return False, "Image has strong glare. Please avoid direct light reflecting off the test strip"
+        
+        logger.info(
+            f"Image validation passed: {width}x{height}, brightness={metrics['brightness']:.1f}, "
+            f"std={metrics['contrast']:.1f}, sharpness={metrics['sharpness']:.1f}, glare={metrics['glare']:.3f}"
+        )
         return True, None
         
     except Exception as e:
         logger.error(f"Error during image validation: {str(e)}")
         return False, f"Error validating image: {str(e)}"
 
+def _check_dimensions(width: int, height: int) -> Optional[str]:
+    """Return an error message if the image size is outside the accepted range"""
+    if height < MIN_IMAGE_DIM or width < MIN_IMAGE_DIM:
+        return f"Image too small ({width}x{height}). Minimum size is {MIN_IMAGE_DIM}x{MIN_IMAGE_DIM} pixels"
+    
+    # Check if image is too large (memory concerns)
+    if height > MAX_IMAGE_DIM or width > MAX_IMAGE_DIM:
+        return f"Image too large ({width}x{height}). Maximum size is {MAX_IMAGE_DIM}x{MAX_IMAGE_DIM} pixels"
+    
+    return None
+
 def validate_file_extension(filename: str, allowed_extensions: set) -> bool:
     """
     Check if file has an allowed extension.
@@ -127,11 +204,15 @@ def get_image_orientation(image_path: str) -> Optional[str]:
         'portrait', 'landscape', or None if error
     """
     try:
-        img = cv2.imread(image_path)
-        if img is None:
-            return None
+        header = read_image_header(image_path)
+        if header is not None:
+            width, height = header.width, header.height
+        else:
+            img = cv2.imread(image_path)
+            if img is None:
+                return None
+            height, width = img.shape[:2]
         
-        height, width = img.shape[:2]
         return 'portrait' if height > width else 'landscape'
     except Exception as e:
         logger.error(f"Error detecting orientation: {str(e)}")
@@ -0,0 +1,302 @@
+"""
+Video-file analysis for rapid test strips
+Decodes frames with cv2.VideoCapture, runs the analyzer only on stable,
+sharp frames that differ from the last analyzed one, and aggregates the
+per-frame results into a single answer with a stability score
+"""
+import cv2
+import numpy as np
+import logging
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from imaging import RoiTracker
+from utils import compute_quality_metrics, MIN_SHARPNESS, MIN_BRIGHTNESS, MAX_BRIGHTNESS
+
+logger = logging.getLogger(__name__)
+
+# Frames are sampled at this rate. Compressed video still has to decode every
+# frame in grab() (later frames depend on it); the skipped ones only save the
+# colour conversion and copy of retrieve() and all of the per-frame gating
+DEFAULT_SAMPLE_FPS = 5.0
+# Frame gating runs on tiny grayscale thumbnails
+QUALITY_THUMBNAIL_DIM = 256
+DIFF_THUMBNAIL_DIM = 64
+# Mean absolute difference (0-255) between consecutive samples below which the camera is "still"
+STABILITY_THRESHOLD = 6.0
+# Mean absolute difference from the last analyzed frame above which the scene counts as changed
+CHANGE_THRESHOLD = 10.0
+# Upper bound on analyzer runs per video
+MAX_ANALYZED_FRAMES = 20
+# Analyzer runs needed before a result counts as stable; until then frames
+# are analyzed even when the scene has not changed, so a static clip gets
+# several independent reads instead of one
+MIN_STABLE_FRAMES = 3
+# Longer videos are refused, both from the container's frame count and fps
+# and while reading (the metadata can be missing or wrong)
+MAX_VIDEO_SECONDS = 60.0
+MAX_VIDEO_FRAMES = 3600
+
+FrameAnalyzer = Callable[[np.ndarray], Optional[Any]]
+
+
+def frame_thumbnails(frame: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return (quality thumbnail, float32 difference thumbnail) for a BGR frame"""
+    h, w = frame.shape[:2]
+    scale = min(1.0, QUALITY_THUMBNAIL_DIM / float(max(h, w)))
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    thumb = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(thumb, cv2.COLOR_BGR2GRAY)
+
+    scale = DIFF_THUMBNAIL_DIM / float(max(size))
+    diff_size = (max(1, int(round(size[0] * scale))), max(1, int(round(size[1] * scale))))
+    diff_thumb = cv2.resize(gray, diff_size, interpolation=cv2.INTER_AREA).astype(np.float32)
+    return gray, diff_thumb
+
+
+def frame_difference(a: Optional[np.ndarray], b: np.ndarray) -> float:
+    """Mean absolute difference between two difference thumbnails"""
+    if a is None or a.shape != b.shape:
+        return float('inf')
+    return float(cv2.norm(a, b, cv2.NORM_L1)) / a.size
+
+
+# ---------------------- Per-test frame analyzers ----------------------
+def _analyze_fob_frame(frame: np.ndarray, tracker: Optional[RoiTracker] = None) -> Optional[str]:
+    from fob_analyzer import analyze_fob
+    result = analyze_fob(frame, result_folder=None, tracker=tracker)
+    if result.get("status") != "ok" or result.get("result") == "invalid":
+        return None
+    return result["result"]
+
+
+def _analyze_ph_frame(frame: np.ndarray, tracker: Optional[RoiTracker] = None) -> Optional[float]:
+    from ph_strip_analyzer import PHStripAnalyzer
+    result = PHStripAnalyzer().analyze_ph_strip(frame, tracker=tracker)
+    if not result.get("success"):
+        return None
+    return result["estimated_ph"]
+
+
+def _analyze_urinalysis_frame(frame: np.ndarray) -> Optional[Dict[str, str]]:
+    from urinalysis_strip_analyzer import analyze_urinalysis
+    result = analyze_urinalysis(frame, result_folder=None, explain=False)
+    if not result.get("success"):
+        return None
+    return {code: data["result"] for code, data in result["results"].items()}
+
+
+FRAME_ANALYZERS: Dict[str, Callable[..., Optional[Any]]] = {
+    "fob": _analyze_fob_frame,
+    "ph": _analyze_ph_frame,
+    "urinalysis": _analyze_urinalysis_frame,
+}
+# Analyzers that accept a RoiTracker to reuse strip geometry between frames
+TRACKED_TEST_TYPES = {"fob", "ph"}
+
+
+def make_frame_analyzer(test_type: str) -> FrameAnalyzer:
+    """
+    Frame analyzer for one video or stream.
+
+    FOB and pH analyzers get their own RoiTracker, so consecutive frames of
+    the same strip skip detection and only re-sample colours.
+    """
+    analyze = FRAME_ANALYZERS[test_type]
+    if test_type not in TRACKED_TEST_TYPES:
+        return analyze
+    tracker = RoiTracker()
+    return lambda frame: analyze(frame, tracker=tracker)
+
+
+# ---------------------- Aggregation ----------------------
+def _majority(values: List[Any]) -> Tuple[Any, float]:
+    """Most common value and the share of votes it received"""
+    winner, votes = Counter(values).most_common(1)[0]
+    return winner, votes / float(len(values))
+
+
+def aggregate_frame_results(values: List[Any]) -> Tuple[Any, float]:
+    """
+    Combine per-frame results into one answer.
+
+    Scalar results (FOB, pH) are decided by majority vote. Per-pad results
+    (urinalysis) are voted pad by pad.
+
+    Returns:
+        Tuple of (result, stability_score) where stability_score is the
+        share of analyzed frames that agree with the result (averaged over
+        pads for urinalysis)
+    """
+    if not values:
+        return None, 0.0
+
+    if isinstance(values[0], dict):
+        result, agreement = {}, []
+        for code in values[0]:
+            winner, share = _majority([v.get(code) for v in values])
+            result[code] = winner
+            agreement.append(share)
+        return result, float(np.mean(agreement)) if agreement else 0.0
+
+    return _majority(values)
+
+
+def _too_long(frames: int, fps: float, max_seconds: float, max_frames: int) -> bool:
+    return frames > max_frames or (fps > 0 and frames / fps > max_seconds)
+
+
+def analyze_video(video_path: str, test_type: str, sample_fps: float = DEFAULT_SAMPLE_FPS,
+                  max_analyzed_frames: int = MAX_ANALYZED_FRAMES,
+                  analyze_frame: Optional[FrameAnalyzer] = None,
+                  min_stable_frames: int = MIN_STABLE_FRAMES,
+                  max_seconds: float = MAX_VIDEO_SECONDS,
+                  max_frames: int = MAX_VIDEO_FRAMES) -> Dict[str, Any]:
+    """
+    Analyze a short video of a test strip.
+
+    Frames are sampled at ``sample_fps``. A sampled frame is analyzed only
+    when it is still (barely differs from the previous sample), sharp and
+    well exposed, and differs from the last analyzed frame, so the number
+    of analyzer runs follows scene changes rather than frame count. The
+    first ``min_stable_frames`` runs skip the scene-change check; a result
+    backed by fewer successful reads is reported with ``stable`` False and
+    a proportionally lower stability score.
+
+    Args:
+        video_path: Path to the video file
+        test_type: 'fob', 'ph' or 'urinalysis'
+        sample_fps: Frames per second to inspect
+        max_analyzed_frames: Stop after this many analyzer runs
+        analyze_frame: Override for the per-frame analyzer (returns None on failure)
+        min_stable_frames: Successful analyzer runs needed for a stable result
+        max_seconds: Refuse videos longer than this
+        max_frames: Refuse videos with more frames than this
+
+    Returns:
+        Dictionary with the aggregated result, stability score and frame
+        counts; unsuccessful with ``too_long`` set when a limit was hit
+    """
+    if analyze_frame is None:
+        if test_type not in FRAME_ANALYZERS:
+            return {"success": False, "status": "error",
+                    "error": f"Unsupported test type: {test_type}"}
+        analyze_frame = make_frame_analyzer(test_type)
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return {"success": False, "status": "error", "error": "Could not open video file"}
+
+    stats = {"decoded": 0, "sampled": 0, "skipped_unstable": 0, "skipped_quality": 0,
+             "skipped_unchanged": 0, "analyzed": 0, "failed": 0}
+    values = []
+
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+        stride = max(1, int(round(fps / sample_fps))) if fps > 0 and sample_fps > 0 else 1
+
+        if _too_long(int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0), fps, max_seconds, max_frames):
+            return _too_long_result(max_seconds, stats)
+
+        previous_thumb = None
+        last_analyzed_thumb = None
+        frame_index = -1
+
+        while stats["analyzed"] < max_analyzed_frames:
+            if not cap.grab():
+                break
+            frame_index += 1
+            stats["decoded"] += 1
+            if _too_long(stats["decoded"], fps, max_seconds, max_frames):
+                return _too_long_result(max_seconds, stats)
+            if frame_index % stride:
+                continue
+
+            ok, frame = cap.retrieve()
+            if not ok or frame is None:
+                continue
+            stats["sampled"] += 1
+
+            gray, diff_thumb = frame_thumbnails(frame)
+            motion = frame_difference(previous_thumb, diff_thumb)
+            previous_thumb = diff_thumb
+
+            # Camera or strip still moving (the first sample has nothing to compare with)
+            if motion > STABILITY_THRESHOLD:
+                stats["skipped_unstable"] += 1
+                continue
+
+            if (stats["analyzed"] >= min_stable_frames
+                    and frame_difference(last_analyzed_thumb, diff_thumb) < CHANGE_THRESHOLD):
+                stats["skipped_unchanged"] += 1
+                continue
+
+            metrics = compute_quality_metrics(gray)
+            if (metrics["sharpness"] < MIN_SHARPNESS
+                    or not MIN_BRIGHTNESS <= metrics["brightness"] <= MAX_BRIGHTNESS):
+                stats["skipped_quality"] += 1
+                continue
+
+            last_analyzed_thumb = diff_thumb
+            stats["analyzed"] += 1
+            try:
+                value = analyze_frame(frame)
+            except Exception as e:
+                logger.warning(f"Frame {frame_index} analysis failed: {str(e)}")
+                value = None
+
+            if value is None:
+                stats["failed"] += 1
+            else:
+                values.append(value)
+    finally:
+        cap.release()
+
+    logger.info(f"Video analysis frame counts: {stats}")
+
+    if not values:
+        return {
+            "success": False,
+            "status": "error",
+            "error": "No stable, readable frame of the test strip was found in the video",
+            "frames": stats
+        }
+
+    result, stability_score = aggregate_frame_results(values)
+    stable = len(values) >= min_stable_frames
+    if not stable:
+        stability_score *= len(values) / float(min_stable_frames)
+    return {
+        "success": True,
+        "status": "ok",
+        "type": "video",
+        "test_type": test_type,
+        "result": result,
+        "stability_score": round(stability_score, 3),
+        "stable": stable,
+        "frame_results": values,
+        "frames": stats
+    }
+
+
+def _too_long_result(max_seconds: float, stats: Dict[str, int]) -> Dict[str, Any]:
+    return {
+        "success": False,
+        "status": "error",
+        "too_long": True,
+        "error": f"Video is too long; keep it under {max_seconds:g} seconds",
+        "frames": stats
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Analyze a test strip video")
+    parser.add_argument("video_path")
+    parser.add_argument("test_type", choices=sorted(FRAME_ANALYZERS))
+    parser.add_argument("--sample-fps", type=float, default=DEFAULT_SAMPLE_FPS)
+    args = parser.parse_args()
+
+    print(json.dumps(analyze_video(args.video_path, args.test_type, sample_fps=args.sample_fps),
+                     indent=2, default=str))